@@ -104,11 +104,10 @@ PASSWORD = os.environ['DB_PASSWORD']
 HOST = os.environ['HOST']
 PORT = os.environ['PORT']
 
-query_tweets = f"""
-SELECT tweet_created, vader_compound, text_blob_polarity, text_blob_subjectivity, author_id,
-        conversation_id
-FROM preprocessed_tweets_info 
-LEFT OUTER JOIN raw_tweets_info rti ON preprocessed_tweets_info.tweet_id = rti.tweet_id
+query_tweets = """
+SELECT root_account, interval_start, granularity, tweet_count, vader_compound_sum, text_blob_polarity_sum,
+        text_blob_subjectivity_sum
+FROM sentiment_aggregates
 """
 query_btc_daily = """
 SELECT input_date, open_price, high_price, low_price, close_price, adj_close_price, volume FROM btc_daily_info
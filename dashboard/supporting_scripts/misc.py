@@ -1,39 +1,33 @@
+import os
+import sys
 import pandas as pd
 from supporting_scripts.constants import ACCOUNTS, GET_ID, query_tweets, query_btc_daily, query_btc_hourly, USER, \
     DATABASE, HOST, PORT, PASSWORD
-# from ..data_managing.db_handler import retrieve_data
-import psycopg2
 from psycopg2 import DatabaseError
 from sklearn.preprocessing import FunctionTransformer
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.pipeline import Pipeline
 
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)                                                   # repo root, data_managing is a package
+from data_managing.db_pool import ConnectionPool                            # depends only on psycopg2
 
-def create_connection():
-    """Connects to db server"""
-    try:
-        connection = psycopg2.connect(user=USER, database=DATABASE, host=HOST, port=PORT, password=PASSWORD,
-                                      sslmode='require')
-        cursor = connection.cursor()
-    except (Exception, DatabaseError) as err:
-        raise Exception(f'Could not connect to server: {err}')
-    return connection, cursor
+db_pool = ConnectionPool(minconn=1, maxconn=int(os.environ.get('DB_POOL_MAX', 10)), user=USER, database=DATABASE,
+                         host=HOST, port=PORT, password=PASSWORD, sslmode='require')
 
 
 def retrieve_data(query):
     """Retrieves all the data"""
-    connection = None
     rows = None
     try:
-        connection, cursor = create_connection()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                rows = cursor.fetchall()
         print(f'Rows have been retrieved')
     except (Exception, DatabaseError) as err:
         print(f'Failed to retrieve rows. ERROR: {err}')
-    finally:
-        connection.close()
     return rows
 
 
@@ -49,20 +43,34 @@ def to_datetime(dataframe: pd.DataFrame, columns: list):
     return dataframe
 
 
+def aggregate_sentiment(dataframe: pd.DataFrame, granularity: str, period_format: str):
+    """
+    Sums sentiment aggregates of the granularity over the accounts and calculates average sentiment per period
+    :param dataframe: pd.DataFrame, sentiment aggregates, see get_tweets
+    :param granularity: str, 'day' or 'hour'
+    :param period_format: str, strftime format of the period, it is the index named 'tweet_created'
+    :return: pd.DataFrame, with avg_vader_compound, tweet_count, avg_tb_polarity, avg_tb_subjectivity columns
+    """
+    df = dataframe.loc[dataframe['granularity'] == granularity].copy(deep=True)
+    df = dashboard_pipe.fit_transform(df)
+    df = df.groupby([df['interval_start'].dt.strftime(period_format).rename('tweet_created')]
+                    )[['tweet_count', 'vader_compound_sum', 'tb_polarity_sum', 'tb_subjectivity_sum']].sum()
+    return pd.DataFrame({
+        'avg_vader_compound': df['vader_compound_sum'] / df['tweet_count'],
+        'tweet_count': df['tweet_count'],
+        'avg_tb_polarity': df['tb_polarity_sum'] / df['tweet_count'],
+        'avg_tb_subjectivity': df['tb_subjectivity_sum'] / df['tweet_count'],
+    })
+
+
 def tweet_daily_pipe(dataframe):
     """
-    Preprocessing helper function for tweets for daily analysis. Function groups tweets on daily basis and calculates
-    sentiment per period.
+    Preprocessing helper function for tweets for daily analysis. Function sums daily aggregates of the selected accounts
+    and calculates sentiment per period.
     :param dataframe: pd.DataFrame
     :return: pd.DataFrame
     """
-    df = dataframe.copy(deep=True)
-    df = dashboard_pipe.fit_transform(df)
-    df = df.groupby([df['tweet_created'].dt.strftime('%y-%m-%d')]
-                    )[['vader_compound', 'tb_polarity', 'tb_subjectivity']].agg(['mean', 'count'])
-    df.drop([('tb_polarity', 'count'), ('tb_subjectivity', 'count')], axis=1, inplace=True)
-    df.columns = ['avg_vader_compound', 'tweet_count', 'avg_tb_polarity', 'avg_tb_subjectivity']
-    return df
+    return aggregate_sentiment(dataframe, 'day', '%y-%m-%d')
 
 
 def btc_daily_pipe(dataframe: pd.DataFrame):
@@ -104,18 +112,12 @@ def daily_pipe(tweets_daily: pd.DataFrame, btc_daily: pd.DataFrame):
 
 def tweet_hourly_pipe(dataframe: pd.DataFrame):
     """
-    Preprocessing helper function for tweets for hourly analysis. Function groups tweets on hourly basis and calculates
-    sentiment per period.
+    Preprocessing helper function for tweets for hourly analysis. Function sums hourly aggregates of the selected
+    accounts and calculates sentiment per period.
     :param dataframe: pd.DataFrame
     :return: pd.DataFrame
     """
-    df = dataframe.copy(deep=True)
-    df = dashboard_pipe.fit_transform(df)
-    df = df.groupby([df['tweet_created'].dt.strftime('%y-%m-%d-%H')]
-                    )[['vader_compound', 'tb_polarity', 'tb_subjectivity']].agg(['mean', 'count'])
-    df.drop([('tb_polarity', 'count'), ('tb_subjectivity', 'count')], axis=1, inplace=True)
-    df.columns = ['avg_vader_compound', 'tweet_count', 'avg_tb_polarity', 'avg_tb_subjectivity']
-    return df
+    return aggregate_sentiment(dataframe, 'hour', '%y-%m-%d-%H')
 
 
 def btc_hourly_pipe(dataframe):
@@ -159,19 +161,19 @@ def hourly_pipe(tweets_hourly, btc_hourly):
 
 
 dashboard_pipe = Pipeline(steps=[
-    ('to_datetime', FunctionTransformer(func=to_datetime, kw_args={'columns': ['tweet_created']}))
+    ('to_datetime', FunctionTransformer(func=to_datetime, kw_args={'columns': ['interval_start']}))
 ])
 
 
 def get_tweets():
     """
-    Retrieves analyzed tweets with their date, author and conversation_ids from 'raw_tweets_info',
-    'preprocessed_tweets_info' databases.
+    Retrieves hourly and daily sentiment aggregates of the analyzed tweets per conversation root account from the
+    'sentiment_aggregates' table, which is maintained as tweets are preprocessed.
     :return: pd.DatFrame
     """
     return pd.DataFrame(retrieve_data(query=query_tweets),
-                        columns=['tweet_created', 'vader_compound', 'tb_polarity',
-                                 'tb_subjectivity', 'author_id', 'conversation_id'])
+                        columns=['root_account', 'interval_start', 'granularity', 'tweet_count', 'vader_compound_sum',
+                                 'tb_polarity_sum', 'tb_subjectivity_sum'])
 
 
 def get_daily_btc():
@@ -200,10 +202,9 @@ def query_df(dataframe: pd.DataFrame, author_ids: list):
     selected sources.
     :param dataframe: pd.DataFrame, to be queried
     :param author_ids: list, of Author IDs that are selected
-    :return: pd.DataFrame, of all the related conversations to the selected Authors' IDs
+    :return: pd.DataFrame, aggregates of the conversations started by the selected Authors' IDs
     """
-    valid_conversations = dataframe.loc[dataframe['author_id'].isin(author_ids)]['conversation_id']
-    return dataframe.loc[dataframe['conversation_id'].isin(valid_conversations)]
+    return dataframe.loc[dataframe['root_account'].isin(author_ids)]
 
 
 def get_dataframes():
@@ -39,7 +39,7 @@ def serialization_routine():
     Function that is scheduled to run hourly. It serializes database with tweets abd BTC on hourly basis and does some
     computations in advance which are also serialized to speed up site speed.
         Serializes:
-            - data_tweets: pd.DataFrame, (note: very large and constantly growing)
+            - data_tweets: pd.DataFrame, sentiment aggregates per account, hour and day
             - btc_daily: pd.DataFrame, bitcoin daily stats
             - btc_hourly: pd.DataFrame, bitcoin hourly stats
             - indices_mapping_d: dict, (note: takes some time to calculate that is why it is serialized hourly)
@@ -0,0 +1,162 @@
+"""
+Historical backfill, e.g. onboarding a new account or recovering from a multi-day outage.
+Usage:
+    python backfill.py 2022-06-01 2022-06-10 [--accounts BitcoinMagazine binance] [--shard-hours 24] [--workers 4]
+                       [--comments]
+"""
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db_handler import retrieve_data, QUERIES
+
+
+class Backfill:
+    """
+    Splits a date range into time-window shards per account and extracts them on a pool of workers. Workers share the
+    extractor's credential pool, so the rate limit budgets still hold, and tweets seen by several shards are merged by
+    the upserts. Finished shards are saved to db, so a stopped backfill skips them when it is started again, and a shard
+    interrupted mid-way continues from its last page.
+    NOTE: user timeline returns only 3200 most recent tweets of the account, and comments could be searched only for
+    the last 7 days, older windows are extracted without comments.
+    Example:
+    ```py
+        backfill = Backfill(tweet_extractor, shard_hours=24, workers=4)
+        backfill.run(datetime(2022, 6, 1), datetime(2022, 6, 10), include_comments=True)
+    ```
+    """
+    SEARCH_LIMIT = timedelta(days=7) - timedelta(minutes=5)                 # search/recent looks back only 7 days
+
+    def __init__(self, extractor, shard_hours=24, workers=4):
+        """
+        Constructor
+        :param extractor: TweetRetriever, its target accounts are backfilled
+        :param shard_hours: int, length of a shard
+        :param workers: int, number of shards extracted at once
+        """
+        self.extractor = extractor
+        self.shard_length = timedelta(hours=shard_hours)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._done = 0
+        self._tweets = 0
+
+    def shards(self, start_time, end_time):
+        """
+        Splits the range into shards
+        :param start_time: datetime.datetime, start of the range
+        :param end_time: datetime.datetime, end of the range
+        :return: list of (shard_start, shard_end) strings in the extractor's date format
+        """
+        shards = []
+        shard_start = start_time
+        while shard_start < end_time:
+            shard_end = min(shard_start + self.shard_length, end_time)
+            shards.append((shard_start.strftime(self.extractor.dateformat_),
+                           shard_end.strftime(self.extractor.dateformat_)))
+            shard_start = shard_end
+        return shards
+
+    @staticmethod
+    def _finished():
+        """Returns (target_key, shard_start, shard_end) of the finished shards"""
+        rows = retrieve_data(QUERIES['backfill_shards']['retrieve_all']) or []
+        return {(target_key, shard_start, shard_end) for target_key, shard_start, shard_end, _ in rows}
+
+    @staticmethod
+    def _interrupted():
+        """
+        Returns {(target_id, shard_start, shard_end): next_token} of the shards interrupted mid-way. Their pagination
+        checkpoints are saved under 'backfill:<id>' keys, so the hourly runs do not resume them as their own windows.
+        """
+        rows = retrieve_data(QUERIES['pagination_checkpoints']['retrieve_all']) or []
+        return {(target_key.split(':', 1)[1], window_start, window_end): next_token
+                for target_key, window_start, window_end, next_token, _ in rows if target_key.startswith('backfill:')}
+
+    def _run_shard(self, target_handle, target_id, shard_start, shard_end, next_token=None, on_conversation=None):
+        """Extracts the shard and marks it finished once its pages are written"""
+        window = {'start_time': shard_start, 'since_id': None, 'known_conversations': []}
+        count = self.extractor._extract_timeline(target_handle, target_id, window, shard_end,
+                                                 on_conversation=on_conversation, next_token=next_token,
+                                                 target_key=f'backfill:{target_id}')
+        self.extractor._write([(QUERIES['backfill_shards']['upsert'],
+                                [(f'account:{target_id}', shard_start, shard_end, count)])])
+        self.extractor._flush()
+        return count
+
+    def _progress(self, count, total, started):
+        """Prints progress and ETA after a finished shard"""
+        with self._lock:
+            self._done += 1
+            self._tweets += count
+            done, tweets = self._done, self._tweets
+        elapsed = time.perf_counter() - started
+        eta = elapsed / done * (total - done)
+        print(f'\nBACKFILL: {done}/{total} shards ({done / total:.0%}), {tweets} tweets, '
+              f'elapsed {timedelta(seconds=int(elapsed))}, ETA {timedelta(seconds=int(eta))}\n')
+
+    def run(self, start_time, end_time, include_comments=False):
+        """
+        Backfills extractor's target accounts within the range
+        :param start_time: datetime.datetime, start of the range
+        :param end_time: datetime.datetime, end of the range
+        :param include_comments: bool, True to extract comments of the tweets within the last 7 days
+        """
+        extractor = self.extractor
+        extractor._reset_counters()
+        extractor.verify_once()
+        finished = self._finished()
+        interrupted = self._interrupted()
+        jobs = []
+        for target_handle, target_id in extractor.resolve_targets():
+            for shard_start, shard_end in self.shards(start_time, end_time):
+                if (f'account:{target_id}', shard_start, shard_end) not in finished:
+                    jobs.append((target_handle, target_id, shard_start, shard_end,
+                                 interrupted.get((str(target_id), shard_start, shard_end))))
+        total = len(jobs)
+        print(f'BACKFILL: {total} shards to extract, {len(finished)} finished before.')
+        self._done = 0
+        self._tweets = 0
+        conversations, collect = extractor._conversation_collector()
+        on_conversation = collect if include_comments else None
+        started = time.perf_counter()
+        extractor._start_pipeline()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self._run_shard, *job, on_conversation=on_conversation): job
+                           for job in jobs}
+                for future in as_completed(futures):
+                    self._progress(future.result(), total, started)
+                extractor._drain()
+                cm_start_time = max(start_time, datetime.now() - self.SEARCH_LIMIT)
+                if include_comments and cm_start_time < end_time:
+                    comment_jobs, planned = extractor._comment_jobs(conversations, cm_start_time, end_time)
+                    print(f'BACKFILL: extracting comments, {len(comment_jobs)} jobs.')
+                    for future in [executor.submit(job, *args) for job, args in comment_jobs]:
+                        future.result()
+                    extractor._drain()
+                    if extractor.crawl_planner is not None:
+                        extractor.crawl_planner.commit(planned, end_time)
+            extractor._report()
+        finally:
+            extractor._stop_pipeline()
+
+
+if __name__ == '__main__':
+    from config import TARGET_ACCOUNTS, HTTP_POOL_SIZE
+    from http_client import HttpClient
+    from manage import build_tweet_extractor
+
+    parser = argparse.ArgumentParser(description='Backfills tweets of the target accounts within the date range.')
+    parser.add_argument('start', type=datetime.fromisoformat, help='start of the range, e.g. 2022-06-01')
+    parser.add_argument('end', type=datetime.fromisoformat, help='end of the range, e.g. 2022-06-10T12:00')
+    parser.add_argument('--accounts', nargs='+', default=TARGET_ACCOUNTS, help='handles, all targets by default')
+    parser.add_argument('--shard-hours', type=int, default=24, help='length of a shard')
+    parser.add_argument('--workers', type=int, default=4, help='number of shards extracted at once')
+    parser.add_argument('--comments', action='store_true', help='extract comments of the last 7 days too')
+    args = parser.parse_args()
+    tweet_extractor = build_tweet_extractor(HttpClient(pool_maxsize=max(HTTP_POOL_SIZE, args.workers)),
+                                            target_accounts=args.accounts)
+    Backfill(tweet_extractor, shard_hours=args.shard_hours, workers=args.workers).run(
+        args.start, args.end, include_comments=args.comments)
@@ -0,0 +1,103 @@
+"""
+Microbenchmark of the page decoding, CPU cost per 100-tweet page.
+    legacy - response.json() in too_many_requests, response_is_empty and parse_response, dict of dicts, tuple(values)
+    single - one parse per response cached on it, rows built directly as namedtuples (orjson if installed)
+Usage:
+    python benchmark_decoding.py [number of pages]
+"""
+import sys
+import json
+import random
+import timeit
+from decoding import decode_page, payload, orjson
+
+
+class _Response:
+    """Stand-in for requests.Response"""
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _fake_page(size=100, users=20):
+    """Body of a timeline/search page with expanded authors"""
+    authors = [str(random.randrange(10 ** 17, 10 ** 18)) for _ in range(users)]
+    data = [{
+        'id': str(random.randrange(10 ** 18, 10 ** 19)),
+        'conversation_id': str(random.randrange(10 ** 18, 10 ** 19)),
+        'author_id': random.choice(authors),
+        'created_at': '2022-07-01T12:00:00.000Z',
+        'text': ' '.join(random.choice(['btc', 'moon', 'hodl', 'bear', 'bull', '#bitcoin', '@cz_binance'])
+                         for _ in range(30)),
+        'public_metrics': {'retweet_count': 3, 'reply_count': 1, 'like_count': 12, 'quote_count': 0},
+    } for _ in range(size)]
+    includes = {'users': [{
+        'id': author,
+        'name': 'name',
+        'created_at': '2015-01-01T00:00:00.000Z',
+        'verified': False,
+        'public_metrics': {'followers_count': 100, 'following_count': 10, 'tweet_count': 1000, 'listed_count': 1},
+    } for author in authors for _ in range(size // users)]}                # authors repeat on the page
+    meta = {'result_count': size, 'next_token': 'b26v89c19zqg8o3fpz2m'}
+    return json.dumps({'data': data, 'includes': includes, 'meta': meta}).encode()
+
+
+def _legacy(response):
+    """Decoding path before the single parse"""
+    if response.status_code == 429 or response.json().get('title') == 'Too Many Requests':
+        return
+    if response.json().get('meta', {}).get('result_count') == 0:
+        return
+    res = response.json()
+    tweets_dict = {}
+    for tweet in res.get('data'):
+        tweets_dict[tweet.get('id')] = {
+            'tweet_created': tweet.get('created_at'),
+            'conversation_id': tweet.get('conversation_id'),
+            'tweet_id': tweet.get('id'),
+            'author_id': tweet.get('author_id'),
+            'text': tweet.get('text'),
+            'retweet_count': tweet.get('public_metrics').get('retweet_count'),
+            'reply_count': tweet.get('public_metrics').get('reply_count'),
+            'like_count': tweet.get('public_metrics').get('like_count'),
+            'quote_count': tweet.get('public_metrics').get('quote_count')
+        }
+    users_dict = {}
+    for user in res.get('includes').get('users'):
+        users_dict[user.get('id')] = {
+            'account_created': user.get('created_at'),
+            'account_id': user.get('id'),
+            'name': user.get('name'),
+            'verified': user.get('verified'),
+            'follower_count': user.get('public_metrics').get('followers_count'),
+            'following_count': user.get('public_metrics').get('following_count'),
+            'tweet_count': user.get('public_metrics').get('tweet_count'),
+            'listed_count': user.get('public_metrics').get('listed_count')
+        }
+    return [tuple(row.values()) for row in tweets_dict.values()], [tuple(row.values()) for row in users_dict.values()]
+
+
+def _single(response):
+    """Current decoding path"""
+    if response.status_code == 429 or payload(response).get('title') == 'Too Many Requests':
+        return
+    if payload(response).get('meta', {}).get('result_count') == 0:
+        return
+    tweets, users, _ = decode_page(payload(response))
+    return tweets, users
+
+
+def main(pages=2000):
+    content = _fake_page()
+    for name, decode in (('legacy', _legacy), ('single', _single)):
+        seconds = min(timeit.repeat(lambda: decode(_Response(content)), number=pages, repeat=5))
+        print(f'{name}: {seconds / pages * 1e6:.0f} us per 100-tweet page')
+    print(f'json parser: {"orjson" if orjson is not None else "json"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,70 @@
+"""
+Benchmark of a full simulated hourly run (tweets, comments, preprocessing, hourly BTC) against the local stub server
+replaying recorded responses. Twitter and CryptoCompare are not contacted. The replayed tweets, checkpoints and reply
+counts are written to a separate scratch database on the server from .env, never to the .env database itself.
+Record responses of a single real run first:
+    RECORD_RESPONSES=hourly_run.jsonl.gz python manage.py
+Usage:
+    python benchmark_extraction.py hourly_run.jsonl.gz --database benchmark [--time-scale 0.01] [--concurrency 4]
+"""
+import os
+import time
+import argparse
+from os.path import join, dirname
+from dotenv import dotenv_values
+
+
+def use_database(database):
+    """
+    Points the db connections of this process to the scratch database, has to be called before config is imported
+    :param database: str, name of the scratch database
+    """
+    configured = os.environ.get('DATABASE') or dotenv_values(join(dirname(__file__), '.env')).get('DATABASE')
+    if not database or database == configured:
+        raise Exception('ERROR: the benchmark needs a scratch database other than the one of .env.')
+    os.environ['DATABASE'] = database                                       # load_dotenv does not override it
+
+
+def main(recording, time_scale=0.01, concurrency=None):
+    from config import CC_API_KEY, HTTP_POOL_SIZE, EXTRACTION_CONCURRENCY
+    from replay import StubApiServer, load_recordings
+    from http_client import HttpClient
+    from rate_limiter import RateLimiter, CRYPTOCOMPARE_LIMITS
+    from data_extraction import TweetRetriever, BtcExtractorCC
+    from manage import build_tweet_extractor, extract_tweets_hourly, extract_btc_hourly
+
+    concurrency = concurrency if concurrency else EXTRACTION_CONCURRENCY
+    stub = StubApiServer(load_recordings(recording), time_scale=time_scale)
+    base_url = stub.start()
+    http_client = HttpClient(pool_maxsize=HTTP_POOL_SIZE)
+    cc_limiter = RateLimiter(CRYPTOCOMPARE_LIMITS)
+    tweet_extractor = build_tweet_extractor(http_client, base_url=base_url)
+    TweetRetriever._VERIFIED = True                                         # no OAuth handshake against the stub
+    hourly_btc_extractor = BtcExtractorCC(CC_API_KEY, rate_limiter=cc_limiter, http_client=http_client,
+                                          base_url=base_url)
+    start = time.perf_counter()
+    try:
+        extract_tweets_hourly(tweet_extractor, concurrency=concurrency)
+        extract_btc_hourly(hourly_btc_extractor)
+    finally:
+        stub.stop()
+    elapsed = time.perf_counter() - start
+    rows = tweet_extractor.write_buffer.stats()['rows']
+    slept = tweet_extractor.credential_pool.slept() + cc_limiter.slept()
+    print(f'\n\nBENCHMARK ({recording}, time scale {time_scale}, concurrency {concurrency})\n'
+          f'ELAPSED: {elapsed:.2f} sec\n'
+          f'REQUESTS: {stub.requests} ({stub.requests / elapsed:.1f}/sec, {stub.misses} not recorded)\n'
+          f'ROWS WRITTEN: {rows} ({rows / elapsed:.1f}/sec)\n'
+          f'SLEPT ON RATE LIMITS: {slept:.2f} sec\n'
+          f'HTTP: {http_client.latency_stats()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated hourly run against recorded responses.')
+    parser.add_argument('recording', help='.jsonl.gz file written by RECORD_RESPONSES')
+    parser.add_argument('--database', required=True, help='scratch database on the .env server, not the .env one')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='multiplier of the rate limit windows')
+    parser.add_argument('--concurrency', type=int, help='1 for the serial mode, EXTRACTION_CONCURRENCY by default')
+    args = parser.parse_args()
+    use_database(args.database)
+    main(args.recording, time_scale=args.time_scale, concurrency=args.concurrency)
@@ -0,0 +1,20 @@
+"""
+Fills hours missing in btc_hourly_info, e.g. after the scheduler was down.
+Usage:
+    python btc_gaps.py [--start 2022-06-01] [--end 2022-06-10T12:00] [--dry-run]
+"""
+import argparse
+from datetime import datetime
+from config import CC_API_KEY, HTTP_POOL_SIZE, CRYPTOCOMPARE_BASE_URL
+from http_client import HttpClient
+from data_extraction import BtcExtractorCC
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds hours missing in btc_hourly_info and fills them in bulk.')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='first hour checked, first hour in db by default')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='last hour checked, last finished hour by default')
+    parser.add_argument('--dry-run', action='store_true', help='only report the gaps')
+    args = parser.parse_args()
+    extractor = BtcExtractorCC(CC_API_KEY, http_client=HttpClient(pool_maxsize=HTTP_POOL_SIZE),
+                               base_url=CRYPTOCOMPARE_BASE_URL)
+    extractor.fill_gaps(args.start, args.end, dry_run=args.dry_run)
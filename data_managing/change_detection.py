@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from db_handler import retrieve_data
+
+
+def fingerprint(values):
+    """
+    Stable 64 bit fingerprint of the values, fits into BIGINT
+    :param values: tuple, column values
+    :return: int
+    """
+    return int.from_bytes(hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class ChangeFilter:
+    """
+    Drops rows that are already in the table with the same values, so unchanged rows are neither sent nor rewritten.
+    Fingerprint of the updatable columns is kept per key in an in-process LRU, backed by the table's row_hash column
+    for the keys the LRU has not seen yet. Fingerprint is appended to the passed rows as the last (row_hash) column.
+    The LRU learns a fingerprint only once its row is written, see commit. Thread-safe.
+    Example:
+    ```py
+        tweets_filter = ChangeFilter('raw_tweets_info', 'tweet_id', key_index=2, value_indices=(5, 6, 7, 8))
+        rows = tweets_filter.filter(tweet_rows)                     # new or changed rows, with row_hash
+        ...                                                         # write rows to db
+        tweets_filter.commit(rows)
+    ```
+    """
+    def __init__(self, table, key_column, key_index, value_indices, capacity=100000):
+        """
+        Constructor
+        :param table: str, table name
+        :param key_column: str, unique column of the table
+        :param key_index: int, index of the key column in the rows
+        :param value_indices: tuple, indices of the columns the upsert updates
+        :param capacity: int, max number of fingerprints kept in memory
+        """
+        self.table = table
+        self.key_column = key_column
+        self.key_index = key_index
+        self.value_indices = value_indices
+        self.capacity = capacity
+        self._cache = OrderedDict()                                         # {key: fingerprint}, least recent first
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def _load(self, keys):
+        """Returns {key: row_hash} of the keys stored in db"""
+        query = f"""
+        SELECT {self.key_column}, row_hash
+        FROM {self.table}
+        WHERE {self.key_column} IN %s AND row_hash IS NOT NULL;
+        """
+        return dict(retrieve_data(query, (tuple(keys),)) or [])
+
+    def _remember(self, key, row_hash):
+        """Puts the fingerprint to the LRU, the lock has to be held"""
+        self._cache[key] = row_hash
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def tag(self, rows):
+        """
+        Appends fingerprints to the rows without filtering them
+        :param rows: list of tuples
+        :return: list of tuples
+        """
+        return [tuple(row) + (fingerprint(tuple(row[i] for i in self.value_indices)),) for row in rows]
+
+    def filter(self, rows):
+        """
+        Returns new and changed rows
+        :param rows: list of tuples
+        :return: list of tuples, rows with their fingerprint appended
+        """
+        tagged = [(row, fingerprint(tuple(row[i] for i in self.value_indices))) for row in rows]
+        with self._lock:
+            known = {}
+            for row, _ in tagged:
+                key = row[self.key_index]
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    known[key] = self._cache[key]
+        missing = {row[self.key_index] for row, _ in tagged} - known.keys()
+        if missing:
+            stored = self._load(missing)
+            with self._lock:
+                for key, row_hash in stored.items():
+                    self._remember(key, row_hash)
+            known.update(stored)
+        changed = [tuple(row) + (row_hash,) for row, row_hash in tagged if known.get(row[self.key_index]) != row_hash]
+        with self._lock:
+            self.skipped += len(rows) - len(changed)
+        return changed
+
+    def commit(self, rows):
+        """
+        Remembers fingerprints of the rows written to db
+        :param rows: list of tuples returned by filter
+        """
+        with self._lock:
+            for row in rows:
+                self._remember(row[self.key_index], row[-1])
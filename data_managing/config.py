@@ -30,5 +30,36 @@ PASSWORD = os.environ['DB_PASSWORD']
 HOST = os.environ['HOST']
 PORT = os.environ['PORT']
 
+# EXTRACTION
+EXTRACTION_CONCURRENCY = int(os.environ.get('EXTRACTION_CONCURRENCY', 1))    # > 1 enables concurrent extraction
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))                  # keep-alive connections per host
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))                         # db connections kept open when idle
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))                        # max open db connections
+BULK_LOAD_ROWS = int(os.environ.get('BULK_LOAD_ROWS', 5000))                # batches this large are COPYed, 0 never
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 1))   # tweet partitions created ahead of time
+TWEETS_RETENTION_MONTHS = int(os.environ.get('TWEETS_RETENTION_MONTHS', 0))  # past months kept in db, 0 to keep all
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')                                 # expired partitions are archived there
+CHECKPOINT_OVERLAP = int(os.environ.get('CHECKPOINT_OVERLAP', 0))           # minutes re-fetched before checkpoint
+BATCH_COMMENTS = os.environ.get('BATCH_COMMENTS', '1') == '1'               # one search query for many conversations
+QUERY_MAX_LENGTH = int(os.environ.get('QUERY_MAX_LENGTH', 512))             # 1024 with Academic Research access
+PLAN_COMMENTS = os.environ.get('PLAN_COMMENTS', '1') == '1'                 # crawl only conversations with new replies
+COMMENT_REQUEST_BUDGET = int(os.environ.get('COMMENT_REQUEST_BUDGET', 0))   # comment requests per run, 0 for unlimited
+HANDLE_TTL = int(os.environ.get('HANDLE_TTL', 7*24))                        # hours before a handle is resolved again
+DB_FLUSH_ROWS = int(os.environ.get('DB_FLUSH_ROWS', 1000))                  # buffered rows written in one transaction
+PIPELINE_DEPTH = int(os.environ.get('PIPELINE_DEPTH', 8))                   # pages queued per stage, 0 to disable
+RECORD_RESPONSES = os.environ.get('RECORD_RESPONSES')                       # .jsonl.gz file a single run is recorded to
+TWITTER_BASE_URL = os.environ.get('TWITTER_BASE_URL', 'https://api.twitter.com')
+CRYPTOCOMPARE_BASE_URL = os.environ.get('CRYPTOCOMPARE_BASE_URL', 'https://min-api.cryptocompare.com')
+METRICS_JSONL = os.environ.get('METRICS_JSONL')                             # run metrics appended as JSON lines
+METRICS_PROM = os.environ.get('METRICS_PROM')                               # run metrics in Prometheus text format
+CHANGE_CACHE_SIZE = int(os.environ.get('CHANGE_CACHE_SIZE', 100000))        # row fingerprints in memory, 0 to disable
+LANDING_ZONE = os.environ.get('LANDING_ZONE')                               # directory raw pages are kept in
+LANDING_CODEC = os.environ.get('LANDING_CODEC')                             # zstd or gzip, zstd if it is installed
+BTC_DAILY_SOURCE = os.environ.get('BTC_DAILY_SOURCE', 'rollup')             # rollup of hourly candles or yahoo
+STREAM_SOURCE = os.environ.get('STREAM_SOURCE')                             # e.g. twitter, None for hourly polling
+STREAM_BATCH_SECONDS = float(os.environ.get('STREAM_BATCH_SECONDS', 5))     # max wait of a streamed tweet
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))           # max tweets in a micro-batch
+ROOT_WAIT_HOURS = int(os.environ.get('ROOT_WAIT_HOURS', 24))                # replies wait that long for their root
+
 TARGET_ACCOUNTS = ['BitcoinMagazine', 'DocumentingBTC', 'BitcoinFear', 'BTC_Archive', 'Bitcoin', 'BT', 'TheCryptoLark',
                    'MartiniGuyYT', 'Sheldon_Sniper', 'binance', 'CoinDesk', 'cz_binance']
@@ -0,0 +1,106 @@
+import math
+import heapq
+from datetime import datetime, timedelta
+from db_handler import insert_to_db, retrieve_data, QUERIES
+
+
+class CommentCrawlPlanner:
+    """
+    Decides which conversations are worth a comment crawl. Last seen reply count of every conversation is stored in db,
+    conversations without new replies since the last crawl are skipped, the rest are crawled in the order of expected
+    new replies (reply count delta) until the per run request budget is spent. Conversations that did not fit into the
+    budget keep their delta and are crawled next run from the start of the window they missed (pending_since), so their
+    replies are not lost, even if they have never been crawled.
+    Example:
+    ```py
+        planner = CommentCrawlPlanner(request_budget=300)
+        plan = planner.plan({'1548...': 12, '1549...': 0}, window_start)      # [(conversation_id, start_time), ...]
+        ...                                                                    # crawl comments
+        planner.commit([conversation_id for conversation_id, _ in plan], window_end)
+    ```
+    """
+    SEARCH_LIMIT = timedelta(days=7)                                        # search/recent looks back only 7 days
+    TOLERANCE = timedelta(minutes=5)                                        # scheduler jitter between runs
+
+    def __init__(self, request_budget=None, page_size=100):
+        """
+        Constructor
+        :param request_budget: int, max number of comment requests per run, None for unlimited
+        :param page_size: int, comments per page
+        """
+        self.request_budget = request_budget
+        self.page_size = page_size
+        self._reply_counts = {}
+        self._pending = {}                                                  # {deferred conversation: row to store}
+        self.skipped = 0                                                    # conversations without new replies
+        self.deferred = 0                                                   # conversations over the budget
+
+    def _load(self, conversation_ids):
+        """
+        Returns {conversation_id: (reply_count, last_crawled, pending_since)} of the conversations crawled or deferred
+        before
+        """
+        if not conversation_ids:
+            return {}
+        query = f"""
+        {QUERIES['conversation_reply_counts']['retrieve_all']}
+        WHERE conversation_id IN %s
+        """
+        rows = retrieve_data(query, (tuple(conversation_ids),)) or []
+        return {conversation_id: (reply_count, last_crawled, pending_since)
+                for conversation_id, reply_count, last_crawled, pending_since in rows}
+
+    def plan(self, reply_counts, window_start):
+        """
+        Plans comment crawl
+        :param reply_counts: dict, {conversation_id: current reply count}
+        :param window_start: datetime.datetime, start of the comment window of this run
+        :return: list of (conversation_id, start_time) in the order of priority
+        """
+        self._reply_counts = reply_counts
+        self._pending = {}
+        self.skipped = 0
+        self.deferred = 0
+        seen = self._load(list(reply_counts))
+        search_limit = datetime.now() - self.SEARCH_LIMIT + self.TOLERANCE
+        queue = []
+        for conversation_id, reply_count in reply_counts.items():
+            last_count, last_crawled, pending_since = seen.get(conversation_id, (0, None, None))
+            delta = (reply_count or 0) - last_count
+            if delta <= 0:
+                self.skipped += 1
+                continue
+            start_time = window_start
+            crawl_from = pending_since if pending_since is not None else last_crawled
+            if crawl_from is not None and crawl_from < window_start - self.TOLERANCE:
+                start_time = max(crawl_from, search_limit)                  # deferred by one of the previous runs
+            heapq.heappush(queue, (-delta, conversation_id, start_time, last_count, last_crawled))
+
+        plan = []
+        budget = self.request_budget
+        while queue:
+            delta, conversation_id, start_time, last_count, last_crawled = heapq.heappop(queue)
+            cost = math.ceil(-delta / self.page_size)
+            if budget is not None:
+                if cost > budget:
+                    self.deferred += 1
+                    self._pending[conversation_id] = (conversation_id, last_count, last_crawled, start_time)
+                    continue
+                budget -= cost
+            plan.append((conversation_id, start_time))
+        print(f'Comment crawl plan: {len(plan)} conversations, {self.skipped} without new replies, '
+              f'{self.deferred} deferred to the next run.')
+        return plan
+
+    def commit(self, conversation_ids, window_end):
+        """
+        Stores reply counts of the crawled conversations, deferred conversations keep their last crawl and the start of
+        the window they are to be crawled from
+        :param conversation_ids: list, crawled conversations
+        :param window_end: datetime.datetime, end of the comment window
+        """
+        rows = [(conversation_id, self._reply_counts[conversation_id], window_end, None)
+                for conversation_id in conversation_ids]
+        rows.extend(self._pending.values())
+        if rows:
+            insert_to_db(rows, query=QUERIES['conversation_reply_counts']['upsert'])
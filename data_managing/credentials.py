@@ -0,0 +1,84 @@
+import threading
+from collections import namedtuple, Counter
+from rate_limiter import RateLimiter, TWITTER_LIMITS
+
+Credentials = namedtuple('Credentials', ['name', 'api_key', 'api_secret_key', 'access_token', 'access_token_secret',
+                                         'bearer_token'])
+
+
+class CredentialPool:
+    """
+    Spreads requests across several Twitter apps. Rate limits are per app, so every token has its own RateLimiter, and
+    each request goes to the token with the most budget left on the endpoint. Once every token is exhausted, the
+    request waits for the token whose window resets first. Thread-safe.
+    Example:
+    ```py
+        pool = CredentialPool([Credentials('pr', API_KEY, ...), Credentials('gc', GC_API_KEY, ...)])
+        token = pool.acquire('search_recent')
+        response = requests.get(..., headers={'Authorization': f'Bearer {token.bearer_token}'})
+        pool.update(token, 'search_recent', response.headers)
+    ```
+    """
+    def __init__(self, credentials, limits=TWITTER_LIMITS, rate_limiters=None):
+        """
+        Constructor
+        :param credentials: list of Credentials, names have to be unique
+        :param limits: dict, {endpoint: (requests per window, window in seconds)} of a single app
+        :param rate_limiters: list of RateLimiter, one per credentials, None to create them from limits
+        """
+        if not credentials:
+            raise Exception('ERROR: credential pool needs at least one set of credentials.')
+        self.credentials = list(credentials)
+        rate_limiters = rate_limiters if rate_limiters else [RateLimiter(limits) for _ in self.credentials]
+        self._limiters = {token.name: limiter for token, limiter in zip(self.credentials, rate_limiters)}
+        self._requests = Counter()
+        self._lock = threading.Lock()
+
+    def add_endpoint(self, endpoint, capacity, period):
+        """Registers a new endpoint budget for every token"""
+        for limiter in self._limiters.values():
+            limiter.add_endpoint(endpoint, capacity, period)
+
+    def acquire(self, endpoint):
+        """
+        Reserves one request on the token with the most headroom, sleeps only if every token is exhausted
+        :param endpoint: str, endpoint name
+        :return: Credentials, token the request has to be sent with
+        """
+        by_headroom = sorted(self.credentials, key=lambda token: -self._limiters[token.name].remaining(endpoint))
+        for token in by_headroom:
+            if self._limiters[token.name].try_acquire(endpoint):
+                break
+        else:
+            token = min(self.credentials, key=lambda token: self._limiters[token.name].reset_in(endpoint))
+            self._limiters[token.name].acquire(endpoint)
+        with self._lock:
+            self._requests[token.name] += 1
+        return token
+
+    def update(self, token, endpoint, headers=None):
+        """Synchronizes token's budget with the response headers, see RateLimiter.update"""
+        self._limiters[token.name].update(endpoint, headers)
+
+    def exhaust(self, token, endpoint, headers=None):
+        """Marks token's budget as exhausted, next requests fail over to the other tokens"""
+        self._limiters[token.name].exhaust(endpoint, headers)
+
+    def slept(self):
+        """Returns seconds spent sleeping on all tokens"""
+        return sum(limiter.slept() for limiter in self._limiters.values())
+
+    def stats(self):
+        """
+        Summary per token
+        :return: dict, {name: {'requests', 'slept'}}
+        """
+        with self._lock:
+            requests = dict(self._requests)
+        return {name: {'requests': requests.get(name, 0), 'slept': limiter.slept()}
+                for name, limiter in self._limiters.items()}
+
+    def reset_stats(self):
+        """Resets request counters"""
+        with self._lock:
+            self._requests.clear()
@@ -1,11 +1,20 @@
-import time
+import math
+import asyncio
+import threading
 import pandas as pd
 import tweepy
-import requests
-from datetime import datetime
-from tweepy.errors import TweepyException, NotFound
-from db_handler import insert_to_db, retrieve_data, QUERIES
-import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from tweepy.errors import TweepyException
+from db_handler import insert_to_db, insert_many_to_db, retrieve_data, execute_query, db_pool, QUERIES
+from rate_limiter import RateLimiter, CRYPTOCOMPARE_LIMITS
+from credentials import Credentials, CredentialPool
+from http_client import BadResponseError, default_client
+from db_writer import DbWriteBuffer
+from pipeline import Pipeline
+from decoding import decode_page, payload
+from telemetry import RunMetrics
+from change_detection import ChangeFilter
 
 
 class TweetRetriever:
@@ -26,18 +35,32 @@ class TweetRetriever:
                                     ACCESS_TOKEN, ACCESS_TOKEN_SECRET,BEARER_TOKEN)
         get_tweets.extract_tweets(tweets_start_time, comments_start_time, end_time,                 # extract tweets
                                     include_comments=True)    # extract tweets
+        # or harvest several accounts/conversations at once, sharing the same request budget
+        get_tweets.extract_tweets_async(tweets_start_time, comments_start_time, end_time,
+                                        include_comments=True, concurrency=4)
         ```
     """
     dateformat_ = '%Y-%m-%dT%H:%M:%SZ'
 
-    REQUEST_LIMIT = 450                                                      # per 15 min
-    _REQUEST_COUNT = 0                                                       # resets to 0 every 450 requests
     _TOTAL_REQUESTS = 0                                                      # total number of requests
     _TWEETS_EXTRACTED = 0                                                    # total number of tweets/comments extracted
     _GRAND_TOTAL = 0                                                         # total number per instance
+    _REQUESTS_SAVED = 0                                                      # timeline requests saved by checkpoints
+    _VERIFIED = False                                                        # credentials are verified once per process
+    _ROW_KEYS = {                                                            # columns identifying rows of the buffer
+        QUERIES['user_info']['upsert']: (1,),                                # account_id
+        QUERIES['raw_tweets_info']['upsert']: (2,),                          # tweet_id
+        QUERIES['conversation_roots']['upsert']: (0,),                       # conversation_id
+        QUERIES['account_checkpoints']['upsert']: (0,),                      # account_id
+        QUERIES['pagination_checkpoints']['upsert']: (0, 1, 2),              # target_key, window_start, window_end
+        QUERIES['pagination_checkpoints']['delete']: (0, 1, 2),
+    }
 
     def __init__(self, target_accounts, api_key, api_secret_key, access_token,
-                 access_token_secret, bearer_token):
+                 access_token_secret, bearer_token, rate_limiter=None, http_client=None, checkpoint_overlap=0,
+                 batch_comments=False, query_max_length=512, crawl_planner=None, handle_ttl=7*24, write_buffer=None,
+                 pipeline_depth=0, base_url='https://api.twitter.com', credential_pool=None, metrics=None,
+                 detect_changes=True, change_cache_size=100000, landing_zone=None):
         """
         Constructor
         :param target_accounts: list of targets' handles
@@ -46,6 +69,24 @@ class TweetRetriever:
         :param access_token: str, access token
         :param access_token_secret: str, access token secret
         :param bearer_token: str, bearer token
+        :param rate_limiter: RateLimiter, budget per endpoint of the passed credentials, ignored with credential_pool
+        :param http_client: HttpClient, pooled http client, defaults to the process wide client
+        :param checkpoint_overlap: int, minutes of the timeline re-fetched before account's checkpoint, 0 to fetch only
+            tweets newer than the checkpoint
+        :param batch_comments: bool, True to search comments of many conversations with a single query
+        :param query_max_length: int, max length of search query (512 for Essential/Elevated, 1024 for Academic access)
+        :param crawl_planner: CommentCrawlPlanner, skips conversations without new replies, None to crawl all of them
+        :param handle_ttl: int, hours a resolved handle->id pair is trusted before it is looked up again
+        :param write_buffer: DbWriteBuffer, collects pages and writes them in one transaction per flush
+        :param pipeline_depth: int, pages queued in front of the parser and the db writer threads, 0 to parse and write
+            pages on the fetching thread
+        :param base_url: str, api root, e.g. url of the local stub server replaying recorded responses
+        :param credential_pool: CredentialPool, several apps' tokens to spread the requests across, None to send all of
+            them with the passed credentials
+        :param metrics: RunMetrics, per run metrics, pass it with the output files set to export them
+        :param detect_changes: bool, True to skip users and tweets that are already in db with the same values
+        :param change_cache_size: int, number of row fingerprints kept in memory per table
+        :param landing_zone: LandingZone, raw pages are kept there to be reprocessed without fetching them again
         """
         self.target_accounts = target_accounts
         self.API_KEY = api_key
@@ -53,11 +94,40 @@ class TweetRetriever:
         self.ACCESS_TOKEN = access_token
         self.ACCESS_TOKEN_SECRET = access_token_secret
         self.BEARER_TOKEN = bearer_token
+        self.credential_pool = credential_pool if credential_pool else CredentialPool(
+            [Credentials('default', api_key, api_secret_key, access_token, access_token_secret, bearer_token)],
+            rate_limiters=[rate_limiter] if rate_limiter else None)
+        self.http_client = http_client if http_client else default_client()
+        self.checkpoint_overlap = timedelta(minutes=checkpoint_overlap)
+        self.batch_comments = batch_comments
+        self.query_max_length = query_max_length
+        self.crawl_planner = crawl_planner
+        self.handle_ttl = timedelta(hours=handle_ttl)
+        self.write_buffer = write_buffer if write_buffer else DbWriteBuffer()
+        self.detect_changes = detect_changes
+        self._change_filters = {
+            QUERIES['user_info']['upsert']: ChangeFilter('user_info', 'account_id', key_index=1,
+                                                         value_indices=(3, 4, 5, 6, 7), capacity=change_cache_size),
+            QUERIES['raw_tweets_info']['upsert']: ChangeFilter('raw_tweets_info', 'tweet_id', key_index=2,
+                                                               value_indices=(5, 6, 7, 8), capacity=change_cache_size),
+        }
+        self.write_buffer.add_flush_hook(self._on_flush)
+        self.landing_zone = landing_zone
+        self.pipeline_depth = pipeline_depth
+        self.base_url = base_url
+        self.metrics = metrics if metrics else RunMetrics()
+        self._slept_before = 0                                               # rate limit sleep before the run
+        self._pipeline = None
+        self._lock = threading.Lock()                                        # guards counters shared by workers
 
-    def connect(self):
-        """Connects to tweepy api"""
-        auth = tweepy.OAuthHandler(self.API_KEY, self.API_SECRET_KEY)
-        auth.set_access_token(self.ACCESS_TOKEN, self.ACCESS_TOKEN_SECRET)             # READ & WRITE Permissions
+    @staticmethod
+    def connect(credentials):
+        """
+        Connects to tweepy api
+        :param credentials: Credentials, token of the pool
+        """
+        auth = tweepy.OAuthHandler(credentials.api_key, credentials.api_secret_key)
+        auth.set_access_token(credentials.access_token, credentials.access_token_secret)   # READ & WRITE Permissions
         return tweepy.API(auth)
 
     @staticmethod
@@ -71,22 +141,72 @@ class TweetRetriever:
         except TweepyException as err:
             return Exception(f'Connection is not verified: {err} Aborting...')
 
-    @staticmethod
-    def get_target_id(target_handle, api):
-        """Retrieving user's id."""
-        print(f'Looking up {target_handle}')
-        user = None
-        try:
-            user = api.get_user(screen_name=target_handle)
-        except NotFound:
-            print(f'Handle "{target_handle}" was not found. Moving onto next one.')
-        if user:
-            return user.id
-        return
-
-    def get_tweets(self, user_id, start_time, end_time, next_token=None):
+    def verify_once(self):
+        """
+        Verifies credentials of every token in the pool on the first run of the process only, the OAuth handshakes are
+        skipped afterwards
+        """
+        if TweetRetriever._VERIFIED:
+            return True
+        for credentials in self.credential_pool.credentials:
+            print(f'Credentials "{credentials.name}":')
+            verified = self.connection_is_verified(self.connect(credentials))
+            if verified is not True:
+                return verified
+        TweetRetriever._VERIFIED = True
+        return True
+
+    def get_users_by_usernames(self, handles):
+        """Endpoint for looking up up to 100 users by their handles."""
+        url = f'{self.base_url}/2/users/by?'
+        params = {
+            'usernames': ','.join(handles),
+        }
+        return self._get('users_lookup', url, params)
+
+    def _lookup_handles(self, handles):
+        """
+        Resolves handles to account ids, 100 handles per request
+        :param handles: list, handles
+        :return: dict, {handle: account_id}, account_id is None if the handle was not found
+        """
+        resolved = {}
+        for i in range(0, len(handles), 100):
+            batch = handles[i:i + 100]
+            print(f'Looking up {", ".join(batch)}')
+            response = self.get_users_by_usernames(batch)
+            while self.too_many_requests(response):
+                response = self.get_users_by_usernames(batch)                   # rate limiter waited for the reset
+            for user in payload(response).get('data', []):
+                resolved[user['username'].lower()] = user['id']
+            for handle in batch:
+                if handle.lower() not in resolved:
+                    print(f'Handle "{handle}" was not found. Moving onto next one.')
+                resolved.setdefault(handle.lower(), None)
+        return resolved
+
+    def resolve_targets(self):
+        """
+        Resolves target handles to account ids through the handle registry, handles missing in the registry or older
+        than handle_ttl are looked up with a single batched request and written back.
+        :return: list of (target_handle, target_id), handles that were not found are left out
+        """
+        query = f"""
+        {QUERIES['handle_registry']['retrieve_all']}
+        WHERE resolved_at >= %s
+        """
+        rows = retrieve_data(query, (datetime.now() - self.handle_ttl,)) or []
+        registry = {handle: account_id for handle, account_id, _ in rows}
+        missing = [handle for handle in self.target_accounts if handle.lower() not in registry]
+        if missing:
+            resolved = self._lookup_handles(missing)
+            insert_to_db(list(resolved.items()), QUERIES['handle_registry']['upsert'])
+            registry.update(resolved)
+        return [(handle, registry[handle.lower()]) for handle in self.target_accounts if registry[handle.lower()]]
+
+    def get_tweets(self, user_id, start_time, end_time, next_token=None, since_id=None):
         """Endpoint for retrieving tweets from user's timeline."""
-        url = f'https://api.twitter.com/2/users/{user_id}/tweets?'
+        url = f'{self.base_url}/2/users/{user_id}/tweets?'
         params = {
             'start_time': start_time,
             'end_time': end_time,                                        # defaults to now() - 30s
@@ -96,23 +216,28 @@ class TweetRetriever:
             # 'exclude': 'retweets,replies',
             'max_results': 100,
         }
-        headers = {
-            'Authorization': f'Bearer {self.BEARER_TOKEN}'
+        if since_id:
+            params['since_id'] = since_id
+        return self._get('user_timeline', url, params, next_token)
+
+    def get_tweets_by_ids(self, tweet_ids):
+        """Endpoint for looking up up to 100 tweets by their ids."""
+        url = f'{self.base_url}/2/tweets?'
+        params = {
+            'ids': ','.join(tweet_ids),
+            'tweet.fields': 'public_metrics',
         }
-        if next_token:
-            params['pagination_token'] = next_token
-        response = requests.get(url=url, params=params, headers=headers)
-        if not response:
-            raise Exception(f'BAD RESPONSE: '
-                            f'\nSTATUS: {response.status_code}\nMESSAGE: {response.json()}'
-                            f'\nREQ URL: {response.url}\nNEXT_TOKE: {next_token}')
-        return response
+        return self._get('tweets_lookup', url, params)
 
     def get_replies_from_tweet(self, tweet_id, start_time, end_time, next_token=None):
         """Endpoint for retrieving comments. Valid only for last 7 days!"""
-        url = 'https://api.twitter.com/2/tweets/search/recent?'
+        return self.get_replies_from_conversations([tweet_id], start_time, end_time, next_token=next_token)
+
+    def get_replies_from_conversations(self, conversation_ids, start_time, end_time, next_token=None):
+        """Endpoint for retrieving comments of several conversations with one query. Valid only for last 7 days!"""
+        url = f'{self.base_url}/2/tweets/search/recent?'
         params = {
-            'query': f'conversation_id:{tweet_id}',
+            'query': self._conversations_query(conversation_ids),
             'start_time': start_time,
             'end_time': end_time,                                        # defaults to now() - 30s
             'expansions': 'author_id',
@@ -120,138 +245,600 @@ class TweetRetriever:
             'user.fields': 'name,username,created_at,description,verified,public_metrics',
             'max_results': 100,
         }
-        headers = {
-            'Authorization': f'Bearer {self.BEARER_TOKEN}',
-        }
+        return self._get('search_recent', url, params, next_token)
+
+    @staticmethod
+    def _conversations_query(conversation_ids):
+        """Search query matching replies of any of the conversations"""
+        return ' OR '.join(f'conversation_id:{conversation_id}' for conversation_id in conversation_ids)
+
+    def _batch_conversations(self, conversation_ids):
+        """
+        Groups conversations into batches whose search query fits into query_max_length
+        :param conversation_ids: list, conversation ids
+        :return: list of lists of conversation ids
+        """
+        batches = []
+        batch = []
+        for conversation_id in dict.fromkeys(conversation_ids):                     # unique, order preserved
+            if batch and len(self._conversations_query(batch + [conversation_id])) > self.query_max_length:
+                batches.append(batch)
+                batch = []
+            batch.append(conversation_id)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _get(self, endpoint, url, params, next_token=None):
+        """
+        Sends request with the token that has the most of the endpoint's budget left, the budget is synchronized with
+        the response headers.
+        :param endpoint: str, rate limiter's endpoint name
+        :param url: str, url
+        :param params: dict, query parameters
+        :param next_token: str, pagination token
+        :return: response
+        """
         if next_token:
             params['pagination_token'] = next_token
-        response = requests.get(url=url, params=params, headers=headers)
+        token = self.credential_pool.acquire(endpoint)                      # the token with the most headroom
+        headers = {
+            'Authorization': f'Bearer {token.bearer_token}',
+        }
+        try:
+            response = self.http_client.get(url=url, params=params, headers=headers)
+        except Exception:
+            self.credential_pool.update(token, endpoint)                    # releases the reserved request
+            raise
+        self.credential_pool.update(token, endpoint, response.headers)
+        self.metrics.request(endpoint, response.status_code, response.latency)
+        self._count_request()
+        if self.too_many_requests(response):
+            self.credential_pool.exhaust(token, endpoint, response.headers)  # next try goes to another token
+            return response
         if not response:
-            raise Exception(f'BAD RESPONSE: '
-                            f'\nSTATUS: {response.status_code}\nMESSAGE: {response.json()}'
-                            f'\nREQ URL: {response.url}\nNEXT_TOKE: {next_token}')
+            raise BadResponseError(f'BAD RESPONSE: '
+                                   f'\nSTATUS: {response.status_code}\nMESSAGE: {response.text}'
+                                   f'\nREQ URL: {response.url}\nNEXT_TOKE: {next_token}')
         return response
 
     @staticmethod
     def response_is_empty(response):
         """Checks if response is empty"""
         empty = False
-        if response.json().get('meta', {}).get('result_count') == 0:
+        if payload(response).get('meta', {}).get('result_count') == 0:
             print('RESPONSE IS EMPTY')
             empty = True
         return empty
 
     @staticmethod
     def too_many_requests(response):
-        """Checks if response is bad (when you hit "Too many requests" Twitter's response is still 200.)"""
+        """Checks if response is bad (when you hit "Too many requests" Twitter's response could still be 200.)"""
         too_many = False
-        if response.json().get('title') == 'Too Many Requests':
-            print('Too Many Requests ERROR. Sleeping for 20 min...')
+        if response.status_code == 429 or payload(response).get('title') == 'Too Many Requests':
+            print('Too Many Requests ERROR. Waiting for the rate limit reset...')
             too_many = True
         return too_many
 
-    def reached_limit(self):
-        """Checks if request limit has been reached"""
-        reached = False
-        if self._REQUEST_COUNT >= self.REQUEST_LIMIT - 1:                # -1 just to be safe
-            reached = True
-            print(f'Reached {self.REQUEST_LIMIT}, sleeping for 16 min')
-            self._REQUEST_COUNT = 0
-        return reached
+    def _count_request(self):
+        """Thread-safe increment of the request counter"""
+        with self._lock:
+            self._TOTAL_REQUESTS += 1
+
+    def _count_extracted(self, count):
+        """Thread-safe increment of the extracted tweets counter, returns the new total"""
+        with self._lock:
+            self._TWEETS_EXTRACTED += count
+            return self._TWEETS_EXTRACTED
 
     @staticmethod
     def parse_response(response):
-        """parses response of the retrieved tweets"""
-        tweets_data = response.get('data')
-        tweets_dict = {}
-        for tweet in tweets_data:
-            info = {
-                'tweet_created': tweet.get('created_at'),
-                'conversation_id': tweet.get('conversation_id'),
-                'tweet_id': tweet.get('id'),
-                'author_id': tweet.get('author_id'),
-                'text': tweet.get('text'),
-                'retweet_count': tweet.get('public_metrics').get('retweet_count'),
-                'reply_count': tweet.get('public_metrics').get('reply_count'),
-                'like_count': tweet.get('public_metrics').get('like_count'),
-                'quote_count': tweet.get('public_metrics').get('quote_count')
-            }
-            tweets_dict[tweet.get('id')] = info
-
-        users_data = response.get('includes').get('users')
-        users_dict = {}
-        for user in users_data:
-            info = {
-                'account_created': user.get('created_at'),
-                'account_id': user.get('id'),
-                'name': user.get('name'),
-                'verified': user.get('verified'),
-                'follower_count': user.get('public_metrics').get('followers_count'),
-                'following_count': user.get('public_metrics').get('following_count'),
-                'tweet_count': user.get('public_metrics').get('tweet_count'),
-                'listed_count': user.get('public_metrics').get('listed_count')
-            }
-            users_dict[info.get('account_id')] = info  # we do not want duplicates => key(author_id) might not be unique
-        meta = response.get('meta', {})
-        return tweets_dict, users_dict, meta
+        """
+        Parses page of the retrieved tweets into rows, see decoding.decode_page
+        :param response: dict, parsed body of the page
+        :return: tuple, (list of TweetRow, list of UserRow, meta)
+        """
+        return decode_page(response)
 
-    @staticmethod
-    def _insert_to_db(parsed_response, users_query=True):
+    def _request_page(self, endpoint, *args, next_token=None, **kwargs):
+        """
+        Sends a request to the passed endpoint, retries on "Too Many Requests" once the rate limit has been reset.
+        :param endpoint: callable, self.get_tweets or self.get_replies_from_tweet
+        :param args: positional arguments for the endpoint
+        :param next_token: str, pagination token
+        :param kwargs: keyword arguments for the endpoint
+        :return: response, or None if response is empty
+        """
+        while True:
+            response = endpoint(*args, next_token=next_token, **kwargs)
+            if self.too_many_requests(response):
+                continue
+            if self.response_is_empty(response):
+                return None
+            return response
+
+    def _parse_stage(self, item):
         """
-        Creates list of tuples and inserts it to database.
+        Parses the page and turns it into rows, together with the extraction progress
         NOTE: users' information has to be inserted to db first due to constraints!!!
+        :param item: tuple, ('page', parsed body, progress, on_page, url), other items are passed on as they are,
+            url is None for the pages that are not landed
+        :return: tuple, ('write', list of (query, rows))
+        """
+        if item[0] != 'page':
+            return item
+        _, page, progress, on_page, url = item
+        if url and self.landing_zone is not None:
+            self.landing_zone.write(page, url)
+        tweets, users, meta = self.parse_response(page)
+        changed_tweets = self._changed(QUERIES['raw_tweets_info']['upsert'], tweets)
+        batches = [
+            (QUERIES['user_info']['upsert'], self._changed(QUERIES['user_info']['upsert'], users)),  # users first!
+            (QUERIES['raw_tweets_info']['upsert'], changed_tweets),
+            (QUERIES['conversation_roots']['upsert'],                       # tweets starting their conversations
+             [(row[1], row[3]) for row in changed_tweets if row[1] == row[2]]),
+        ]
+        if progress:
+            batches.extend(progress(tweets, meta))
+        if on_page:
+            on_page(tweets)
+        return 'write', batches
 
-        Parameters
-        :param parsed_response: dict, parsed response
-        :param users_query: bool, to pick correct query
+    def _changed(self, query, rows):
+        """Returns rows that are new or changed, with their row_hash, all of them if change detection is off"""
+        change_filter = self._change_filters[query]
+        return change_filter.filter(rows) if self.detect_changes else change_filter.tag(rows)
+
+    def _on_flush(self, batches):
+        """Write buffer's hook, change filters learn fingerprints of the committed rows"""
+        for query, rows in batches:
+            change_filter = self._change_filters.get(query)
+            if change_filter is not None:
+                change_filter.commit(rows)
+
+    def _write_stage(self, item):
         """
-        query = QUERIES['user_info']['upsert'] if users_query else QUERIES['raw_tweets_info']['upsert']
-        rows_to_insert = []
-        for tweet in parsed_response.values():
-            row = tuple(tweet.values())
-            rows_to_insert.append(row)
-        insert_to_db(rows_to_insert, query=query)
+        Passes rows to the write buffer, rows passed together are always flushed in the same transaction
+        :param item: tuple, ('write', list of (query, rows)) or ('flush',)
+        """
+        if item[0] == 'flush':
+            self.write_buffer.flush()
+            return
+        self.write_buffer.add_many([(query, rows, self._ROW_KEYS.get(query)) for query, rows in item[1]])
+
+    def _submit(self, item):
+        """Passes the item through the parser and the writer, on their threads if the pipeline is running"""
+        if self._pipeline is not None:
+            self._pipeline.put(item)                                        # blocks while the parser is behind
+        else:
+            self._write_stage(self._parse_stage(item))
+
+    def _write(self, batches):
+        """Writes rows after the pages submitted before them, see _write_stage"""
+        self._submit(('write', batches))
+
+    def _flush(self):
+        """Flushes the write buffer once the pages submitted before are written"""
+        self._submit(('flush',))
+
+    def _drain(self):
+        """Waits until every submitted page is parsed and written to db"""
+        if self._pipeline is not None:
+            self._pipeline.join()
+        self.write_buffer.flush()
+
+    def _start_pipeline(self):
+        """Starts parser and db writer threads, fetching threads only download pages then"""
+        if self.pipeline_depth:
+            self._pipeline = Pipeline([('parse', self._parse_stage, 1), ('write', self._write_stage, 1)],
+                                      maxsize=self.pipeline_depth)
+            self._pipeline.start()
+
+    def _stop_pipeline(self):
+        """Stops parser and db writer threads"""
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+        if self.landing_zone is not None:
+            self.landing_zone.close()
+
+    def _store_page(self, response, progress=None, on_page=None):
+        """
+        Submits the page to be parsed and written to db in one transaction, together with the extraction progress.
+        :param response: response of the page
+        :param progress: callable, progress(tweets, meta) returns list of (query, rows) written along with the page
+        :param on_page: callable, on_page(tweets) called once the page is parsed
+        :return: dict, meta of the page
+        """
+        page = payload(response)
+        meta = page.get('meta', {})
+        self._submit(('page', page, progress, on_page, response.url))
+        self._count_extracted(int(meta.get('result_count')))
+        return meta
+
+    def reprocess(self, pages):
+        """
+        Parses pages fetched before (e.g. read from the landing zone) and writes them to db, nothing is requested
+        :param pages: iterable of dicts, parsed bodies of the pages
+        :return: int, number of pages
+        """
+        count = 0
+        self._start_pipeline()
+        try:
+            for page in pages:
+                self._submit(('page', page, None, None, None))
+                count += 1
+            self._drain()
+        finally:
+            self._stop_pipeline()
+        return count
+
+    @staticmethod
+    def _conversation_ids(tweets):
+        """
+        Returns conversations of the parsed tweets
+        :param tweets: list of TweetRow, parsed tweets
+        :return: list of (conversation_id, reply_count), reply_count is None unless the tweet starts the conversation
+        """
+        conversations = []
+        for tweet in tweets:
+            if not tweet.conversation_id:
+                raise Exception('ERROR: could not find conversation in parsed data.')
+            reply_count = tweet.reply_count if tweet.conversation_id == tweet.tweet_id else None
+            conversations.append((tweet.conversation_id, reply_count))
+        return conversations
+
+    @staticmethod
+    def _newest_tweet(tweets, newest=None):
+        """
+        Returns the newest tweet of the page
+        :param tweets: list of TweetRow, parsed tweets
+        :param newest: tuple, (tweet_id, tweet_created) newest tweet so far
+        :return: tuple, (tweet_id, tweet_created)
+        """
+        for tweet in tweets:
+            if newest is None or int(tweet.tweet_id) > int(newest[0]):
+                newest = (tweet.tweet_id, tweet.tweet_created)
+        return newest
+
+    @staticmethod
+    def _load_checkpoints():
+        """Returns high-water marks of the accounts, {account_id: (last_tweet_id, last_tweet_created)}"""
+        rows = retrieve_data(QUERIES['account_checkpoints']['retrieve_all']) or []
+        return {account_id: (last_tweet_id, last_tweet_created) for account_id, last_tweet_id, last_tweet_created in rows}
+
+    @staticmethod
+    def _pagination_progress(target_key, window_start, window_end, next_token, since_id=None):
+        """
+        Returns write that saves pagination checkpoint of the window, or clears it once the window is finished
+        :param target_key: str, 'account:<id>', 'backfill:<id>', 'conversation:<id>' or 'conversations:<id>,<id>,...'
+        :param window_start: str, start time of the window
+        :param window_end: str, end time of the window
+        :param next_token: str, token of the next page, None if the window is finished
+        :param since_id: str, since_id the window was requested with
+        :return: tuple, (query, rows)
+        """
+        if next_token:
+            return QUERIES['pagination_checkpoints']['upsert'], [(target_key, window_start, window_end, next_token,
+                                                                  since_id)]
+        return QUERIES['pagination_checkpoints']['delete'], [(target_key, window_start, window_end)]
+
+    def _resume_window(self, kind, target_id, window_start, window_end, since_id, next_token=None):
+        """
+        Extracts the interrupted window of the pagination checkpoint from the passed page, or from its start
+        :param kind: str, 'account', 'conversation' or 'conversations'
+        :param target_id: str, account id, conversation id or comma separated conversation ids
+        :param window_start: str, start time of the window
+        :param window_end: str, end time of the window
+        :param since_id: str, since_id the window was requested with
+        :param next_token: str, token of the page to resume from, None to restart the window
+        """
+        if kind == 'account':
+            window = {'start_time': window_start, 'since_id': since_id, 'known_conversations': []}
+            self._extract_timeline(target_id, target_id, window, window_end, next_token=next_token)
+        elif kind == 'conversations':
+            self._extract_comments_batch(target_id.split(','), window_start, window_end, next_token=next_token)
+        else:
+            self._extract_comments(target_id, window_start, window_end, next_token=next_token)
+
+    def _resume_interrupted(self):
+        """
+        Finishes timelines and comment threads that were interrupted in the previous runs, from their last page. A
+        window whose page can not be requested any more (e.g. its pagination token has expired) is extracted again from
+        its start with the since_id it was requested with, as account's checkpoint has already moved past its first
+        page. Shards of an interrupted backfill are left to the backfill, see backfill.py.
+        """
+        rows = retrieve_data(QUERIES['pagination_checkpoints']['retrieve_all']) or []
+        search_limit = datetime.utcnow() - timedelta(days=7)
+        for target_key, window_start, window_end, next_token, since_id in rows:
+            kind, target_id = target_key.split(':', 1)
+            if kind == 'backfill':
+                continue
+            if kind != 'account' and datetime.strptime(window_start, self.dateformat_) < search_limit:
+                print(f'Comments of {target_key} are older than 7 days and can not be resumed.')
+                self._write([(QUERIES['pagination_checkpoints']['delete'], [(target_key, window_start, window_end)])])
+                continue
+            print(f'\n\nResuming {target_key} ({window_start} - {window_end}) from the last extracted page.')
+            try:
+                self._resume_window(kind, target_id, window_start, window_end, since_id, next_token)
+            except BadResponseError as err:                               # e.g. pagination token has expired
+                print(f'Could not resume {target_key}, restarting the window. ERROR: {err}')
+                try:
+                    self._resume_window(kind, target_id, window_start, window_end, since_id)
+                except BadResponseError as err:
+                    print(f'Could not restart {target_key}, its checkpoint is kept for the next run. ERROR: {err}')
+                    continue
+                finished = (target_key, window_start, window_end)                   # also when the window was empty
+                self._write([(QUERIES['pagination_checkpoints']['delete'], [finished])])
+        self._flush()
+
+    def _account_window(self, target_id, tw_start_time, checkpoint=None):
+        """
+        Narrows the timeline window down to the tweets newer than account's checkpoint. Conversations of the tweets that
+        are already in db, but still fall into the window, are returned so their comments are still extracted.
+        :param target_id: int, account id
+        :param tw_start_time: datetime.datetime, start time for tweet search
+        :param checkpoint: tuple, (last_tweet_id, last_tweet_created)
+        :return: dict, {'start_time', 'since_id', 'known_conversations'}
+        """
+        window = {'start_time': tw_start_time.strftime(self.dateformat_), 'since_id': None, 'known_conversations': []}
+        if checkpoint is None or checkpoint[1] < tw_start_time:
+            return window
+        last_tweet_id, last_tweet_created = checkpoint
+        if self.checkpoint_overlap:
+            fetch_from = max(last_tweet_created - self.checkpoint_overlap, tw_start_time)
+            window['start_time'] = fetch_from.strftime(self.dateformat_)
+            created_filter = 'tweet_created < %s'
+        else:
+            fetch_from = last_tweet_created
+            window['since_id'] = last_tweet_id
+            created_filter = 'tweet_created <= %s'
+        query = f"""
+        SELECT DISTINCT conversation_id
+        FROM raw_tweets_info
+        WHERE author_id = %s AND tweet_created >= %s AND {created_filter};
+        """
+        rows = retrieve_data(query, (str(target_id), tw_start_time, fetch_from)) or []
+        window['known_conversations'] = [row[0] for row in rows]
+        return window
 
-    def _extract_comments(self, conversation_id, start_time, end_time):
+    def _count_saved(self, window, known_count, new_count):
+        """
+        Counts timeline requests saved by the checkpoint, i.e. pages of the already known tweets that were not fetched
+        :param window: dict, account's window
+        :param known_count: int, number of the tweets already in db that fall into the window
+        :param new_count: int, number of the tweets extracted
+        """
+        if not (window['since_id'] or self.checkpoint_overlap) or not known_count:
+            return
+        full = math.ceil((known_count + new_count) / 100)
+        saved = max(full - max(math.ceil(new_count / 100), 1), 0)
+        with self._lock:
+            self._REQUESTS_SAVED += saved
+
+    def _extract_comments(self, conversation_id, start_time, end_time, next_token=None):
         """
         Takes a  tweet's ids and extracts all comments from it
         :param conversation_id: int, conversation id
+        :param start_time: str, start time for comments search
+        :param end_time: str, end time for comments search
+        :param next_token: str, token of the page to resume from
         """
         print(f'\n\nExtracting comments from Conversation ID: {conversation_id}.')
+        target_key = f'conversation:{conversation_id}'
+
+        def progress(tweets, meta):
+            return [self._pagination_progress(target_key, start_time, end_time, meta.get('next_token'))]
+
         comments_per_tweet = 0
-        next_token = None
         while True:
-            print(f'\n\nTotal Request Count: {self._TOTAL_REQUESTS}')
-            print(f'Request Count: {self._REQUEST_COUNT}')
+            target_response = self._request_page(self.get_replies_from_tweet, conversation_id, start_time, end_time,
+                                                 next_token=next_token)
+            if target_response is None:
+                if next_token:
+                    self._write([self._pagination_progress(target_key, start_time, end_time, None)])
+                break
+            meta = self._store_page(target_response, progress)
+            comments_per_tweet += int(meta.get('result_count'))
+            next_token = meta.get('next_token', None)
+            if next_token is None:
+                print(f'All comments ({comments_per_tweet}) from the tweet have been extracted.')
+                break
 
-            if self.reached_limit():
-                time.sleep(60*16)
+    def _extract_comments_batch(self, conversation_ids, start_time, end_time, next_token=None):
+        """
+        Extracts comments of several conversations with a single search query, replies are routed back to their
+        conversations by the conversation_id field.
+        :param conversation_ids: list, conversation ids, their query has to fit into query_max_length
+        :param start_time: str, start time for comments search
+        :param end_time: str, end time for comments search
+        :param next_token: str, token of the page to resume from
+        :return: int, number of extracted comments
+        """
+        print(f'\n\nExtracting comments from {len(conversation_ids)} conversations.')
+        target_key = f'conversations:{",".join(conversation_ids)}'
 
-            target_response = self.get_replies_from_tweet(conversation_id, start_time, end_time, next_token=next_token)
-            self._REQUEST_COUNT += 1
-            self._TOTAL_REQUESTS += 1
+        def progress(tweets, meta):
+            return [self._pagination_progress(target_key, start_time, end_time, meta.get('next_token'))]
 
-            if self.too_many_requests(target_response):
-                time.sleep(60*20)
-                continue
-            if self.response_is_empty(target_response):
+        comments_per_batch = 0
+        while True:
+            target_response = self._request_page(self.get_replies_from_conversations, conversation_ids, start_time,
+                                                 end_time, next_token=next_token)
+            if target_response is None:
+                if next_token:
+                    self._write([self._pagination_progress(target_key, start_time, end_time, None)])
+                break
+            meta = self._store_page(target_response, progress)
+            comments_per_batch += int(meta.get('result_count'))
+            next_token = meta.get('next_token', None)
+            if next_token is None:
+                print(f'All comments ({comments_per_batch}) from {len(conversation_ids)} conversations have been '
+                      f'extracted.')
                 break
+        return comments_per_batch
 
-            print(f'RESPONSE STATUS: {target_response.status_code}')
-            tweets_dict, user_dict, meta = self.parse_response(target_response.json())
-            self._insert_to_db(user_dict, users_query=True)                             # IMPORTANT: insert users first!
-            self._insert_to_db(tweets_dict, users_query=False)
+    def _lookup_reply_counts(self, conversation_ids):
+        """
+        Looks up current reply counts of the conversations, 100 per request
+        :param conversation_ids: list, conversation ids
+        :return: dict, {conversation_id: reply_count}
+        """
+        reply_counts = {}
+        for i in range(0, len(conversation_ids), 100):
+            batch = conversation_ids[i:i + 100]
+            response = self.get_tweets_by_ids(batch)
+            while self.too_many_requests(response):
+                response = self.get_tweets_by_ids(batch)                        # rate limiter waited for the reset
+            for tweet in payload(response).get('data', []):
+                reply_counts[tweet['id']] = tweet['public_metrics']['reply_count']
+            for conversation_id in batch:
+                reply_counts.setdefault(conversation_id, 0)                     # deleted or protected
+        return reply_counts
 
-            self._TWEETS_EXTRACTED += int(meta.get('result_count'))
-            comments_per_tweet += int(meta.get('result_count'))
+    def _comment_jobs(self, conversations, cm_start_time, end_time):
+        """
+        Turns conversations collected from the timelines into comment crawl jobs. With crawl planner only conversations
+        with new replies are crawled, in the order of expected new replies and within planner's request budget.
+        :param conversations: dict, {conversation_id: reply_count, None if unknown}
+        :param cm_start_time: datetime.datetime, start time for comments search
+        :param end_time: datetime.datetime, end time for comments search
+        :return: tuple, (list of (callable, args), list of planned conversation ids)
+        """
+        if self.crawl_planner is None:
+            windows = {cm_start_time: list(conversations)}
+        else:
+            unknown = [conversation_id for conversation_id, count in conversations.items() if count is None]
+            conversations.update(self._lookup_reply_counts(unknown))
+            windows = {}
+            for conversation_id, start_time in self.crawl_planner.plan(conversations, cm_start_time):
+                windows.setdefault(start_time, []).append(conversation_id)
+        end_time = end_time.strftime(self.dateformat_)
+        jobs = []
+        planned = []
+        for start_time, conversation_ids in windows.items():
+            start_time = start_time.strftime(self.dateformat_)
+            planned.extend(conversation_ids)
+            if self.batch_comments:
+                jobs.extend((self._extract_comments_batch, (batch, start_time, end_time))
+                            for batch in self._batch_conversations(conversation_ids))
+            else:
+                jobs.extend((self._extract_comments, (conversation_id, start_time, end_time))
+                            for conversation_id in conversation_ids)
+        return jobs, planned
 
-            print(f'Total number of tweets/comments extracted: {self._TWEETS_EXTRACTED}')
+    def _conversation_collector(self):
+        """
+        Returns dict collecting conversations found in the timelines and the callable filling it, thread-safe
+        :return: tuple, (dict {conversation_id: reply_count}, callable(conversation_id, reply_count=None))
+        """
+        conversations = {}
+
+        def collect(conversation_id, reply_count=None):
+            with self._lock:
+                known = conversations.get(conversation_id)
+                conversations[conversation_id] = reply_count if known is None else max(known, reply_count or 0)
+
+        return conversations, collect
+
+    def _reset_counters(self):
+        """Resets counters & settings before a run"""
+        self._TOTAL_REQUESTS = 0
+        self._TWEETS_EXTRACTED = 0
+        self._REQUESTS_SAVED = 0
+        self.http_client.reset_stats()
+        self.write_buffer.reset_stats()
+        self.credential_pool.reset_stats()
+        self.metrics.start()
+        self._slept_before = self.credential_pool.slept()
+        for change_filter in self._change_filters.values():
+            change_filter.skipped = 0
+        db_pool.reset_stats()
+
+    def _report(self):
+        """Exports metrics of the run and prints its summary"""
+        self._GRAND_TOTAL += self._TWEETS_EXTRACTED
+        _, tweets_new = self.write_buffer.table_stats().get('raw_tweets_info', (0, 0))
+        db_writes = self.write_buffer.stats()
+        pool = db_pool.stats()
+        metrics = self.metrics.finish(
+            tweets_extracted=self._TWEETS_EXTRACTED,
+            tweets_new=tweets_new,                                          # counted by the upsert, no table scans
+            tweets_seen=self._TWEETS_EXTRACTED - tweets_new,
+            new_ratio=tweets_new / self._TWEETS_EXTRACTED if self._TWEETS_EXTRACTED else 0,
+            rows_unchanged=sum(change_filter.skipped for change_filter in self._change_filters.values()),
+            rows_written=db_writes['rows'],
+            db_write_seconds=db_writes['write_time'],
+            db_pool_wait_seconds=pool['wait_time'],
+            db_pool_max_wait_seconds=pool['max_wait'],
+            db_pool_utilization=pool['utilization'],
+            rate_limit_sleep_seconds=self.credential_pool.slept() - self._slept_before,
+            requests_saved=self._REQUESTS_SAVED,
+        )
+        print(f'Process finished.\nTOTAL NUMBER OF EXTRACTED TWEETS THIS SESSION: {self._TWEETS_EXTRACTED}\n\n'
+              f'GRAND TOTAL: {self._GRAND_TOTAL}\nNEW TWEETS: {tweets_new} ({metrics["new_ratio"]:.0%})\n'
+              f'SLEPT ON RATE LIMITS: {metrics["rate_limit_sleep_seconds"]:.0f} sec\n'
+              f'REQUESTS SAVED BY CHECKPOINTS: {self._REQUESTS_SAVED}\n'
+              f'HTTP: {self.http_client.latency_stats()}\n'
+              f'TOKENS: {self.credential_pool.stats()}\n'
+              f'DB WRITES: {self.write_buffer.stats()}\n'
+              f'PIPELINE: {self._pipeline.stats() if self._pipeline is not None else None}\n\n')
+
+    def _extract_timeline(self, target_handle, target_id, window, end_time, on_conversation=None, next_token=None,
+                          target_key=None):
+        """
+        Extracts tweets from account's timeline within the window. Every page moves account's checkpoint forward and
+        saves the pagination checkpoint of the window in the same transaction, the account is flushed to db at the end.
+        :param target_handle: str, account's handle
+        :param target_id: int, account's id
+        :param window: dict, account's window, see _account_window
+        :param end_time: str, end_time for the search
+        :param on_conversation: callable, called with (conversation_id, reply_count) to extract comments from
+        :param next_token: str, token of the page to resume from
+        :param target_key: str, key of the window's pagination checkpoint, 'account:<id>' by default
+        :return: int, number of extracted tweets
+        """
+        print(f'\n\n\nExtracting tweets from {target_handle}')
+        target_key = target_key if target_key else f'account:{target_id}'
+
+        newest = None
+
+        def progress(tweets, meta):
+            nonlocal newest
+            newest = self._newest_tweet(tweets, newest)                # buffer keeps the last checkpoint only
+            return [
+                (QUERIES['account_checkpoints']['upsert'], [(str(target_id), newest[0], newest[1])]),
+                self._pagination_progress(target_key, window['start_time'], end_time, meta.get('next_token'),
+                                          window['since_id']),
+            ]
+
+        def on_page(tweets):
+            if on_conversation:
+                for conversation_id, reply_count in self._conversation_ids(tweets):   # passing tweets to comments
+                    on_conversation(conversation_id, reply_count)
+
+        tweets_per_handle = 0
+        while True:
+            target_response = self._request_page(self.get_tweets, target_id, window['start_time'], end_time,
+                                                 next_token=next_token, since_id=window['since_id'])
+            if target_response is None:
+                if next_token:
+                    self._write([self._pagination_progress(target_key, window['start_time'], end_time, None)])
+                break
+            meta = self._store_page(target_response, progress, on_page)
+            tweets_per_handle += int(meta.get('result_count'))
             next_token = meta.get('next_token', None)
             if next_token is None:
-                print(f'All comments ({comments_per_tweet}) from the tweet have been extracted.')
+                print(f'All tweets ({tweets_per_handle}) from {target_handle} have been extracted.')
                 break
+        self._flush()
+        self._count_saved(window, len(window['known_conversations']), tweets_per_handle)
+        if on_conversation:
+            for conversation_id in window['known_conversations']:                 # tweets skipped by the checkpoint
+                on_conversation(conversation_id)
+        return tweets_per_handle
 
-    def extract_tweets(self, tw_start_time, cm_start_time, end_time, include_comments=True):
+    def extract_tweets(self, tw_start_time, cm_start_time, end_time, include_comments=True, use_checkpoints=True):
         """
         Extracts tweets and comments from the target list up to specified date.
         NOTE: comments could be extracted only up last 7 days, unless you have premium api. However, for tweet only 3200
@@ -260,67 +847,82 @@ class TweetRetriever:
         :param cm_start_time: datetime.datetime, start time fot comments search
         :param end_time: datetime.datetime, end_time for the search
         :param include_comments: bool, True to include comment search, False otherwise
+        :param use_checkpoints: bool, True to request only tweets newer than accounts' checkpoints and to resume
+            interrupted runs
         :return:
         """
-        # Reset Counters & Settings
-        self._REQUEST_COUNT = 0
-        self._TOTAL_REQUESTS = 0
-        self._TWEETS_EXTRACTED = 0
-        tw_start_time = tw_start_time.strftime(self.dateformat_)
-        cm_start_time = cm_start_time.strftime(self.dateformat_)
-        end_time = end_time.strftime(self.dateformat_)
-
-        api = self.connect()
-        self.connection_is_verified(api)
-        for target_handle in self.target_accounts:
-            print(f'\n\n\nExtracting tweets from {target_handle}')
+        self._reset_counters()
+        window_end = end_time.strftime(self.dateformat_)
+        conversations, collect = self._conversation_collector()
 
-            target_id = self.get_target_id(target_handle, api)
-            tweets_per_handle = 0
-            next_token = None
-            while True:
-                print(f'\n\nTotal Request Count: {self._TOTAL_REQUESTS}')
-                print(f'Request Count: {self._REQUEST_COUNT}')
-
-                if self.reached_limit():
-                    time.sleep(60*16)
+        self.verify_once()
+        self._start_pipeline()
+        try:
+            if use_checkpoints:
+                self._resume_interrupted()
+            checkpoints = self._load_checkpoints() if use_checkpoints else {}
+            for target_handle, target_id in self.resolve_targets():
+                window = self._account_window(target_id, tw_start_time, checkpoints.get(str(target_id)))
+                self._extract_timeline(target_handle, target_id, window, window_end,
+                                       on_conversation=collect if include_comments else None)
+            self._drain()                                               # every timeline page has been parsed
+            jobs, planned = self._comment_jobs(conversations, cm_start_time, end_time)
+            for job, args in jobs:
+                job(*args)
+            self._drain()                                               # comments are in db before they are marked
+            if self.crawl_planner is not None:
+                self.crawl_planner.commit(planned, end_time)
+            self._report()
+        finally:
+            self._stop_pipeline()
 
-                target_response = self.get_tweets(target_id, tw_start_time, end_time, next_token=next_token)
-                self._REQUEST_COUNT += 1
-                self._TOTAL_REQUESTS += 1
+    def extract_tweets_async(self, tw_start_time, cm_start_time, end_time, include_comments=True, use_checkpoints=True,
+                             concurrency=4):
+        """
+        Same as extract_tweets, but timelines of several accounts and comment threads of several conversations are
+        fetched at once. All workers share one rate limiter, so the per endpoint budgets still hold.
+        :param tw_start_time: datetime.datetime, start time fot tweet search
+        :param cm_start_time: datetime.datetime, start time fot comments search
+        :param end_time: datetime.datetime, end_time for the search
+        :param include_comments: bool, True to include comment search, False otherwise
+        :param use_checkpoints: bool, True to request only tweets newer than accounts' checkpoints and to resume
+            interrupted runs
+        :param concurrency: int, maximum number of requests in flight
+        """
+        self._reset_counters()
+        self.verify_once()
+        self._start_pipeline()
+        try:
+            if use_checkpoints:
+                self._resume_interrupted()
+            checkpoints = self._load_checkpoints() if use_checkpoints else {}
+            windows = {}
+            for target_handle, target_id in self.resolve_targets():
+                windows[(target_handle, target_id)] = self._account_window(target_id, tw_start_time,
+                                                                           checkpoints.get(str(target_id)))
+            asyncio.run(self._harvest(windows, cm_start_time, end_time, include_comments, concurrency))
+            self._report()
+        finally:
+            self._stop_pipeline()
 
-                if self.too_many_requests(target_response):
-                    time.sleep(60*20)
-                    continue
-                if self.response_is_empty(target_response):
-                    break
-
-                print(f'FROM: {target_handle}')
-                print(f'RESPONSE STATUS: {target_response.status_code}')
-
-                tweets_dict, users_dict, meta = self.parse_response(target_response.json())
-                self._insert_to_db(users_dict, users_query=True)                        # IMPORTANT: insert users first!
-                self._insert_to_db(tweets_dict, users_query=False)
-
-                self._TWEETS_EXTRACTED += int(meta.get('result_count'))
-                tweets_per_handle += int(meta.get('result_count'))
-                print(f'Tweets already extracted: {self._TWEETS_EXTRACTED}')
-                if include_comments:
-                    for tweet_info in tweets_dict.values():                         # passing tweets to extract comments
-                        conversation_id = tweet_info.get('conversation_id', None)
-                        if conversation_id:
-                            self._extract_comments(conversation_id, cm_start_time, end_time)
-                        else:
-                            raise Exception('ERROR: could not find conversation in parsed data.')
-
-                next_token = meta.get('next_token', None)
-                if next_token is None:
-                    print(f'All tweets ({tweets_per_handle}) from {target_handle} have been extracted.')
-                    break
-        db_count = retrieve_data('SELECT COUNT(DISTINCT tweet_id) FROM raw_tweets_info')[0][0]
-        self._GRAND_TOTAL += self._TWEETS_EXTRACTED
-        print(f'Process finished.\nTOTAL NUMBER OF EXTRACTED TWEETS THIS SESSION: {self._TWEETS_EXTRACTED}\n\n'
-              f'GRAND TOTAL: {self._GRAND_TOTAL}\nEFFICIENCY: {db_count/self._GRAND_TOTAL}%\n\n')
+    async def _harvest(self, windows, cm_start_time, end_time, include_comments, concurrency):
+        """Runs every account's timeline and then the comment crawl jobs on a bounded pool of workers"""
+        loop = asyncio.get_running_loop()
+        window_end = end_time.strftime(self.dateformat_)
+        conversations, collect = self._conversation_collector()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*(
+                loop.run_in_executor(executor, lambda handle=target_handle, id_=target_id, window=window:
+                                     self._extract_timeline(handle, id_, window, window_end,
+                                                            on_conversation=collect if include_comments else None))
+                for (target_handle, target_id), window in windows.items()))
+            await loop.run_in_executor(executor, self._drain)          # every timeline page has been parsed
+            jobs, planned = await loop.run_in_executor(executor, self._comment_jobs, conversations, cm_start_time,
+                                                       end_time)
+            await asyncio.gather(*(loop.run_in_executor(executor, job, *args) for job, args in jobs))
+            await loop.run_in_executor(executor, self._drain)          # comments are in db before they are marked
+        if self.crawl_planner is not None:
+            self.crawl_planner.commit(planned, end_time)
 
 
 class BtcExtractorYahoo:
@@ -358,6 +960,7 @@ class BtcExtractorYahoo:
         print(f'{len(rows_to_insert)} have been inserted to btc_daily')
 
     def extract_btc(self):
+        import yfinance as yf                                               # only needed by this source
         print(f'Extracting BTC for the period {self.period} with interval of {self.interval}.\n')
         btc_daily = yf.download(tickers='BTC-USD', period=self.period, interval=self.interval)
         btc_daily.reset_index(inplace=True)
@@ -366,43 +969,98 @@ class BtcExtractorYahoo:
         print('Process Finished')
 
 
+class BtcDailyRollup:
+    """
+    Computes daily BTC bars from the hourly CryptoCompare candles already in db, an alternative to BtcExtractorYahoo
+    without a second provider, so daily and hourly prices line up. Only the days after the last stored one are rolled
+    up, together with a few days before it, in case their hours were filled later. Days are local, as the hourly
+    candles, the current day is left until it is finished. Volume is the USD volume (volumeto).
+    Example:
+    ```py
+        btc_extractor = BtcDailyRollup()
+        btc_extractor.extract_btc()
+    ```
+    """
+    def __init__(self, lookback_days=2):
+        """
+        Constructor
+        :param lookback_days: int, stored days rolled up again
+        """
+        self.lookback_days = lookback_days
+
+    def extract_btc(self, start_date=None, end_date=None):
+        """
+        Rolls hourly candles up into btc_daily_info
+        :param start_date: datetime.date, first day, defaults to lookback_days before the last stored day
+        :param end_date: datetime.date, day after the last one, defaults to today
+        :return: int, number of days written
+        """
+        if start_date is None:
+            rows = retrieve_data(QUERIES['btc_daily_info']['last'])
+            last_date = rows[0][0] if rows else None
+            start_date = last_date - timedelta(days=self.lookback_days) if last_date else date.min
+        end_date = end_date if end_date else date.today()
+        days = execute_query(QUERIES['btc_daily_info']['rollup'], (start_date, end_date))
+        print(f'{days} days have been rolled up to btc_daily_info.')
+        return days
+
+
 class BtcExtractorCC:
     """
     Extracts hourly data for BTC, saves it to database.
     https://min-api.cryptocompare.com/documentation
     API allows up to 100,000 free calls per month.
     Class should not make more calls than (31 days * 24 hours) = 720
+    Hours missed by the hourly runs (restarts, outages) are filled by fill_gaps, up to 2000 candles per request.
     """
-    def __init__(self, api_key, frequency='hourly'):
+    MAX_LIMIT = 2000                                                        # histohour returns limit + 1 candles
+
+    def __init__(self, api_key, frequency='hourly', rate_limiter=None, http_client=None,
+                 base_url='https://min-api.cryptocompare.com'):
         """
         Constructor
         :param api_key: str, api key from CompareCrypto (it's free)
         :param frequency: str, ['hourly', 'daily'] (daily is not configured)
+        :param rate_limiter: RateLimiter, monthly quota budget
+        :param http_client: HttpClient, pooled http client, defaults to the process wide client
+        :param base_url: str, api root, e.g. url of the local stub server replaying recorded responses
         """
         self.api_key = api_key
         self.frequency = frequency
-        self.url = 'https://min-api.cryptocompare.com/data/v2/histohour?'
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter(CRYPTOCOMPARE_LIMITS)
+        self.http_client = http_client if http_client else default_client()
+        self.url = f'{base_url}/data/v2/histohour?'
         self.limit = 1
 
-    def get_request(self):
+    def get_request(self, limit=None, to_ts=None):
         """
         Sends and returns response.
+        :param limit: int, number of data points before to_ts, defaults to self.limit
+        :param to_ts: int, unix timestamp of the last data point, None for the current hour
         :return: response
         """
         params = {
             'fsym': 'BTC',                                                          # coin symbol
             'tsym': 'USD',                                                          # currency symbol to convert to
-            'limit': self.limit,                                                    # number of data points
+            'limit': self.limit if limit is None else limit,                        # number of data points
         }
+        if to_ts is not None:
+            params['toTs'] = to_ts
         headers = {
             'accept': 'application/json',
             'authorization': f'Apikey {self.api_key}'
         }
-        response = requests.get(url=self.url, headers=headers, params=params)
+        self.rate_limiter.acquire('cryptocompare')
+        try:
+            response = self.http_client.get(url=self.url, headers=headers, params=params)
+        except Exception:
+            self.rate_limiter.update('cryptocompare')                       # releases the reserved request
+            raise
+        self.rate_limiter.update('cryptocompare', response.headers)
         if not response:
-            raise Exception(f'BAD RESPONSE: '
-                            f'\nSTATUS: {response.status_code}\nMESSAGE: {response.json()}'
-                            f'\nREQ URL: {response.url}')
+            raise BadResponseError(f'BAD RESPONSE: '
+                                   f'\nSTATUS: {response.status_code}\nMESSAGE: {response.text}'
+                                   f'\nREQ URL: {response.url}')
         return response
 
     def _insert_to_db(self, parsed_response):
@@ -420,6 +1078,17 @@ class BtcExtractorCC:
         :param response:
         :return:
         """
+        parsed = self._parse_points(response)
+        self._insert_to_db(parsed)
+        return parsed
+
+    @staticmethod
+    def _parse_points(response):
+        """
+        Parses candles of the response
+        :param response: response
+        :return: list of dicts, in the column order of the upsert
+        """
         res = response.json()
         data = res.get('Data', {}).get('Data', None)
         if data is None:
@@ -430,9 +1099,91 @@ class BtcExtractorCC:
                                                           'volumeto', 'close')}
             dp['time'] = datetime.fromtimestamp(dp['time']).strftime('%Y-%m-%d %T')
             parsed.append(dp)
-        self._insert_to_db(parsed)
         return parsed
 
+    @staticmethod
+    def find_gaps(start_time=None, end_time=None):
+        """
+        Finds hours missing in btc_hourly_info, except the ones the api is known to skip
+        :param start_time: datetime.datetime, first hour checked, defaults to the first hour in db
+        :param end_time: datetime.datetime, last hour checked, defaults to the last finished hour
+        :return: list of datetime.datetime, missing hours, oldest first
+        """
+        if start_time is None:
+            rows = retrieve_data(QUERIES['btc_hourly_info']['first'])
+            start_time = rows[0][0] if rows else None
+            if start_time is None:
+                return []                                                   # nothing to compare to yet
+        if end_time is None:
+            end_time = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        rows = retrieve_data(QUERIES['btc_hourly_info']['gaps'], (start_time, end_time)) or []
+        return [hour for hour, in rows]
+
+    def plan_requests(self, gaps):
+        """
+        Covers missing hours with as few requests as possible, newest first
+        :param gaps: list of datetime.datetime, missing hours, oldest first
+        :return: list of (last hour, number of candles), every request returns up to MAX_LIMIT candles
+        """
+        plan = []
+        for hour in reversed(gaps):
+            if plan:
+                last_hour, _ = plan[-1]
+                candles = int((last_hour - hour).total_seconds() // 3600) + 1
+                if candles <= self.MAX_LIMIT:
+                    plan[-1] = (last_hour, candles)                         # covered by the same request
+                    continue
+            plan.append((hour, 1))
+        return plan
+
+    def fill_gaps(self, start_time=None, end_time=None, dry_run=False):
+        """
+        Finds hours missing in db, requests them in bulk and upserts them in one batch. Hours the api skipped while
+        returning the hours before and after them (e.g. a DST hour) are saved to btc_missing_hours, find_gaps does not
+        return them anymore, hours after the last returned candle are requested again by the next run.
+        :param start_time: datetime.datetime, first hour checked, defaults to the first hour in db
+        :param end_time: datetime.datetime, last hour checked, defaults to the last finished hour
+        :param dry_run: bool, True to only report the gaps
+        :return: list of datetime.datetime, missing hours
+        """
+        gaps = self.find_gaps(start_time, end_time)
+        plan = self.plan_requests(gaps)
+        print(f'BTC GAPS: {len(gaps)} missing hours, {len(plan)} requests to fill them.')
+        if dry_run:
+            for gap_start, gap_end in self._ranges(gaps):
+                print(f'\t{gap_start} - {gap_end}')
+            return gaps
+        missing = {hour.strftime('%Y-%m-%d %T') for hour in gaps}
+        rows = {}
+        skipped = set()
+        for last_hour, candles in plan:
+            response = self.get_request(limit=max(candles - 1, 1), to_ts=int(last_hour.timestamp()))
+            points = self._parse_points(response)
+            returned = {point['time'] for point in points}
+            for point in points:
+                if point['time'] in missing:
+                    rows[point['time']] = tuple(point.values())
+            if returned:                                                    # the api has the hours around them
+                skipped.update(hour for hour in missing - returned if min(returned) < hour < max(returned))
+        if rows or skipped:
+            insert_many_to_db([(QUERIES['btc_hourly_info']['upsert'], list(rows.values())),
+                               (QUERIES['btc_missing_hours']['upsert'], [(hour,) for hour in sorted(skipped)])],
+                              page_size=max(len(rows), len(skipped)))
+        print(f'BTC GAPS: {len(rows)} hours filled, {len(missing) - len(rows)} not returned by the api, '
+              f'{len(skipped)} of them skipped by the api are not requested again.')
+        return gaps
+
+    @staticmethod
+    def _ranges(hours):
+        """Groups consecutive hours into (first, last) ranges"""
+        ranges = []
+        for hour in hours:
+            if ranges and hour - ranges[-1][1] == timedelta(hours=1):
+                ranges[-1][1] = hour
+            else:
+                ranges.append([hour, hour])
+        return [tuple(hour_range) for hour_range in ranges]
+
     def extract_bitcoin(self):
         print(f'Requesting BitCoin {self.frequency} Data...')
         response = self.get_request()
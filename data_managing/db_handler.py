@@ -1,34 +1,93 @@
-import psycopg2
+import io
+import re
+from functools import lru_cache
 from psycopg2 import DatabaseError
 from psycopg2.extras import execute_values
-from config import USER, DATABASE, PASSWORD, PORT, HOST
+from config import USER, DATABASE, PASSWORD, PORT, HOST, DB_POOL_MIN, DB_POOL_MAX, BULK_LOAD_ROWS
+from db_pool import ConnectionPool
 
+db_pool = ConnectionPool(minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, user=USER, database=DATABASE, host=HOST, port=PORT,
+                         password=PASSWORD, sslmode='require')
+
+
+_UPSERT = re.compile(r'INSERT INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s+%s\s+(ON CONFLICT\s*\(([^)]*)\)\s*DO\s+(\w+).*)$',
+                     re.DOTALL | re.IGNORECASE)
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+@lru_cache(maxsize=None)
+def _parse_upsert(query):
+    """
+    Splits INSERT ... VALUES %s ON CONFLICT (...) query into its parts
+    :return: tuple, (table, columns, conflict clause with the rest of the query, conflict columns, 'UPDATE' or
+        'NOTHING'), None for the other queries
+    """
+    match = _UPSERT.match(query.strip())
+    if match is None:
+        return None
+    table, columns, conflict, keys, action = match.groups()
+    return table, ' '.join(columns.split()), conflict.strip().rstrip(';'), keys, action.upper()
+
+
+def _copy_value(value):
+    """Formats the value for COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _copy_upsert(cursor, query, values_list):
+    """
+    Bulk upsert with the same semantics as execute_values(query): rows are streamed with COPY to a staging table and
+    merged with one INSERT ... SELECT using the query's ON CONFLICT clause. Out of several rows with the same key the
+    last one is merged for DO UPDATE and the first one for DO NOTHING, as if the rows were inserted one by one.
+    :param cursor: cursor, in the caller's transaction
+    :param query: str, upsert query, see _parse_upsert
+    :param values_list: list of tuples
+    :return: list, rows returned by the RETURNING clause, None if the query has none
+    """
+    table, columns, conflict, keys, action = _parse_upsert(query)
+    staging = f'_staging_{table}'
+    cursor.execute(f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA;'
+                   f'ALTER TABLE {staging} ADD COLUMN _row_number BIGINT;')
+    buffer = io.StringIO()
+    for row_number, row in enumerate(values_list):
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write(f'\t{row_number}\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {staging} ({columns}, _row_number) FROM STDIN;', buffer)
+    order = 'DESC' if action == 'UPDATE' else 'ASC'
+    cursor.execute(f"""
+    INSERT INTO {table} ({columns})
+        SELECT DISTINCT ON ({keys}) {columns}
+        FROM {staging}
+        ORDER BY {keys}, _row_number {order}
+    {conflict};
+    """)
+    result = cursor.fetchall() if 'RETURNING' in query else None
+    cursor.execute(f'DROP TABLE {staging};')
+    return result
 
-def create_connection():
-    """Connects to db server"""
-    try:
-        connection = psycopg2.connect(user=USER, database=DATABASE, host=HOST, port=PORT, password=PASSWORD,
-                                      sslmode='require')
-        cursor = connection.cursor()
-    except (Exception, DatabaseError) as err:
-        raise Exception(f'Could not connect to server: {err}')
-    return connection, cursor
+
+def _upsert(cursor, query, values_list, page_size=100):
+    """Writes rows with COPY if the batch has at least BULK_LOAD_ROWS rows, with execute_values otherwise"""
+    if BULK_LOAD_ROWS and len(values_list) >= BULK_LOAD_ROWS and _parse_upsert(query) is not None:
+        return _copy_upsert(cursor, query, values_list)
+    return execute_values(cursor, query, values_list, page_size=page_size, fetch='RETURNING' in query)
 
 
 def create_table(query):
     """Creates sql table"""
-    connection = None
     try:
-        connection, cursor = create_connection()
-        cursor.execute(query)
-        connection.commit()
-        cursor.close()
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+            connection.commit()
         print(f'Table "{query.split()[5]}" has been successfully created!')
     except (Exception, DatabaseError) as err:
         print(f'Failed to create table: {err}')
-    finally:
-        if connection is not None:
-            connection.close()
 
 
 def insert_to_db(values_list: list, query: str):
@@ -37,66 +96,97 @@ def insert_to_db(values_list: list, query: str):
     :param values_list: list, list of tuples separates by coma, e.g. [(1, 3, ..., 2), (2, 1, ... 3)]
     :param query: str, query
     """
-    connection = None
     try:
-        connection, cursor = create_connection()
-        execute_values(cursor, query, values_list)
-        connection.commit()
-        cursor.close()
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                _upsert(cursor, query, values_list)
+            connection.commit()
         print(f'Data has been successfully inserted to {query.split()[2]}')
     except (Exception, DatabaseError) as err:
         raise Exception(f'Failed to insert rows! ERROR: {err}')
-    finally:
-        if connection is not None:
-            connection.close()
+
+
+def insert_many_to_db(batches: list, page_size=100):
+    """
+    Inserts rows into several tables in one transaction, either all of them are written or none
+    :param batches: list, list of (query, values_list) executed in the given order
+    :param page_size: int, max number of rows per statement
+    :return: list, rows returned by the queries with RETURNING clause, None for the rest, in the order of batches
+    """
+    try:
+        with db_pool.connection() as connection:
+            results = []
+            with connection.cursor() as cursor:
+                for query, values_list in batches:
+                    result = None
+                    if values_list:
+                        result = _upsert(cursor, query, values_list, page_size=page_size)
+                    results.append(result)
+            connection.commit()
+        return results
+    except (Exception, DatabaseError) as err:
+        raise Exception(f'Failed to insert rows! ERROR: {err}')
 
 
 def _delete_all_data_from_table(table: str, query=None):
     """Deletes all data from the table"""
     query = query if query else f"""DELETE FROM {table};"""
-    connection = None
     try:
-        connection, cursor = create_connection()
-        cursor.execute(query)
-        connection.commit()
-        cursor.close()
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+            connection.commit()
         print('All data has been deleted from the table.')
     except (Exception, DatabaseError) as err:
         print(f'Failed to delete table {table}. ERROR: {err}')
-    finally:
-        connection.close()
 
 
 def _delete_table(table: str):
     """Deletes passed table"""
     query = f"""DROP TABLE {table};"""
-    connection = None
     try:
-        connection, cursor = create_connection()
-        cursor.execute(query)
-        connection.commit()
-        cursor.close()
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+            connection.commit()
         print(f'Table "{table}" has been deleted')
     except (Exception, DatabaseError) as err:
         print(f'Failed to delete table {table}. ERROR: {err}')
-    finally:
-        connection.close()
 
 
-def retrieve_data(query):
-    """Retrieves all the data"""
-    connection = None
+def execute_query(query, params=None):
+    """
+    Executes a statement that does not return rows, e.g. INSERT ... SELECT
+    :param query: str, query
+    :param params: tuple, query parameters
+    :return: int, number of affected rows
+    """
+    try:
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rowcount = cursor.rowcount
+            connection.commit()
+        return rowcount
+    except (Exception, DatabaseError) as err:
+        raise Exception(f'Failed to execute query! ERROR: {err}')
+
+
+def retrieve_data(query, params=None):
+    """
+    Retrieves all the data, quietly since the extraction looks rows up for every page (e.g. ChangeFilter), only
+    failures are printed
+    :param query: str, query
+    :param params: tuple, query parameters
+    """
     rows = None
     try:
-        connection, cursor = create_connection()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        print(f'Rows have been retrieved')
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
     except (Exception, DatabaseError) as err:
         print(f'Failed to retrieve rows. ERROR: {err}')
-    finally:
-        connection.close()
     return rows
 
 
@@ -113,81 +203,117 @@ CREATE TABLE IF NOT EXISTS user_info
     following_count INTEGER,
     tweet_count INTEGER,
     listed_count INTEGER,
+    row_hash BIGINT,
     PRIMARY KEY(pk_id, account_id)
     );
 """
 user_info_upsert = """
 INSERT INTO user_info 
-(account_created, account_id, account_name, verified, follower_count, following_count, tweet_count, listed_count)
+(account_created, account_id, account_name, verified, follower_count, following_count, tweet_count, listed_count,
+ row_hash)
     VALUES %s
     ON CONFLICT (account_id) DO UPDATE 
     SET verified = EXCLUDED.verified, 
         follower_count = EXCLUDED.follower_count,
         following_count = EXCLUDED.following_count,
         tweet_count = EXCLUDED.tweet_count,
-        listed_count = EXCLUDED.listed_count;
+        listed_count = EXCLUDED.listed_count,
+        row_hash = EXCLUDED.row_hash
+    WHERE user_info.row_hash IS DISTINCT FROM EXCLUDED.row_hash;
 """
 user_info_retrieve_all = """
 SELECT (account_created, account_id, account_name, verified, follower_count, following_count, tweet_count, listed_count)
 FROM user_info
 """
 
-# RAW TWEETS DB
-raw_tweets_info = """
-CREATE TABLE IF NOT EXISTS raw_tweets_info 
-    (
-    pk_id SERIAL,
-    tweet_created TIMESTAMP,
-    conversation_id VARCHAR(30),
-    tweet_id VARCHAR(30) UNIQUE,
-    author_id VARCHAR(30),
-    tweet_text TEXT,
-    retweet_count INTEGER,
-    reply_count INTEGER,
-    like_count INTEGER,
-    quote_count INTEGER,
-    PRIMARY KEY(pk_id, tweet_id),
-    CONSTRAINT fk_author_id
-        FOREIGN KEY(author_id)
-            REFERENCES user_info(account_id)
-    );
-"""
+# RAW TWEETS DB (partitioned by month of tweet_created, the table is created by migrations, see migrations.py and
+# partitioning.py), partitioned tables can not return xmax, rows inserted by the upsert's transaction are told by
+# first_seen instead
 raw_tweets_upsert = """
 INSERT INTO raw_tweets_info 
-(tweet_created, conversation_id, tweet_id, author_id, tweet_text, retweet_count, reply_count, like_count, quote_count)
+(tweet_created, conversation_id, tweet_id, author_id, tweet_text, retweet_count, reply_count, like_count, quote_count,
+ row_hash)
     VALUES %s
-    ON CONFLICT (tweet_id) DO UPDATE
+    ON CONFLICT (tweet_id, tweet_created) DO UPDATE
     SET retweet_count = EXCLUDED.retweet_count,
         reply_count = EXCLUDED.reply_count,
         like_count = EXCLUDED.like_count,
-        quote_count = EXCLUDED.quote_count;
+        quote_count = EXCLUDED.quote_count,
+        row_hash = EXCLUDED.row_hash
+    WHERE raw_tweets_info.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+    RETURNING (first_seen = NOW()) AS inserted;
 """
 raw_tweets_retrieve_all = """
 SELECT (tweet_created, conversation_id, author_id, tweet_text, retweet_count, reply_count, like_count, quote_count)
 FROM raw_tweets_info
 """
 
-# PREPROCESSED TWEETS DB
-preprocessed_tweets_info = """
-CREATE TABLE IF NOT EXISTS preprocessed_tweets_info 
+# SENTIMENT AGGREGATES (per conversation root account, hour and day, maintained by the rollup after preprocessing)
+sentiment_aggregates = """
+CREATE TABLE IF NOT EXISTS sentiment_aggregates
     (
-    pk_id SERIAL,
-    tweet_id VARCHAR(30) UNIQUE,
-    cleaned_text TEXT,
-    vader_compound FLOAT,
-    text_blob_polarity FLOAT,
-    text_blob_subjectivity FLOAT,
-    PRIMARY KEY(pk_id),
-    CONSTRAINT fk_tweet_id
-        FOREIGN KEY(tweet_id)
-            REFERENCES raw_tweets_info(tweet_id)
+    root_account VARCHAR(30),
+    interval_start TIMESTAMP,
+    granularity VARCHAR(4),
+    tweet_count BIGINT,
+    vader_compound_sum FLOAT,
+    vader_compound_sum_sq FLOAT,
+    text_blob_polarity_sum FLOAT,
+    text_blob_polarity_sum_sq FLOAT,
+    text_blob_subjectivity_sum FLOAT,
+    text_blob_subjectivity_sum_sq FLOAT,
+    PRIMARY KEY(root_account, interval_start, granularity)
     );
 """
+# preprocessed tweets not aggregated yet are flagged as aggregated and added to the aggregates in the same statement,
+# so every tweet is counted once; tweets whose conversation root is not known yet stay pending for the next rollup,
+# once they are older than the passed number of hours they are aggregated under their own author, e.g. replies of the
+# target accounts in threads of other users, whose roots are never extracted
+sentiment_aggregates_rollup = """
+WITH pending AS (
+    UPDATE preprocessed_tweets_info scored
+    SET aggregated = TRUE
+    FROM raw_tweets_info tweet
+    LEFT JOIN conversation_roots root ON root.conversation_id = tweet.conversation_id
+    WHERE NOT scored.aggregated
+        AND tweet.tweet_id = scored.tweet_id AND tweet.tweet_created = scored.tweet_created
+        AND (root.author_id IS NOT NULL OR scored.tweet_created < NOW() - %s * INTERVAL '1 hour')
+    RETURNING COALESCE(root.author_id, tweet.author_id) AS author_id, scored.tweet_created, scored.vader_compound,
+              scored.text_blob_polarity, scored.text_blob_subjectivity
+)
+INSERT INTO sentiment_aggregates
+(root_account, interval_start, granularity, tweet_count, vader_compound_sum, vader_compound_sum_sq,
+ text_blob_polarity_sum, text_blob_polarity_sum_sq, text_blob_subjectivity_sum, text_blob_subjectivity_sum_sq)
+    SELECT author_id, date_trunc(granularity, tweet_created), granularity, COUNT(*),
+           SUM(vader_compound), SUM(vader_compound ^ 2),
+           SUM(text_blob_polarity), SUM(text_blob_polarity ^ 2),
+           SUM(text_blob_subjectivity), SUM(text_blob_subjectivity ^ 2)
+    FROM pending
+    CROSS JOIN (VALUES ('hour'), ('day')) AS granularities(granularity)
+    GROUP BY author_id, date_trunc(granularity, tweet_created), granularity
+    ON CONFLICT (root_account, interval_start, granularity) DO UPDATE
+    SET tweet_count = sentiment_aggregates.tweet_count + EXCLUDED.tweet_count,
+        vader_compound_sum = sentiment_aggregates.vader_compound_sum + EXCLUDED.vader_compound_sum,
+        vader_compound_sum_sq = sentiment_aggregates.vader_compound_sum_sq + EXCLUDED.vader_compound_sum_sq,
+        text_blob_polarity_sum = sentiment_aggregates.text_blob_polarity_sum + EXCLUDED.text_blob_polarity_sum,
+        text_blob_polarity_sum_sq = sentiment_aggregates.text_blob_polarity_sum_sq + EXCLUDED.text_blob_polarity_sum_sq,
+        text_blob_subjectivity_sum = sentiment_aggregates.text_blob_subjectivity_sum
+                                     + EXCLUDED.text_blob_subjectivity_sum,
+        text_blob_subjectivity_sum_sq = sentiment_aggregates.text_blob_subjectivity_sum_sq
+                                        + EXCLUDED.text_blob_subjectivity_sum_sq;
+"""
+sentiment_aggregates_retrieve_all = """
+SELECT root_account, interval_start, granularity, tweet_count, vader_compound_sum, vader_compound_sum_sq,
+       text_blob_polarity_sum, text_blob_polarity_sum_sq, text_blob_subjectivity_sum, text_blob_subjectivity_sum_sq
+FROM sentiment_aggregates
+"""
+
+# PREPROCESSED TWEETS DB (partitioned by month of tweet_created, the table is created by migrations)
 preprocessed_tweets_info_upsert = """
-INSERT INTO preprocessed_tweets_info 
-(tweet_id, cleaned_text, vader_compound, text_blob_polarity, text_blob_subjectivity)
+INSERT INTO preprocessed_tweets_info
+(tweet_id, cleaned_text, vader_compound, text_blob_polarity, text_blob_subjectivity, tweet_created)
     VALUES %s
-    ON CONFLICT (tweet_id) DO NOTHING;
+    ON CONFLICT (tweet_id, tweet_created) DO NOTHING;
 """
 preprocessed_tweets_info_retrieve_all = """
 SELECT (tweet_id, cleaned_text, vader_compound, text_blob_polarity, text_blob_subjectivity)
@@ -219,6 +345,31 @@ btc_daily_retrieve_all = """
 SELECT (input_date, open_price, high_price, low_price, close_price, adj_close_price, volume)
 FROM btc_daily_info
 """
+btc_daily_last = """
+SELECT MAX(input_date)
+FROM btc_daily_info;
+"""
+btc_daily_rollup = """
+INSERT INTO btc_daily_info
+(input_date, open_price, high_price, low_price, close_price, adj_close_price, volume)
+    SELECT input_datetime::DATE,
+           (ARRAY_AGG(open_price ORDER BY input_datetime))[1],
+           MAX(high_price),
+           MIN(low_price),
+           (ARRAY_AGG(close_price ORDER BY input_datetime DESC))[1],
+           (ARRAY_AGG(close_price ORDER BY input_datetime DESC))[1],
+           SUM(volumeto)
+    FROM btc_hourly_info
+    WHERE input_datetime >= %s AND input_datetime < %s
+    GROUP BY input_datetime::DATE
+    ON CONFLICT (input_date) DO UPDATE
+    SET open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        adj_close_price = EXCLUDED.adj_close_price,
+        volume = EXCLUDED.volume;
+"""
 
 # BTC HOURLY INFO
 btc_hourly = """
@@ -251,6 +402,183 @@ btc_hourly_retrieve_all = """
 SELECT (input_datetime, high_price, low_price, open_price, volumefrom, volumeto, close_price)
 FROM btc_hourly_info
 """
+btc_hourly_first = """
+SELECT MIN(input_datetime)
+FROM btc_hourly_info;
+"""
+btc_hourly_gaps = """
+SELECT hours.input_datetime
+FROM generate_series(%s::TIMESTAMP, %s::TIMESTAMP, INTERVAL '1 hour') AS hours(input_datetime)
+LEFT JOIN btc_hourly_info USING (input_datetime)
+LEFT JOIN btc_missing_hours USING (input_datetime)
+WHERE btc_hourly_info.input_datetime IS NULL
+    AND btc_missing_hours.input_datetime IS NULL
+ORDER BY hours.input_datetime;
+"""
+# BTC MISSING HOURS (hours the api skipped while returning the hours around them, they are not requested again)
+btc_missing_hours = """
+CREATE TABLE IF NOT EXISTS btc_missing_hours
+    (
+    input_datetime TIMESTAMP,
+    confirmed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(input_datetime)
+    );
+"""
+btc_missing_hours_upsert = """
+INSERT INTO btc_missing_hours
+(input_datetime)
+    VALUES %s
+    ON CONFLICT (input_datetime) DO NOTHING;
+"""
+btc_missing_hours_retrieve_all = """
+SELECT input_datetime, confirmed_at
+FROM btc_missing_hours
+ORDER BY input_datetime;
+"""
+# ACCOUNT CHECKPOINTS (high-water marks of the accounts' timelines)
+account_checkpoints = """
+CREATE TABLE IF NOT EXISTS account_checkpoints
+    (
+    account_id VARCHAR(30),
+    last_tweet_id VARCHAR(30),
+    last_tweet_created TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(account_id)
+    );
+"""
+account_checkpoints_upsert = """
+INSERT INTO account_checkpoints
+(account_id, last_tweet_id, last_tweet_created)
+    VALUES %s
+    ON CONFLICT (account_id) DO UPDATE
+    SET last_tweet_id = EXCLUDED.last_tweet_id,
+        last_tweet_created = EXCLUDED.last_tweet_created,
+        updated_at = NOW()
+    WHERE account_checkpoints.last_tweet_id::NUMERIC < EXCLUDED.last_tweet_id::NUMERIC;
+"""
+account_checkpoints_retrieve_all = """
+SELECT account_id, last_tweet_id, last_tweet_created
+FROM account_checkpoints
+"""
+# PAGINATION CHECKPOINTS (progress of unfinished timeline/comment windows)
+pagination_checkpoints = """
+CREATE TABLE IF NOT EXISTS pagination_checkpoints
+    (
+    target_key TEXT,
+    window_start VARCHAR(20),
+    window_end VARCHAR(20),
+    next_token TEXT,
+    since_id VARCHAR(30),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(target_key, window_start, window_end)
+    );
+"""
+pagination_checkpoints_upsert = """
+INSERT INTO pagination_checkpoints
+(target_key, window_start, window_end, next_token, since_id)
+    VALUES %s
+    ON CONFLICT (target_key, window_start, window_end) DO UPDATE
+    SET next_token = EXCLUDED.next_token,
+        updated_at = NOW();
+"""
+pagination_checkpoints_delete = """
+DELETE FROM pagination_checkpoints
+    WHERE (target_key, window_start, window_end) IN (VALUES %s);
+"""
+pagination_checkpoints_retrieve_all = """
+SELECT target_key, window_start, window_end, next_token, since_id
+FROM pagination_checkpoints
+ORDER BY updated_at
+"""
+# CONVERSATION REPLY COUNTS (reply count seen at the last comment crawl of a conversation, pending_since is the start
+# of the comment window a deferred conversation has to be crawled from, see migrations)
+conversation_reply_counts = """
+CREATE TABLE IF NOT EXISTS conversation_reply_counts
+    (
+    conversation_id VARCHAR(30),
+    reply_count INTEGER,
+    last_crawled TIMESTAMP,
+    PRIMARY KEY(conversation_id)
+    );
+"""
+conversation_reply_counts_upsert = """
+INSERT INTO conversation_reply_counts
+(conversation_id, reply_count, last_crawled, pending_since)
+    VALUES %s
+    ON CONFLICT (conversation_id) DO UPDATE
+    SET reply_count = EXCLUDED.reply_count,
+        last_crawled = EXCLUDED.last_crawled,
+        pending_since = EXCLUDED.pending_since;
+"""
+conversation_reply_counts_retrieve_all = """
+SELECT conversation_id, reply_count, last_crawled, pending_since
+FROM conversation_reply_counts
+"""
+# CONVERSATION ROOTS (author of the tweet a conversation started with, kept when its partition is archived)
+conversation_roots = """
+CREATE TABLE IF NOT EXISTS conversation_roots
+    (
+    conversation_id VARCHAR(30),
+    author_id VARCHAR(30),
+    PRIMARY KEY(conversation_id)
+    );
+"""
+conversation_roots_upsert = """
+INSERT INTO conversation_roots
+(conversation_id, author_id)
+    VALUES %s
+    ON CONFLICT (conversation_id) DO NOTHING;
+"""
+conversation_roots_retrieve_all = """
+SELECT conversation_id, author_id
+FROM conversation_roots
+"""
+# HANDLE REGISTRY (handle -> account id, looked up again once resolved_at is older than the TTL)
+handle_registry = """
+CREATE TABLE IF NOT EXISTS handle_registry
+    (
+    handle VARCHAR(50),
+    account_id VARCHAR(30),
+    resolved_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(handle)
+    );
+"""
+handle_registry_upsert = """
+INSERT INTO handle_registry
+(handle, account_id)
+    VALUES %s
+    ON CONFLICT (handle) DO UPDATE
+    SET account_id = EXCLUDED.account_id,
+        resolved_at = NOW();
+"""
+handle_registry_retrieve_all = """
+SELECT handle, account_id, resolved_at
+FROM handle_registry
+"""
+# BACKFILL SHARDS (finished time-window shards of historical backfills)
+backfill_shards = """
+CREATE TABLE IF NOT EXISTS backfill_shards
+    (
+    target_key TEXT,
+    shard_start VARCHAR(20),
+    shard_end VARCHAR(20),
+    tweet_count INTEGER,
+    finished_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(target_key, shard_start, shard_end)
+    );
+"""
+backfill_shards_upsert = """
+INSERT INTO backfill_shards
+(target_key, shard_start, shard_end, tweet_count)
+    VALUES %s
+    ON CONFLICT (target_key, shard_start, shard_end) DO UPDATE
+    SET tweet_count = EXCLUDED.tweet_count,
+        finished_at = NOW();
+"""
+backfill_shards_retrieve_all = """
+SELECT target_key, shard_start, shard_end, tweet_count
+FROM backfill_shards
+"""
 QUERIES = {
     'user_info': {
         'create_table': user_info,
@@ -258,12 +586,10 @@ QUERIES = {
         'retrieve_all': user_info_retrieve_all,
     },
     'raw_tweets_info': {
-        'create_table': raw_tweets_info,
         'upsert': raw_tweets_upsert,
         'retrieve_all': raw_tweets_retrieve_all,
     },
     'preprocessed_tweets_info': {
-        'create_table': preprocessed_tweets_info,
         'upsert': preprocessed_tweets_info_upsert,
         'retrieve_all': preprocessed_tweets_info_retrieve_all,
     },
@@ -271,10 +597,55 @@ QUERIES = {
         'create_table': btc_daily,
         'upsert': btc_daily_upsert,
         'retrieve_all': btc_hourly_retrieve_all,
+        'last': btc_daily_last,
+        'rollup': btc_daily_rollup,
     },
     'btc_hourly_info': {
         'create_table': btc_hourly,
         'upsert': btc_hourly_upsert,
         'retrieve_all': btc_hourly_retrieve_all,
-    }
+        'first': btc_hourly_first,
+        'gaps': btc_hourly_gaps,
+    },
+    'btc_missing_hours': {
+        'create_table': btc_missing_hours,
+        'upsert': btc_missing_hours_upsert,
+        'retrieve_all': btc_missing_hours_retrieve_all,
+    },
+    'account_checkpoints': {
+        'create_table': account_checkpoints,
+        'upsert': account_checkpoints_upsert,
+        'retrieve_all': account_checkpoints_retrieve_all,
+    },
+    'pagination_checkpoints': {
+        'create_table': pagination_checkpoints,
+        'upsert': pagination_checkpoints_upsert,
+        'delete': pagination_checkpoints_delete,
+        'retrieve_all': pagination_checkpoints_retrieve_all,
+    },
+    'conversation_reply_counts': {
+        'create_table': conversation_reply_counts,
+        'upsert': conversation_reply_counts_upsert,
+        'retrieve_all': conversation_reply_counts_retrieve_all,
+    },
+    'conversation_roots': {
+        'create_table': conversation_roots,
+        'upsert': conversation_roots_upsert,
+        'retrieve_all': conversation_roots_retrieve_all,
+    },
+    'handle_registry': {
+        'create_table': handle_registry,
+        'upsert': handle_registry_upsert,
+        'retrieve_all': handle_registry_retrieve_all,
+    },
+    'backfill_shards': {
+        'create_table': backfill_shards,
+        'upsert': backfill_shards_upsert,
+        'retrieve_all': backfill_shards_retrieve_all,
+    },
+    'sentiment_aggregates': {
+        'create_table': sentiment_aggregates,
+        'rollup': sentiment_aggregates_rollup,
+        'retrieve_all': sentiment_aggregates_retrieve_all,
+    },
 }
\ No newline at end of file
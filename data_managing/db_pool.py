@@ -0,0 +1,191 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import DatabaseError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by db_handler and the dashboard, so queries do not pay a TLS
+    handshake and a backend fork every time. Connections are opened on demand up to maxconn, checkouts wait for a
+    free connection once all of them are taken. Connections idle longer than health_check_interval are checked with
+    SELECT 1 before they are handed out, broken ones are replaced. Idle connections above minconn are closed after
+    max_idle seconds. The pool depends only on psycopg2, so both packages could import it.
+    Example:
+    ```py
+        pool = ConnectionPool(minconn=1, maxconn=10, user=USER, database=DATABASE, host=HOST, port=PORT,
+                              password=PASSWORD, sslmode='require')
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+            connection.commit()
+        print(pool.stats())
+    ```
+    """
+    def __init__(self, minconn=1, maxconn=10, timeout=30, health_check_interval=30, max_idle=300, **connect_kwargs):
+        """
+        Constructor
+        :param minconn: int, connections kept open even when idle
+        :param maxconn: int, max number of open connections
+        :param timeout: float, max seconds a checkout waits for a free connection
+        :param health_check_interval: float, idle seconds after which a connection is checked before it is used
+        :param max_idle: float, idle seconds after which a connection above minconn is closed
+        :param connect_kwargs: psycopg2.connect arguments
+        """
+        if maxconn < max(minconn, 1):
+            raise Exception('ERROR: maxconn has to be at least 1 and not less than minconn.')
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_idle = max_idle
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()                                                # (connection, returned at), newest last
+        self._size = 0                                                      # open connections, idle and checked out
+        self._condition = threading.Condition()
+        self.reset_stats()
+
+    def _connect(self):
+        try:
+            return psycopg2.connect(**self.connect_kwargs)
+        except (Exception, DatabaseError) as err:
+            raise Exception(f'Could not connect to server: {err}')
+
+    @staticmethod
+    def _healthy(connection):
+        """Checks the connection with a round trip"""
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            connection.rollback()
+            return True
+        except (Exception, DatabaseError):
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except (Exception, DatabaseError):
+            pass
+
+    def _checkout(self):
+        """Takes an idle connection or opens a new one, waits while all of them are taken"""
+        started = time.perf_counter()
+        with self._condition:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if not self._idle and self._size >= self.maxconn:
+                        raise Exception(f'ERROR: no free db connection within {self.timeout} sec.')
+            idle = self._idle.pop() if self._idle else None                 # most recently used, likely healthy
+            if idle is None:
+                self._size += 1
+            self._record_checkout(time.perf_counter() - started)
+        try:
+            if idle is None:
+                return self._connect()
+            connection, returned_at = idle
+            if time.monotonic() - returned_at > self.health_check_interval and not self._healthy(connection):
+                self._close(connection)
+                with self._condition:
+                    self._replaced += 1
+                return self._connect()
+            return connection
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _record_checkout(self, waited):
+        """Updates usage statistics, the condition has to be held"""
+        self._checkouts += 1
+        self._wait_time += waited
+        self._max_wait = max(self._max_wait, waited)
+        self._in_use += 1
+        self._max_in_use = max(self._max_in_use, self._in_use)
+
+    def _release_slot(self):
+        """Forgets a connection that was not returned"""
+        with self._condition:
+            self._size -= 1
+            self._in_use -= 1
+            self._condition.notify()
+
+    def _checkin(self, connection):
+        """Returns the connection, closes the broken ones and the idle ones above minconn"""
+        if not connection.closed and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()                                       # never hand out an open transaction
+            except (Exception, DatabaseError):
+                self._close(connection)
+        if connection.closed:
+            self._release_slot()
+            return
+        now = time.monotonic()
+        expired = []
+        with self._condition:
+            self._idle.append((connection, now))
+            self._in_use -= 1
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._condition.notify()
+        for idle in expired:
+            self._close(idle)
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a connection out for the with block, it goes back to the pool afterwards, an uncommitted transaction
+        is rolled back
+        :return: psycopg2 connection
+        """
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+
+    def stats(self):
+        """
+        Usage of the pool since the last reset
+        :return: dict, {'size', 'in_use', 'max_in_use', 'utilization', 'checkouts', 'wait_time', 'max_wait',
+            'replaced'}, utilization is max_in_use / maxconn
+        """
+        with self._condition:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'max_in_use': self._max_in_use,
+                'utilization': self._max_in_use / self.maxconn,
+                'checkouts': self._checkouts,
+                'wait_time': self._wait_time,
+                'max_wait': self._max_wait,
+                'replaced': self._replaced,
+            }
+
+    def reset_stats(self):
+        """Resets usage statistics, connections in use are kept counted"""
+        with self._condition:
+            self._checkouts = 0
+            self._wait_time = 0
+            self._max_wait = 0
+            self._replaced = 0
+            self._in_use = getattr(self, '_in_use', 0)
+            self._max_in_use = self._in_use
+
+    def close(self):
+        """Closes idle connections, checked out ones are closed when they are returned"""
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self.minconn = 0
+            self.max_idle = 0
+        for connection in idle:
+            self._close(connection)
@@ -0,0 +1,150 @@
+import time
+import threading
+from db_handler import insert_many_to_db
+
+
+class DbWriteBuffer:
+    """
+    Collects rows of several tables across the extracted pages and writes them to db in one transaction per flush,
+    so a page costs neither a connection nor a commit. Tables are written in the order they were first added, i.e.
+    users before tweets, to keep the foreign key constraints. Rows of a table with the same key are written once, the
+    last added row wins, since one statement can not upsert the same row twice. That holds across the queries of the
+    table too, e.g. a checkpoint upserted and then deleted is only deleted, whatever order the queries run in, so the
+    key has to point to the same columns in every query of the table. Queries returning whether the row was inserted
+    as the first column, e.g. "(xmax = 0)", let the buffer count rows that were new to the table, as opposed to rows
+    that were already there. Thread-safe.
+    Example:
+    ```py
+        buffer = DbWriteBuffer(flush_rows=1000)
+        buffer.add(QUERIES['user_info']['upsert'], user_rows, key=(1,))            # IMPORTANT: add users first!
+        buffer.add(QUERIES['raw_tweets_info']['upsert'], tweet_rows, key=(2,))     # flushes once 1000 rows are buffered
+        buffer.flush()                                                              # e.g. at the end of the account
+        print(buffer.stats())
+    ```
+    """
+    def __init__(self, flush_rows=1000):
+        """
+        Constructor
+        :param flush_rows: int, number of buffered rows that triggers a flush
+        """
+        self.flush_rows = flush_rows
+        self._batches = {}                                                  # {query: {key: row}}, insertion ordered
+        self._owners = {}                                                   # {(table, key): query holding the row}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flushes = 0
+        self._rows_written = 0
+        self._flush_time = 0
+        self._max_latency = 0
+        self._tables = {}                                                   # {table: [rows, new rows]}
+        self._hooks = []
+
+    def add_flush_hook(self, hook):
+        """
+        Registers callable which is called after every committed flush
+        :param hook: callable, hook(batches), batches is list of (query, rows) that were written
+        """
+        self._hooks.append(hook)
+
+    def add(self, query, rows, key=None):
+        """
+        Buffers rows, flushes the buffer once it holds flush_rows rows
+        :param query: str, query executed with execute_values
+        :param rows: list of tuples
+        :param key: tuple, indices of the columns identifying the row in every query of the table, None if rows are
+            never repeated
+        """
+        self.add_many([(query, rows, key)])
+
+    def add_many(self, batches):
+        """
+        Buffers rows of several tables at once, e.g. a page together with its checkpoints, so they are always flushed
+        in the same transaction
+        :param batches: list of (query, rows, key), see add
+        """
+        with self._lock:
+            for query, rows, key in batches:
+                batch = self._batches.setdefault(query, {})
+                table = self._table(query)
+                for row in rows:
+                    if key is None:
+                        batch[len(batch)] = row
+                        self._size += 1
+                        continue
+                    row_key = tuple(row[i] for i in key)
+                    owner = self._owners.get((table, row_key))
+                    if owner is None:
+                        self._size += 1
+                    elif owner != query:
+                        del self._batches[owner][row_key]                   # the last query of the row wins
+                    self._owners[(table, row_key)] = query
+                    batch[row_key] = row
+            full = self._size >= self.flush_rows
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rows of all the tables in one transaction"""
+        with self._lock:
+            if not self._size:
+                return
+            batches = [(query, list(batch.values())) for query, batch in self._batches.items() if batch]
+            size = self._size
+            start = time.perf_counter()
+            results = insert_many_to_db(batches, page_size=max(len(rows) for _, rows in batches))
+            latency = time.perf_counter() - start
+            for (query, rows), result in zip(batches, results):
+                table = self._tables.setdefault(self._table(query), [0, 0])
+                table[0] += len(rows)
+                if result is not None:
+                    table[1] += sum(1 for row in result if row[0])             # row[0] is True for inserted rows
+            for hook in self._hooks:
+                hook(batches)
+            self._batches = {}
+            self._owners = {}
+            self._size = 0
+            self._flushes += 1
+            self._rows_written += size
+            self._flush_time += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    @staticmethod
+    def _table(query):
+        """Returns table of the INSERT INTO or DELETE FROM query"""
+        return query.split()[2]
+
+    def stats(self):
+        """
+        Summary of the flushes
+        :return: dict, {'flushes', 'rows', 'write_time', 'mean_latency', 'max_latency', 'rows_per_sec'}, time in
+            seconds
+        """
+        with self._lock:
+            if not self._flushes:
+                return {'flushes': 0, 'rows': 0, 'write_time': 0}
+            return {
+                'flushes': self._flushes,
+                'rows': self._rows_written,
+                'write_time': self._flush_time,
+                'mean_latency': self._flush_time / self._flushes,
+                'max_latency': self._max_latency,
+                'rows_per_sec': self._rows_written / self._flush_time if self._flush_time else None,
+            }
+
+    def table_stats(self):
+        """
+        Rows written per table
+        :return: dict, {table: (rows, new rows)}, new rows are counted only for the queries returning whether the row
+            was inserted
+        """
+        with self._lock:
+            return {table: tuple(counts) for table, counts in self._tables.items()}
+
+    def reset_stats(self):
+        """Resets flush statistics"""
+        with self._lock:
+            self._flushes = 0
+            self._rows_written = 0
+            self._flush_time = 0
+            self._max_latency = 0
+            self._tables = {}
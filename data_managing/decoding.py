@@ -0,0 +1,72 @@
+import json
+from collections import namedtuple
+
+try:
+    import orjson                                                           # optional, ~2-3x faster than json
+except ImportError:
+    orjson = None
+
+# column order of the upsert queries in db_handler
+TweetRow = namedtuple('TweetRow', ['tweet_created', 'conversation_id', 'tweet_id', 'author_id', 'text',
+                                   'retweet_count', 'reply_count', 'like_count', 'quote_count'])
+UserRow = namedtuple('UserRow', ['account_created', 'account_id', 'name', 'verified', 'follower_count',
+                                 'following_count', 'tweet_count', 'listed_count'])
+
+
+def loads(content):
+    """
+    Parses json, with orjson if it is installed
+    :param content: bytes or str
+    :return: parsed json
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def dumps(obj):
+    """
+    Serializes to json, with orjson if it is installed
+    :param obj: json serializable object
+    :return: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def payload(response):
+    """
+    Parses response body once, the result is cached on the response, so every check of the same response reuses it.
+    :param response: requests.Response
+    :return: dict, parsed body, empty dict if the body is not json (e.g. plain text 429/5xx)
+    """
+    parsed = getattr(response, '_payload', None)
+    if parsed is None:
+        try:
+            parsed = loads(response.content)
+        except ValueError:
+            parsed = {}
+        response._payload = parsed
+    return parsed
+
+
+def decode_page(page):
+    """
+    Turns a page of tweets with expanded authors into rows, ready for execute_values
+    :param page: dict, parsed body of a timeline/search page
+    :return: tuple, (list of TweetRow, list of UserRow, meta)
+    """
+    tweets = []
+    for tweet in page.get('data', ()):
+        metrics = tweet['public_metrics']
+        tweets.append(TweetRow(tweet.get('created_at'), tweet.get('conversation_id'), tweet['id'],
+                               tweet.get('author_id'), tweet.get('text'), metrics['retweet_count'],
+                               metrics['reply_count'], metrics['like_count'], metrics['quote_count']))
+    users = {}                                                              # author might be on the page several times
+    for user in page.get('includes', {}).get('users', ()):
+        metrics = user['public_metrics']
+        users[user['id']] = UserRow(user.get('created_at'), user['id'], user.get('name'), user.get('verified'),
+                                    metrics['followers_count'], metrics['following_count'], metrics['tweet_count'],
+                                    metrics['listed_count'])
+    return tweets, list(users.values()), page.get('meta', {})
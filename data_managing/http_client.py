@@ -0,0 +1,136 @@
+import time
+import random
+import threading
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class BadResponseError(Exception):
+    """Raised when API responds with non-2xx status (after retries)."""
+
+
+class HttpClient:
+    """
+    Shared HTTP client for the extractors. Keeps persistent keep-alive connection pools per host, so pages do not pay
+    TCP+TLS handshake every time, retries 5xx responses and connection resets with jittered exponential backoff and
+    records latency of every request. Thread-safe.
+    Example:
+    ```py
+        client = HttpClient(pool_maxsize=8)
+        response = client.get(url, params=params, headers=headers)
+        print(client.latency_stats())
+    ```
+    """
+    def __init__(self, pool_connections=4, pool_maxsize=10, max_retries=5, backoff_factor=0.5, max_backoff=60,
+                 timeout=30):
+        """
+        Constructor
+        :param pool_connections: int, number of hosts to keep connection pools for
+        :param pool_maxsize: int, max number of keep-alive connections per host
+        :param max_retries: int, number of retries on 5xx and connection errors
+        :param backoff_factor: float, base of the exponential backoff in seconds
+        :param max_backoff: float, max backoff in seconds
+        :param timeout: float, seconds to wait for the server
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._hooks = []
+        self._latencies = deque(maxlen=100000)
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Registers callable which is called after every request
+        :param hook: callable, hook(response, latency)
+        """
+        self._hooks.append(hook)
+
+    def _backoff(self, attempt):
+        """Full jitter exponential backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def get(self, url, params=None, headers=None):
+        """
+        Sends GET request, retries on 5xx and connection errors.
+        :param url: str, url
+        :param params: dict, query parameters
+        :param headers: dict, headers
+        :return: response, response.latency holds request latency in seconds
+        """
+        attempt = 0
+        while True:
+            error = None
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url=url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = err
+            latency = time.perf_counter() - start
+            with self._lock:
+                self._latencies.append(latency)
+            if response is not None:
+                response.latency = latency
+                for hook in self._hooks:
+                    hook(response, latency)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            wait = self._backoff(attempt)
+            reason = error if error is not None else f'STATUS {response.status_code}'
+            print(f'Request failed ({reason}), retrying in {wait:.1f} sec...')
+            with self._lock:
+                self._retries += 1
+            time.sleep(wait)
+            attempt += 1
+
+    def latency_stats(self):
+        """
+        Summary of request latencies
+        :return: dict, {'requests', 'retries', 'mean', 'p50', 'p95', 'max'} in seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            retries = self._retries
+        if not latencies:
+            return {'requests': 0, 'retries': retries}
+        return {
+            'requests': len(latencies),
+            'retries': retries,
+            'mean': sum(latencies) / len(latencies),
+            'p50': latencies[int(0.50 * (len(latencies) - 1))],
+            'p95': latencies[int(0.95 * (len(latencies) - 1))],
+            'max': latencies[-1],
+        }
+
+    def reset_stats(self):
+        """Resets latency statistics"""
+        with self._lock:
+            self._latencies.clear()
+            self._retries = 0
+
+
+_DEFAULT_CLIENT = None
+_DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def default_client(pool_maxsize=10):
+    """Returns process wide client shared by all the extractors"""
+    global _DEFAULT_CLIENT
+    with _DEFAULT_CLIENT_LOCK:
+        if _DEFAULT_CLIENT is None:
+            _DEFAULT_CLIENT = HttpClient(pool_maxsize=pool_maxsize)
+        return _DEFAULT_CLIENT
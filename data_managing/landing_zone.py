@@ -0,0 +1,153 @@
+"""
+Append-only store of the raw pages fetched from Twitter, partitioned by the hour they were fetched in.
+Replay re-runs parsing and db loading from the stored pages, nothing is requested.
+Usage:
+    python landing_zone.py landing/ 2022-06-01 2022-06-02T12:00
+"""
+import io
+import os
+import gzip
+import argparse
+import threading
+from datetime import datetime, timedelta
+from decoding import loads, dumps
+
+try:
+    import zstandard                                                        # optional, ~3x faster than gzip
+except ImportError:
+    zstandard = None
+
+
+class LandingZone:
+    """
+    Writes every fetched page as a JSON line to root/date=YYYY-MM-DD/hour=HH/part-<opened>-<pid>.jsonl.zst (.gz when
+    zstandard is not installed). Files are never appended to once closed, a writer opens a new part for every hour and
+    after every close, so several processes could land pages at once. Thread-safe.
+    Example:
+    ```py
+        landing_zone = LandingZone('landing/')
+        landing_zone.write(page, url)                               # for every page
+        landing_zone.close()                                        # at the end of the run
+        for record in landing_zone.read(datetime(2022, 6, 1), datetime(2022, 6, 2)):
+            record['page']
+    ```
+    """
+    def __init__(self, root, codec=None, level=3):
+        """
+        Constructor
+        :param root: str, directory of the landing zone
+        :param codec: str, 'zstd' or 'gzip', None for zstd if it is installed
+        :param level: int, compression level
+        """
+        codec = codec if codec else ('zstd' if zstandard is not None else 'gzip')
+        if codec == 'zstd' and zstandard is None:
+            raise Exception('ERROR: zstd codec needs zstandard package installed.')
+        if codec not in ('zstd', 'gzip'):
+            raise Exception(f'ERROR: unknown codec {codec}.')
+        self.root = root
+        self.codec = codec
+        self.level = level
+        self._hour = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def partition(self, hour):
+        """Returns directory of the hour"""
+        return os.path.join(self.root, f'date={hour:%Y-%m-%d}', f'hour={hour:%H}')
+
+    def _open(self, hour):
+        """Opens a new part file in the hour's partition"""
+        directory = self.partition(hour)
+        os.makedirs(directory, exist_ok=True)
+        name = f'part-{datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}.jsonl'
+        if self.codec == 'zstd':
+            raw = open(os.path.join(directory, f'{name}.zst'), 'xb')
+            return zstandard.ZstdCompressor(level=self.level).stream_writer(raw)
+        return gzip.open(os.path.join(directory, f'{name}.gz'), 'xb', compresslevel=self.level)
+
+    def write(self, page, url=None, fetched_at=None):
+        """
+        Lands the page
+        :param page: dict, parsed body of the response
+        :param url: str, url the page was fetched from
+        :param fetched_at: datetime.datetime, defaults to now
+        """
+        fetched_at = fetched_at if fetched_at else datetime.now()
+        line = dumps({'fetched_at': fetched_at.isoformat(), 'url': url, 'page': page}) + b'\n'
+        hour = fetched_at.replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            if hour != self._hour:
+                self._close()
+                self._file = self._open(hour)
+                self._hour = hour
+            self._file.write(line)
+
+    def _close(self):
+        """Closes the open part, the lock has to be held"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._hour = None
+
+    def close(self):
+        """Closes the open part, the next page opens a new one"""
+        with self._lock:
+            self._close()
+
+    def files(self, start_time, end_time):
+        """
+        Lists part files of the hours within the range
+        :param start_time: datetime.datetime, start of the range
+        :param end_time: datetime.datetime, end of the range, exclusive
+        :return: list of paths, in the order they were written
+        """
+        paths = []
+        hour = start_time.replace(minute=0, second=0, microsecond=0)
+        while hour < end_time:
+            directory = self.partition(hour)
+            if os.path.isdir(directory):
+                paths.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                             if name.startswith('part-'))
+            hour += timedelta(hours=1)
+        return paths
+
+    @staticmethod
+    def _lines(path):
+        """Yields lines of the part file"""
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise Exception(f'ERROR: {path} needs zstandard package installed.')
+            with open(path, 'rb') as raw:
+                with io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw)) as file:
+                    yield from file
+        else:
+            with gzip.open(path, 'rb') as file:
+                yield from file
+
+    def read(self, start_time, end_time):
+        """
+        Yields pages landed within the range
+        :param start_time: datetime.datetime, start of the range
+        :param end_time: datetime.datetime, end of the range, exclusive
+        :return: generator of dicts, {'fetched_at', 'url', 'page'}
+        """
+        for path in self.files(start_time, end_time):
+            for line in self._lines(path):
+                if line.strip():
+                    yield loads(line)
+
+
+if __name__ == '__main__':
+    from config import HTTP_POOL_SIZE
+    from http_client import HttpClient
+    from manage import build_tweet_extractor
+
+    parser = argparse.ArgumentParser(description='Parses the landed pages again and loads them to db.')
+    parser.add_argument('root', help='directory of the landing zone')
+    parser.add_argument('start', type=datetime.fromisoformat, help='start of the range, e.g. 2022-06-01')
+    parser.add_argument('end', type=datetime.fromisoformat, help='end of the range, e.g. 2022-06-02T12:00')
+    args = parser.parse_args()
+    tweet_extractor = build_tweet_extractor(HttpClient(pool_maxsize=HTTP_POOL_SIZE), landing_zone=None)
+    records = LandingZone(args.root).read(args.start, args.end)
+    pages = tweet_extractor.reprocess(record['page'] for record in records)
+    print(f'REPLAYED {pages} pages from {args.root}.')
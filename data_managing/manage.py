@@ -1,22 +1,35 @@
+import sys
 import datetime
 from datetime import timedelta
 import time
 import pandas as pd
 from apscheduler.schedulers.background import BackgroundScheduler
 from config import *
-from data_extraction import TweetRetriever, BtcExtractorYahoo, BtcExtractorCC
+from data_extraction import TweetRetriever, BtcExtractorYahoo, BtcExtractorCC, BtcDailyRollup
+from http_client import HttpClient
+from crawl_planner import CommentCrawlPlanner
+from db_writer import DbWriteBuffer
+from replay import ResponseRecorder
+from credentials import Credentials, CredentialPool
+from telemetry import RunMetrics
+from landing_zone import LandingZone
+from streaming import StreamIngestor, build_source
+from migrations import migrate
+from partitioning import ensure_partitions, maintain_partitions
 from preprocessing import text_pipe
-from db_handler import insert_to_db, retrieve_data, create_table, create_connection, QUERIES
+from db_handler import insert_to_db, retrieve_data, create_table, execute_query, db_pool, QUERIES
 
 # CHECK DB CONNECTION
-if create_connection():
+with db_pool.connection():                                                  # raises if the server can not be reached
     print('Successful Connection to DataBase!')
-else:
-    raise Exception('ERROR: Could NOT connect to the database!')
 
 # CREATE TABLES
 for table in QUERIES.values():
-    create_table(table['create_table'])
+    if 'create_table' in table:                                             # tweet tables are created by migrations
+        create_table(table['create_table'])
+migrate()
+ensure_partitions(PARTITION_MONTHS_AHEAD)
+execute_query(QUERIES['sentiment_aggregates']['rollup'], (ROOT_WAIT_HOURS,))  # tweets left pending by the last run
 
 
 def preprocess_extracted_data(start_time):
@@ -35,26 +48,68 @@ def preprocess_extracted_data(start_time):
     FROM raw_tweets_info
     WHERE tweet_created >= '{start_time.strftime('%Y-%m-%d %T')}'::timestamp;
     """
-    df = pd.DataFrame(retrieve_data(query=query), columns=['tweet_created', 'conversation_id', 'tweet_id',
-                                                           'author_id', 'text'])
+    preprocess_tweets(retrieve_data(query=query))
+    print('Preprocessing is finished...')
+
+
+def preprocess_tweets(rows):
+    """
+    Preprocesses tweets, writes them to db
+    :param rows: list of (tweet_created, conversation_id, tweet_id, author_id, text, ...) tuples, e.g. TweetRows
+    """
+    if not rows:
+        return
+    df = pd.DataFrame([row[:5] for row in rows], columns=['tweet_created', 'conversation_id', 'tweet_id',
+                                                          'author_id', 'text'])
     df = text_pipe.fit_transform(df)
     rows_to_insert = [tuple(row) for row in df.loc[:, :].values.tolist()]
     insert_to_db(rows_to_insert, query=QUERIES['preprocessed_tweets_info']['upsert'])
-    print('Preprocessing is finished...')
+    execute_query(QUERIES['sentiment_aggregates']['rollup'], (ROOT_WAIT_HOURS,))
 
 
-def extract_tweets_hourly(extractor):
+def build_tweet_extractor(http_client, target_accounts=TARGET_ACCOUNTS, base_url=TWITTER_BASE_URL,
+                          landing_zone=LANDING_ZONE):
+    """
+    Builds TweetRetriever from the config, with both credential sets in its pool
+    :param http_client: HttpClient, shared http client
+    :param target_accounts: list of targets' handles
+    :param base_url: str, twitter api root
+    :param landing_zone: str, directory raw pages are landed to, None to skip
+    :return: TweetRetriever
+    """
+    credential_pool = CredentialPool([
+        Credentials('pr', API_KEY, API_SECRET_KEY, ACCESS_TOKEN, ACCESS_TOKEN_SECRET, BEARER_TOKEN),
+        Credentials('gc', GC_API_KEY, GC_API_SECRET_KEY, GC_ACCESS_TOKEN, GC_ACCESS_TOKEN_SECRET, GC_BEARER_TOKEN),
+    ])
+    crawl_planner = CommentCrawlPlanner(request_budget=COMMENT_REQUEST_BUDGET or None) if PLAN_COMMENTS else None
+    return TweetRetriever(target_accounts, API_KEY, API_SECRET_KEY, ACCESS_TOKEN,
+                          ACCESS_TOKEN_SECRET, BEARER_TOKEN, http_client=http_client,
+                          checkpoint_overlap=CHECKPOINT_OVERLAP, batch_comments=BATCH_COMMENTS,
+                          query_max_length=QUERY_MAX_LENGTH, crawl_planner=crawl_planner,
+                          handle_ttl=HANDLE_TTL, write_buffer=DbWriteBuffer(flush_rows=DB_FLUSH_ROWS),
+                          pipeline_depth=PIPELINE_DEPTH, base_url=base_url, credential_pool=credential_pool,
+                          metrics=RunMetrics(jsonl_path=METRICS_JSONL, prom_path=METRICS_PROM),
+                          detect_changes=CHANGE_CACHE_SIZE > 0, change_cache_size=CHANGE_CACHE_SIZE,
+                          landing_zone=LandingZone(landing_zone, codec=LANDING_CODEC) if landing_zone else None)
+
+
+def extract_tweets_hourly(extractor, concurrency=EXTRACTION_CONCURRENCY):
     """
     Extracts raw tweets => raw_tweets_info db;
     Preprocesses raw tweets => preprocessed_tweets_info db
     :param extractor: instance of TweetRetriever
+    :param concurrency: int, > 1 to extract several accounts/conversations at once
     :return:
     """
     end_time = datetime.datetime.now() - datetime.timedelta(seconds=30)                            # -30 for Twitter API
     comments_start_time = datetime.datetime.now() - datetime.timedelta(hours=1, seconds=30)        # -30 to match up
     tweets_start_time = datetime.datetime.now() - datetime.timedelta(hours=12)
     print(f'\n\nEXTRACTING TWEETS\nCM_START_TIME {comments_start_time.strftime("%Y-%m-%d %T")}')
-    extractor.extract_tweets(tweets_start_time, comments_start_time, end_time, include_comments=True)
+    if concurrency > 1:
+        extractor.extract_tweets_async(tweets_start_time, comments_start_time, end_time, include_comments=True,
+                                       concurrency=concurrency)
+    else:
+        extractor.extract_tweets(tweets_start_time, comments_start_time, end_time, include_comments=True)
     # PREPROCESS
     preprocess_extracted_data(comments_start_time)
 
@@ -62,7 +117,7 @@ def extract_tweets_hourly(extractor):
 def extract_btc_daily(extractor):
     """
     Extracts daily stats for bitcoin
-    :param extractor: BtcExtractorYahoo instance
+    :param extractor: BtcDailyRollup or BtcExtractorYahoo instance
     """
     print('\n\nEXTRACTING BTC DAILY')
     extractor.extract_btc()
@@ -76,17 +131,73 @@ def extract_btc_hourly(extractor):
     """
     print('\n\nEXTRACTING BTC HOURLY')
     extractor.extract_bitcoin()
+    extractor.fill_gaps()
+
+
+def preprocess_streamed_tweets():
+    """
+    Preprocesses tweets streamed during the last hour in one window, as extract_tweets_hourly does with the polled
+    ones, so short replies find their parents and the spam filters see the whole hour
+    """
+    preprocess_extracted_data(datetime.datetime.now() - datetime.timedelta(hours=1, seconds=30))
+
+
+def watch_stream(ingestor):
+    """
+    Restarts the stream ingestion once it has ended (e.g. the source closed the stream), since tweets are not polled
+    hourly while they are streamed
+    :param ingestor: StreamIngestor instance
+    """
+    if not ingestor.running():
+        print('STREAM: ingestion has stopped, restarting it.')
+        ingestor.start()
+
+
+def record_hourly_run(path, http_client, tweet_extractor, hourly_btc_extractor):
+    """
+    Runs the hourly tweet and BTC extraction once, recording every response for benchmark_extraction.py
+    :param path: str, .jsonl.gz file the responses are appended to
+    :param http_client: HttpClient, client of the extractors
+    :param tweet_extractor: TweetRetriever instance
+    :param hourly_btc_extractor: BtcExtractorCC instance
+    """
+    recorder = ResponseRecorder(path)
+    http_client.add_hook(recorder)
+    try:
+        extract_tweets_hourly(tweet_extractor)
+        extract_btc_hourly(hourly_btc_extractor)
+    finally:
+        recorder.close()                                                    # a truncated gzip member can not be read
+    print(f'Responses of the run have been recorded to {path}.')
 
 
 if __name__ == '__main__':
-    tweet_extractor = TweetRetriever(TARGET_ACCOUNTS, API_KEY, API_SECRET_KEY, ACCESS_TOKEN,
-                                     ACCESS_TOKEN_SECRET, BEARER_TOKEN)
-    daily_btc_extractor = BtcExtractorYahoo(period='2d', interval='1d')
-    hourly_btc_extractor = BtcExtractorCC(CC_API_KEY)
+    http_client = HttpClient(pool_maxsize=HTTP_POOL_SIZE)
+    tweet_extractor = build_tweet_extractor(http_client)
+    if BTC_DAILY_SOURCE == 'yahoo':
+        daily_btc_extractor = BtcExtractorYahoo(period='2d', interval='1d')
+    else:
+        daily_btc_extractor = BtcDailyRollup()
+    hourly_btc_extractor = BtcExtractorCC(CC_API_KEY, http_client=http_client, base_url=CRYPTOCOMPARE_BASE_URL)
+    if RECORD_RESPONSES:                                                    # a single recorded run, nothing scheduled
+        record_hourly_run(RECORD_RESPONSES, http_client, tweet_extractor, hourly_btc_extractor)
+        sys.exit()
     scheduler = BackgroundScheduler(timezone='US/Eastern')
-    scheduler.add_job(extract_tweets_hourly, 'interval', hours=1, kwargs={'extractor': tweet_extractor})
+    ingestor = None
+    if STREAM_SOURCE:                                                       # tweets are streamed instead of polled
+        ingestor = StreamIngestor(tweet_extractor, build_source(STREAM_SOURCE, bearer_token=BEARER_TOKEN,
+                                                                http_client=http_client, base_url=TWITTER_BASE_URL),
+                                  batch_seconds=STREAM_BATCH_SECONDS, batch_size=STREAM_BATCH_SIZE)
+        ingestor.start()
+        scheduler.add_job(watch_stream, 'interval', minutes=1, kwargs={'ingestor': ingestor})
+        scheduler.add_job(preprocess_streamed_tweets, 'interval', hours=1)
+    else:
+        scheduler.add_job(extract_tweets_hourly, 'interval', hours=1, kwargs={'extractor': tweet_extractor})
     scheduler.add_job(extract_btc_hourly, 'interval', hours=1, kwargs={'extractor': hourly_btc_extractor})
     scheduler.add_job(extract_btc_daily, 'interval', hours=24, kwargs={'extractor': daily_btc_extractor})
+    scheduler.add_job(maintain_partitions, 'interval', hours=24, kwargs={'months_ahead': PARTITION_MONTHS_AHEAD,
+                                                                         'retention_months': TWEETS_RETENTION_MONTHS,
+                                                                         'archive_dir': ARCHIVE_DIR})
     scheduler.start()
     print(F'Press Ctrl+C to exit')
 
@@ -94,4 +205,6 @@ if __name__ == '__main__':
         while True:
             time.sleep(2)
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
+        scheduler.shutdown()                                                # before the watchdog restarts the stream
+        if ingestor is not None:
+            ingestor.stop()
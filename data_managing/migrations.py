@@ -0,0 +1,325 @@
+"""
+Versioned schema migrations, applied in order on top of the CREATE TABLE IF NOT EXISTS baseline of db_handler.
+The tweet tables are created by the migrations only, their final partitioned schema is the result of migration 3
+and the later ones.
+Applied versions are saved to schema_version, every migration runs once per database.
+Usage:
+    python migrations.py [--target 2] [--check]
+"""
+import re
+import json
+import argparse
+from collections import namedtuple
+from psycopg2 import DatabaseError
+from db_handler import db_pool, QUERIES
+
+Migration = namedtuple('Migration', ['version', 'description', 'statements', 'transactional'])
+
+# NOTE: append new migrations, never edit the applied ones!
+#       CREATE INDEX CONCURRENTLY does not block writes but cannot run in a transaction, keep it in non transactional
+#       migrations, one index per statement.
+MIGRATIONS = [
+    Migration(0, 'unpartitioned tweet tables of the first releases, rewritten by migration 3', [  # no-op on old dbs
+        """
+        CREATE TABLE IF NOT EXISTS raw_tweets_info
+            (
+            pk_id SERIAL,
+            tweet_created TIMESTAMP,
+            conversation_id VARCHAR(30),
+            tweet_id VARCHAR(30) UNIQUE,
+            author_id VARCHAR(30),
+            tweet_text TEXT,
+            retweet_count INTEGER,
+            reply_count INTEGER,
+            like_count INTEGER,
+            quote_count INTEGER,
+            row_hash BIGINT,
+            PRIMARY KEY(pk_id, tweet_id),
+            CONSTRAINT fk_author_id
+                FOREIGN KEY(author_id)
+                    REFERENCES user_info(account_id)
+            );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS preprocessed_tweets_info
+            (
+            pk_id SERIAL,
+            tweet_id VARCHAR(30) UNIQUE,
+            cleaned_text TEXT,
+            vader_compound FLOAT,
+            text_blob_polarity FLOAT,
+            text_blob_subjectivity FLOAT,
+            PRIMARY KEY(pk_id),
+            CONSTRAINT fk_tweet_id
+                FOREIGN KEY(tweet_id)
+                    REFERENCES raw_tweets_info(tweet_id)
+            );
+        """,
+    ], True),
+    Migration(1, 'row_hash columns of the change-aware upserts', [
+        'ALTER TABLE user_info ADD COLUMN IF NOT EXISTS row_hash BIGINT;',
+        'ALTER TABLE raw_tweets_info ADD COLUMN IF NOT EXISTS row_hash BIGINT;',
+    ], True),
+    Migration(2, 'indexes of preprocessing, timeline checkpoints and the dashboard', [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS raw_tweets_info_tweet_created_idx '
+        'ON raw_tweets_info (tweet_created);',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS raw_tweets_info_author_id_tweet_created_idx '
+        'ON raw_tweets_info (author_id, tweet_created);',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS raw_tweets_info_conversation_id_idx '
+        'ON raw_tweets_info (conversation_id);',
+    ], False),
+    Migration(3, 'monthly partitions of raw and preprocessed tweets by tweet_created', [
+        'ALTER TABLE preprocessed_tweets_info DROP CONSTRAINT IF EXISTS fk_tweet_id;',  # unique keys need tweet_created
+        'ALTER TABLE raw_tweets_info RENAME TO raw_tweets_info_unpartitioned;',
+        'ALTER TABLE preprocessed_tweets_info RENAME TO preprocessed_tweets_info_unpartitioned;',
+        'ALTER TABLE raw_tweets_info_unpartitioned RENAME CONSTRAINT raw_tweets_info_pkey '
+        'TO raw_tweets_info_unpartitioned_pkey;',
+        'ALTER TABLE preprocessed_tweets_info_unpartitioned RENAME CONSTRAINT preprocessed_tweets_info_pkey '
+        'TO preprocessed_tweets_info_unpartitioned_pkey;',
+        """
+        CREATE TABLE raw_tweets_info
+            (
+            pk_id SERIAL,
+            tweet_created TIMESTAMP,
+            conversation_id VARCHAR(30),
+            tweet_id VARCHAR(30),
+            author_id VARCHAR(30),
+            tweet_text TEXT,
+            retweet_count INTEGER,
+            reply_count INTEGER,
+            like_count INTEGER,
+            quote_count INTEGER,
+            row_hash BIGINT,
+            PRIMARY KEY(tweet_id, tweet_created),
+            CONSTRAINT fk_author_id
+                FOREIGN KEY(author_id)
+                    REFERENCES user_info(account_id)
+            ) PARTITION BY RANGE (tweet_created);
+        """,
+        'CREATE TABLE raw_tweets_info_default PARTITION OF raw_tweets_info DEFAULT;',
+        """
+        INSERT INTO raw_tweets_info
+        (pk_id, tweet_created, conversation_id, tweet_id, author_id, tweet_text, retweet_count, reply_count, like_count,
+         quote_count, row_hash)
+            SELECT pk_id, tweet_created, conversation_id, tweet_id, author_id, tweet_text, retweet_count, reply_count,
+                   like_count, quote_count, row_hash
+            FROM raw_tweets_info_unpartitioned
+            WHERE tweet_created IS NOT NULL;
+        """,
+        """
+        CREATE TABLE preprocessed_tweets_info
+            (
+            pk_id SERIAL,
+            tweet_id VARCHAR(30),
+            cleaned_text TEXT,
+            vader_compound FLOAT,
+            text_blob_polarity FLOAT,
+            text_blob_subjectivity FLOAT,
+            tweet_created TIMESTAMP,
+            PRIMARY KEY(tweet_id, tweet_created)
+            ) PARTITION BY RANGE (tweet_created);
+        """,
+        'CREATE TABLE preprocessed_tweets_info_default PARTITION OF preprocessed_tweets_info DEFAULT;',
+        """
+        INSERT INTO preprocessed_tweets_info
+        (pk_id, tweet_id, cleaned_text, vader_compound, text_blob_polarity, text_blob_subjectivity, tweet_created)
+            SELECT old.pk_id, old.tweet_id, old.cleaned_text, old.vader_compound, old.text_blob_polarity,
+                   old.text_blob_subjectivity, raw.tweet_created
+            FROM preprocessed_tweets_info_unpartitioned old
+            JOIN raw_tweets_info raw ON raw.tweet_id = old.tweet_id;
+        """,
+        "SELECT setval(pg_get_serial_sequence('raw_tweets_info', 'pk_id'), COALESCE(MAX(pk_id), 0) + 1, false) "
+        "FROM raw_tweets_info;",
+        "SELECT setval(pg_get_serial_sequence('preprocessed_tweets_info', 'pk_id'), COALESCE(MAX(pk_id), 0) + 1, "
+        "false) FROM preprocessed_tweets_info;",
+        'DROP TABLE preprocessed_tweets_info_unpartitioned;',
+        'DROP TABLE raw_tweets_info_unpartitioned;',
+        'CREATE INDEX raw_tweets_info_tweet_created_idx ON raw_tweets_info (tweet_created);',  # on every partition
+        'CREATE INDEX raw_tweets_info_author_id_tweet_created_idx ON raw_tweets_info (author_id, tweet_created);',
+        'CREATE INDEX raw_tweets_info_conversation_id_idx ON raw_tweets_info (conversation_id);',
+        'CREATE INDEX preprocessed_tweets_info_tweet_created_idx ON preprocessed_tweets_info (tweet_created);',
+    ], True),
+    Migration(4, 'sentiment aggregates, their pending flag and the conversation roots, the first rollup fills them', [
+        QUERIES['sentiment_aggregates']['create_table'],
+        'ALTER TABLE preprocessed_tweets_info ADD COLUMN IF NOT EXISTS aggregated BOOLEAN NOT NULL DEFAULT FALSE;',
+        'CREATE INDEX IF NOT EXISTS preprocessed_tweets_info_pending_idx ON preprocessed_tweets_info (tweet_created) '
+        'WHERE NOT aggregated;',
+        QUERIES['conversation_roots']['create_table'],
+        """
+        INSERT INTO conversation_roots (conversation_id, author_id)
+            SELECT conversation_id, author_id
+            FROM raw_tweets_info
+            WHERE tweet_id = conversation_id
+            ON CONFLICT (conversation_id) DO NOTHING;
+        """,
+    ], True),
+    Migration(5, 'start of the comment window of the conversations deferred by the crawl planner', [
+        'ALTER TABLE conversation_reply_counts ADD COLUMN IF NOT EXISTS pending_since TIMESTAMP;',
+    ], True),
+    Migration(6, 'first_seen of the raw tweets, the upsert tells new tweets by it', [
+        'ALTER TABLE raw_tweets_info ADD COLUMN IF NOT EXISTS first_seen TIMESTAMP DEFAULT NOW();',
+    ], True),
+]
+
+# (name, query, params, index the query is expected to use)
+HOT_QUERIES = [
+    ('preprocessing', """
+    SELECT tweet_created, conversation_id, tweet_id, author_id, tweet_text
+    FROM raw_tweets_info
+    WHERE tweet_created >= NOW() - INTERVAL '1 hour';
+    """, None, 'raw_tweets_info_tweet_created_idx'),
+    ('known conversations of the timeline', """
+    SELECT DISTINCT conversation_id
+    FROM raw_tweets_info
+    WHERE author_id = %s AND tweet_created >= NOW() - INTERVAL '1 day' AND tweet_created <= NOW();
+    """, ('361289499',), 'raw_tweets_info_author_id_tweet_created_idx'),
+    ('dashboard sentiment', """
+    SELECT root_account, interval_start, granularity, tweet_count, vader_compound_sum, text_blob_polarity_sum,
+           text_blob_subjectivity_sum
+    FROM sentiment_aggregates
+    WHERE root_account = %s;
+    """, ('361289499',), 'sentiment_aggregates_pkey'),
+    ('sentiment rollup', QUERIES['sentiment_aggregates']['rollup'], (24,), 'preprocessed_tweets_info_pending_idx'),
+]
+
+_LOCK_ID = 727100                                                           # advisory lock of the migration runner
+_INDEX_NAME = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF NOT EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+schema_version = """
+CREATE TABLE IF NOT EXISTS schema_version
+    (
+    version INTEGER,
+    description TEXT,
+    applied_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(version)
+    );
+"""
+
+
+def _drop_invalid_indexes(cursor, statements):
+    """Drops indexes of the statements left invalid by an interrupted concurrent build, IF NOT EXISTS skips them"""
+    names = [match.group(1) for match in map(_INDEX_NAME.search, statements) if match]
+    if not names:
+        return
+    cursor.execute("""
+    SELECT index_class.relname
+    FROM pg_index
+    JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+    WHERE NOT pg_index.indisvalid AND index_class.relname IN %s;
+    """, (tuple(names),))
+    for name, in cursor.fetchall():
+        print(f'Dropping invalid index {name} left by an interrupted build.')
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name};')
+
+
+def _apply(cursor, migration):
+    """Runs the migration on an autocommit connection and records its version"""
+    record = ('INSERT INTO schema_version (version, description) VALUES (%s, %s);',
+              (migration.version, migration.description))
+    if migration.transactional:
+        cursor.execute('BEGIN;')
+        try:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(*record)
+            cursor.execute('COMMIT;')
+        except (Exception, DatabaseError):
+            cursor.execute('ROLLBACK;')
+            raise
+    else:
+        _drop_invalid_indexes(cursor, migration.statements)
+        for statement in migration.statements:                              # every statement is idempotent
+            cursor.execute(statement)
+        cursor.execute(*record)
+
+
+def migrate(target=None, migrations=MIGRATIONS):
+    """
+    Applies pending migrations in the order of their versions. Runners of several processes are serialized with an
+    advisory lock, so every migration is applied once.
+    :param target: int, last version to apply, None for all of them
+    :param migrations: list of Migration
+    :return: list of int, applied versions
+    """
+    applied = []
+    with db_pool.connection() as connection:
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(schema_version)
+                cursor.execute('SELECT pg_advisory_lock(%s);', (_LOCK_ID,))
+                try:
+                    cursor.execute('SELECT version FROM schema_version;')
+                    done = {version for version, in cursor.fetchall()}
+                    for migration in sorted(migrations, key=lambda migration: migration.version):
+                        if migration.version in done or (target is not None and migration.version > target):
+                            continue
+                        print(f'Applying migration {migration.version}: {migration.description}...')
+                        try:
+                            _apply(cursor, migration)
+                        except (Exception, DatabaseError) as err:
+                            raise Exception(f'Migration {migration.version} failed! ERROR: {err}')
+                        applied.append(migration.version)
+                finally:
+                    cursor.execute('SELECT pg_advisory_unlock(%s);', (_LOCK_ID,))
+        finally:
+            connection.autocommit = False
+    print(f'Schema is up to date, {len(applied)} migrations applied.')
+    return applied
+
+
+def _used_indexes(plan):
+    """Yields names of the indexes in the EXPLAIN (FORMAT JSON) plan"""
+    if 'Index Name' in plan:
+        yield plan['Index Name']
+    for child in plan.get('Plans', ()):
+        yield from _used_indexes(child)
+
+
+def _parent_indexes(cursor, names):
+    """Returns indexes of the partitioned tables the passed partitions' indexes belong to"""
+    if not names:
+        return set()
+    cursor.execute("""
+    SELECT parent.relname
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    WHERE child.relname IN %s;
+    """, (tuple(names),))
+    return {name for name, in cursor.fetchall()}
+
+
+def check_indexes(queries=HOT_QUERIES, force=True):
+    """
+    Checks with EXPLAIN that the hot queries use their indexes
+    :param queries: list of (name, query, params, index)
+    :param force: bool, True to disable sequential scans while explaining, so the check does not depend on the table
+        sizes (planner prefers sequential scans of small tables), False to check the plans the planner picks now
+    :return: dict, {name: (expected index, True if the plan uses it)}
+    """
+    results = {}
+    with db_pool.connection() as connection:
+        with connection.cursor() as cursor:
+            if force:
+                cursor.execute('SET LOCAL enable_seqscan = off;')
+            for name, query, params, index in queries:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {query}', params)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                used = set(_used_indexes(plan[0]['Plan']))
+                used |= _parent_indexes(cursor, used)                       # partitions have their own indexes
+                results[name] = (index, index in used)
+                print(f'{"OK" if index in used else "MISSING"}: {name} -> {index} (plan uses {sorted(used) or "none"})')
+        connection.rollback()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Applies pending schema migrations.')
+    parser.add_argument('--target', type=int, help='last version to apply, all of them by default')
+    parser.add_argument('--check', action='store_true', help='check with EXPLAIN that the hot queries use indexes')
+    args = parser.parse_args()
+    migrate(target=args.target)
+    if args.check and not all(ok for _, ok in check_indexes().values()):
+        raise SystemExit(1)
@@ -0,0 +1,226 @@
+"""
+Maintenance of the monthly tweet partitions: creates the partitions ahead of time, moves rows that landed in the
+default partition to their months and archives the partitions older than the retention to compressed CSV files.
+Usage:
+    python partitioning.py [--months-ahead 1] [--retention-months 12 --archive-dir archive/]
+    python partitioning.py --restore archive/raw_tweets_info/raw_tweets_info_y2021m06.csv.gz --table raw_tweets_info
+A month archived again, e.g. after a backfill brought its tweets back, is saved to a numbered part file next to the
+first archive, <partition>.part1.csv.gz, <partition>.part2.csv.gz, ..., restoring any of them loads all the parts.
+"""
+import os
+import re
+import gzip
+import argparse
+from datetime import datetime
+from db_handler import db_pool
+
+PARTITIONED_TABLES = ('preprocessed_tweets_info', 'raw_tweets_info')      # by month of tweet_created
+_PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+_ARCHIVE_NAME = re.compile(r'^(.*?)(?:\.part(\d+))?\.csv\.gz$')
+
+
+def month_start(moment):
+    """Returns the first moment of the month"""
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, months):
+    """Returns the first moment of the month months later (earlier if negative)"""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    """Returns name of the table's partition of the month, e.g. raw_tweets_info_y2022m06"""
+    return f'{table}_y{month:%Y}m{month:%m}'
+
+
+def partitions(cursor, table):
+    """
+    Lists monthly partitions of the table
+    :return: dict, {month: partition name}, the default partition is not listed
+    """
+    cursor.execute("""
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = %s::regclass;
+    """, (table,))
+    months = {}
+    for name, in cursor.fetchall():
+        match = _PARTITION_NAME.search(name)
+        if match:
+            months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def _create_partition(table, month):
+    """
+    Creates the month's partition in one transaction, rows of the month are moved to it from the default partition
+    first, otherwise the partition could not be attached
+    :return: int, number of moved rows
+    """
+    name = partition_name(table, month)
+    bounds = (month, add_months(month, 1))
+    with db_pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);')
+            cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {table}_default
+                WHERE tweet_created >= %s AND tweet_created < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved;
+            """, bounds)
+            moved = cursor.rowcount
+            cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);', bounds)
+        connection.commit()
+    print(f'Partition {name} has been created, {moved} rows moved from the default partition.')
+    return moved
+
+
+def ensure_partitions(months_ahead=1, tables=PARTITIONED_TABLES):
+    """
+    Creates partitions of the current month, the next months_ahead months and of every month that has rows in the
+    default partition, e.g. old tweets of a backfill
+    :param months_ahead: int, number of future months
+    :param tables: tuple, partitioned tables
+    :return: list of created partitions
+    """
+    current = month_start(datetime.now())
+    created = []
+    for table in tables:
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                existing = partitions(cursor, table)
+                cursor.execute(f"""
+                SELECT DISTINCT date_trunc('month', tweet_created)
+                FROM {table}_default;
+                """)
+                months = {month for month, in cursor.fetchall()}
+        months.update(add_months(current, offset) for offset in range(months_ahead + 1))
+        for month in sorted(months - existing.keys()):
+            _create_partition(table, month)
+            created.append(partition_name(table, month))
+    return created
+
+
+def _archive_path(directory, name):
+    """Returns path of a new archive file of the partition, existing archives of the partition are never overwritten"""
+    path = os.path.join(directory, f'{name}.csv.gz')
+    part = 0
+    while os.path.exists(path):
+        part += 1
+        path = os.path.join(directory, f'{name}.part{part}.csv.gz')
+    return path
+
+
+def archive_parts(path):
+    """
+    Lists archive files of the partition the file belongs to
+    :param path: str, the partition's archive or any of its part files
+    :return: list, existing files, the first archive first and then the parts in the order they were written
+    """
+    match = _ARCHIVE_NAME.match(path)
+    if match is None:
+        raise Exception(f'ERROR: {path} is not an archived partition.')
+    base = match.group(1)
+    parts = [f'{base}.csv.gz'] if os.path.exists(f'{base}.csv.gz') else []
+    part = 1
+    while os.path.exists(f'{base}.part{part}.csv.gz'):
+        parts.append(f'{base}.part{part}.csv.gz')
+        part += 1
+    return parts
+
+
+def archive_partitions(retention_months, archive_dir, tables=PARTITIONED_TABLES):
+    """
+    Detaches partitions of the months older than the retention, their rows are saved to gzipped CSV files with header
+    before the partitions are dropped, see restore_archive
+    :param retention_months: int, number of past months kept in db besides the current one
+    :param archive_dir: str, directory of the archive, files are saved to <archive_dir>/<table>/<partition>.csv.gz,
+        or to <partition>.partN.csv.gz if the month was archived before
+    :param tables: tuple, partitioned tables
+    :return: list of archived files
+    """
+    cutoff = add_months(month_start(datetime.now()), -retention_months)
+    archived = []
+    for table in tables:
+        directory = os.path.join(archive_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        with db_pool.connection() as connection:
+            with connection.cursor() as cursor:
+                expired = sorted((month, name) for month, name in partitions(cursor, table).items() if month < cutoff)
+        for month, name in expired:
+            path = _archive_path(directory, name)
+            with db_pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as file:
+                        cursor.copy_expert(f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER);', file)
+                    os.replace(f'{path}.tmp', path)                        # the file is complete before the drop
+                    cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name};')
+                    cursor.execute(f'DROP TABLE {name};')
+                connection.commit()
+            print(f'Partition {name} has been archived to {path}.')
+            archived.append(path)
+    return archived
+
+
+def restore_archive(path, table):
+    """
+    Loads an archived partition back with all its part files in one transaction, its month's partition is created by
+    the next ensure_partitions. A tweet archived in several parts is restored from the latest one.
+    :param path: str, gzipped CSV file written by archive_partitions, any part of the partition
+    :param table: str, partitioned table
+    :return: list of restored files
+    """
+    parts = archive_parts(path)
+    if not parts:
+        raise Exception(f'ERROR: {path} does not exist.')
+    staging = f'_restore_{table}'
+    with db_pool.connection() as connection:
+        with connection.cursor() as cursor:
+            for part in reversed(parts):                                    # latest first, it wins the conflicts
+                with gzip.open(part, 'rt', encoding='utf-8') as file:
+                    columns = file.readline().strip()
+                    cursor.execute(f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} '
+                                   f'WITH NO DATA;')
+                    cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv);', file)
+                cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} '
+                               f'ON CONFLICT (tweet_id, tweet_created) DO NOTHING;')
+                cursor.execute(f'DROP TABLE {staging};')
+        connection.commit()
+    ensure_partitions(months_ahead=0, tables=(table,))
+    print(f'{", ".join(parts)} has been restored to {table}.')
+    return parts
+
+
+def maintain_partitions(months_ahead=1, retention_months=0, archive_dir=None):
+    """
+    Creates upcoming partitions and archives the expired ones, runs daily
+    :param months_ahead: int, number of future months with partitions
+    :param retention_months: int, number of past months kept in db, 0 to keep all of them
+    :param archive_dir: str, directory of the archive
+    """
+    ensure_partitions(months_ahead)
+    if retention_months:
+        if not archive_dir:
+            raise Exception('ERROR: retention needs an archive directory.')
+        archive_partitions(retention_months, archive_dir)
+
+
+if __name__ == '__main__':
+    from config import PARTITION_MONTHS_AHEAD, TWEETS_RETENTION_MONTHS, ARCHIVE_DIR
+
+    parser = argparse.ArgumentParser(description='Maintains monthly partitions of the tweet tables.')
+    parser.add_argument('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD, help='future months')
+    parser.add_argument('--retention-months', type=int, default=TWEETS_RETENTION_MONTHS, help='0 to keep all')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='directory of the archived partitions')
+    parser.add_argument('--restore', help='archived partition file to load back')
+    parser.add_argument('--table', choices=PARTITIONED_TABLES, help='table of the restored partition')
+    args = parser.parse_args()
+    if args.restore:
+        restore_archive(args.restore, args.table)
+    else:
+        maintain_partitions(args.months_ahead, args.retention_months, args.archive_dir)
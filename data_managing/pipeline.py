@@ -0,0 +1,157 @@
+import time
+import queue
+import threading
+
+_STOP = object()                                                            # tells a worker to exit
+
+
+class _Stage:
+    """Bounded queue and the workers consuming it."""
+
+    def __init__(self, name, func, workers, maxsize, index=0):
+        self.name = name
+        self.index = index                                                  # position in the pipeline
+        self.func = func
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.threads = [threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True) for i in range(workers)]
+        self.next = None
+        self.pipeline = None
+        self.processed = 0
+        self.busy = 0                                                       # seconds spent in func
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)                                                # blocks while the queue is full
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self.pipeline.failed(self.index):                        # items behind the failed one are drained
+                    continue
+                start = time.perf_counter()
+                result = self.func(item)
+                with self._lock:
+                    self.busy += time.perf_counter() - start
+                    self.processed += 1
+                if result is not None and self.next is not None:
+                    self.next.put(result)
+            except Exception as err:
+                self.pipeline.fail(err, self.index)
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """
+    Chain of stages connected with bounded queues, every stage runs on its own worker threads. A full queue blocks
+    the stage feeding it (backpressure), so the throughput is bounded by the slowest stage and memory stays bounded.
+    A stage's func returns the item for the next stage, or None to pass nothing on. The first error of any stage is
+    raised by every following put() and join(), so every producer fails. Items that were already past the failed
+    stage are still processed, the ones behind it are drained without work, so nothing submitted after the failed item
+    is written before it (e.g. a page's checkpoint past a page that was lost).
+    Example:
+    ```py
+        pipeline = Pipeline([('parse', parse, 1), ('write', write, 1)], maxsize=8)
+        pipeline.start()
+        for page in pages:
+            pipeline.put(page)                                      # blocks if the parser is 8 pages behind
+        pipeline.join()                                             # waits until every page is written
+        print(pipeline.stats())
+        pipeline.close()
+    ```
+    """
+    def __init__(self, stages, maxsize=8):
+        """
+        Constructor
+        :param stages: list of (name, func, workers)
+        :param maxsize: int, max number of items waiting in front of each stage
+        """
+        self._stages = [_Stage(name, func, workers, maxsize, index)
+                        for index, (name, func, workers) in enumerate(stages)]
+        for stage, next_stage in zip(self._stages, self._stages[1:]):
+            stage.next = next_stage
+        for stage in self._stages:
+            stage.pipeline = self
+        self.error = None
+        self._failed_at = -1                                                # index of the last failed stage
+        self._lock = threading.Lock()
+        self._started = None
+
+    def start(self):
+        """Starts the workers"""
+        self._started = time.perf_counter()
+        for stage in self._stages:
+            for thread in stage.threads:
+                thread.start()
+
+    def fail(self, err, index=0):
+        """
+        Records the first error, items waiting in front of the failed stage and the stages before it are drained
+        without work from now on
+        :param err: Exception, error of the stage
+        :param index: int, index of the failed stage
+        """
+        with self._lock:
+            if self.error is None:
+                self.error = err
+            self._failed_at = max(self._failed_at, index)
+
+    def failed(self, index):
+        """Checks if the stage has to drain its items without work"""
+        return index <= self._failed_at
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error                                                # the pipeline stays failed
+
+    def put(self, item):
+        """
+        Feeds the first stage, blocks while its queue is full
+        :param item: item passed to the first stage's func
+        """
+        self._raise()
+        self._stages[0].put(item)
+
+    def join(self):
+        """Waits until every item went through all the stages"""
+        for stage in self._stages:
+            stage.queue.join()
+        self._raise()
+
+    def close(self):
+        """
+        Stops the workers once the queues are drained, stage by stage, so a stage's workers exit only after every
+        worker feeding them did, i.e. no result lands behind the stop of its stage and no worker is left blocked on a
+        full queue nobody reads
+        """
+        for stage in self._stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
+
+    def stats(self):
+        """
+        Per stage summary
+        :return: dict, {stage: {'depth', 'max_depth', 'processed', 'busy', 'per_sec'}}, per_sec is the stage's
+            throughput since start, busy is the share of the time its workers were working
+        """
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        stats = {}
+        for stage in self._stages:
+            with stage._lock:
+                stats[stage.name] = {
+                    'depth': stage.queue.qsize(),
+                    'max_depth': stage.max_depth,
+                    'processed': stage.processed,
+                    'busy': stage.busy / (elapsed * len(stage.threads)) if elapsed else 0,
+                    'per_sec': stage.processed / elapsed if elapsed else 0,
+                }
+        return stats
@@ -289,7 +289,7 @@ def text_blob_analysis(dataframe):
 
 
 def columns_to_keep(dataframe):
-    columns = ['tweet_id', 'text', 'vader_compound', 'text_blob_sentiment', 'text_blob_subjectivity']
+    columns = ['tweet_id', 'text', 'vader_compound', 'text_blob_sentiment', 'text_blob_subjectivity', 'tweet_created']
     return dataframe[columns]
 
 
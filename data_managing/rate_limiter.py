@@ -0,0 +1,156 @@
+import time
+import threading
+
+# endpoint: (requests per window, window in seconds)
+# https://developer.twitter.com/en/docs/twitter-api/rate-limits
+TWITTER_LIMITS = {
+    'user_timeline': (1500, 15*60),                                         # GET /2/users/:id/tweets
+    'search_recent': (450, 15*60),                                          # GET /2/tweets/search/recent
+    'tweets_lookup': (300, 15*60),                                          # GET /2/tweets
+    'users_lookup': (300, 15*60),                                           # GET /2/users/by
+}
+# https://min-api.cryptocompare.com/pricing
+# NOTE: only a local throttle, the bucket lives in the process' memory, so it starts full after every restart and is
+#       not shared with the other processes using the key (e.g. btc_gaps.py). The monthly quota itself is counted by
+#       CryptoCompare, a request over it fails with a bad response.
+CRYPTOCOMPARE_LIMITS = {
+    'cryptocompare': (100000, 31*24*60*60),                                 # free calls per month
+}
+
+
+class _Bucket:
+    """Budget of a single endpoint."""
+    __slots__ = ('capacity', 'period', 'remaining', 'reset_at', 'in_flight', 'slept')
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.remaining = capacity
+        self.reset_at = time.time() + period
+        self.in_flight = 0                                                  # acquired, but not answered yet
+        self.slept = 0                                                      # total seconds spent waiting
+
+    def refill(self, now):
+        """Starts a new window once the reset time has passed"""
+        if now >= self.reset_at:
+            self.remaining = self.capacity - self.in_flight
+            self.reset_at = now + self.period
+
+
+class RateLimiter:
+    """
+    Token bucket per endpoint, synchronized with the "x-rate-limit-*" headers returned by the API.
+    Requests are spent locally, and every response corrects the local budget with the real quota state, so callers
+    sleep only until the real reset time and only when the budget is actually exhausted. Thread-safe.
+    Example:
+    ```py
+        limiter = RateLimiter(TWITTER_LIMITS)
+        limiter.acquire('search_recent')                    # blocks only if the budget is exhausted
+        response = requests.get(...)
+        limiter.update('search_recent', response.headers)
+    ```
+    """
+    def __init__(self, limits, margin=1):
+        """
+        Constructor
+        :param limits: dict, {endpoint: (requests per window, window in seconds)}
+        :param margin: int, number of requests kept in reserve, just to be safe
+        """
+        self.margin = margin
+        self._buckets = {endpoint: _Bucket(capacity, period) for endpoint, (capacity, period) in limits.items()}
+        self._condition = threading.Condition()
+
+    def add_endpoint(self, endpoint, capacity, period):
+        """Registers a new endpoint budget"""
+        with self._condition:
+            self._buckets[endpoint] = _Bucket(capacity, period)
+
+    def _take(self, bucket, now):
+        """Takes one request of the bucket if there is budget left, the condition has to be held"""
+        bucket.refill(now)
+        if bucket.remaining > self.margin:
+            bucket.remaining -= 1
+            bucket.in_flight += 1
+            return True
+        return False
+
+    def try_acquire(self, endpoint):
+        """
+        Reserves one request of the endpoint's budget without waiting
+        :param endpoint: str, endpoint name
+        :return: bool, False if the budget is exhausted
+        """
+        with self._condition:
+            return self._take(self._buckets[endpoint], time.time())
+
+    def acquire(self, endpoint):
+        """
+        Reserves one request of the endpoint's budget, sleeps until the reset time if the budget is exhausted.
+        :param endpoint: str, endpoint name
+        """
+        bucket = self._buckets[endpoint]
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._take(bucket, now):
+                    return
+                wait = max(bucket.reset_at - now, 0) + 1                    # +1 to be sure the window has reset
+                print(f'Rate limit of "{endpoint}" has been reached, sleeping for {wait:.0f} sec.')
+                self._condition.wait(wait)
+                bucket.slept += time.time() - now
+
+    def update(self, endpoint, headers=None):
+        """
+        Releases the reserved request and synchronizes the budget with the rate limit headers, if they are present.
+        :param endpoint: str, endpoint name
+        :param headers: dict-like, response headers
+        """
+        bucket = self._buckets[endpoint]
+        with self._condition:
+            bucket.in_flight = max(bucket.in_flight - 1, 0)
+            headers = headers or {}
+            limit = headers.get('x-rate-limit-limit')
+            remaining = headers.get('x-rate-limit-remaining')
+            reset = headers.get('x-rate-limit-reset')
+            if limit is not None:
+                bucket.capacity = int(limit)
+            if remaining is not None:
+                bucket.remaining = int(remaining) - bucket.in_flight
+            if reset is not None:
+                bucket.reset_at = int(reset)
+            self._condition.notify_all()
+
+    def exhaust(self, endpoint, headers=None):
+        """
+        Marks the endpoint's budget as exhausted ("Too Many Requests"), next acquire() sleeps until the reset time.
+        :param endpoint: str, endpoint name
+        :param headers: dict-like, response headers
+        """
+        bucket = self._buckets[endpoint]
+        with self._condition:
+            bucket.remaining = 0
+            reset = (headers or {}).get('x-rate-limit-reset')
+            if reset is not None:
+                bucket.reset_at = int(reset)
+            elif bucket.reset_at <= time.time():
+                bucket.reset_at = time.time() + bucket.period
+
+    def remaining(self, endpoint):
+        """Returns number of requests left in the current window"""
+        bucket = self._buckets[endpoint]
+        with self._condition:
+            bucket.refill(time.time())
+            return bucket.remaining
+
+    def reset_in(self, endpoint):
+        """Returns seconds left until the endpoint's window resets"""
+        bucket = self._buckets[endpoint]
+        with self._condition:
+            return max(bucket.reset_at - time.time(), 0)
+
+    def slept(self, endpoint=None):
+        """Returns seconds spent sleeping on the endpoint, or on all endpoints"""
+        with self._condition:
+            if endpoint is not None:
+                return self._buckets[endpoint].slept
+            return sum(bucket.slept for bucket in self._buckets.values())
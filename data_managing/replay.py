@@ -0,0 +1,178 @@
+import gzip
+import json
+import math
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+VOLATILE_PARAMS = ('start_time', 'end_time', 'since_id', 'toTs')           # change every run, ignored when matching
+SKIPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection', 'date', 'server')
+
+
+def request_key(url):
+    """
+    Key the recorded response is replayed for: path and query without the time window parameters
+    :param url: str, url or path with query
+    :return: str, e.g. '/2/users/123/tweets?max_results=100&pagination_token=...'
+    """
+    parts = urlsplit(url)
+    params = sorted((key, value) for key, value in parse_qsl(parts.query) if key not in VOLATILE_PARAMS)
+    return f'{parts.path}?{urlencode(params)}'
+
+
+class ResponseRecorder:
+    """
+    HttpClient hook saving every response with its headers to gzipped JSONL, to be replayed by StubApiServer later.
+    Thread-safe.
+    Example:
+    ```py
+        recorder = ResponseRecorder('hourly_run.jsonl.gz')
+        http_client.add_hook(recorder)
+        ...                                                         # run the extractors
+        recorder.close()
+    ```
+    """
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: str, file the responses are appended to
+        """
+        self.path = path
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, response, latency):
+        record = {
+            'url': response.url,
+            'status': response.status_code,
+            'headers': dict(response.headers),
+            'body': response.text,
+            'latency': latency,
+            'recorded_at': time.time(),
+        }
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        """Flushes and closes the file"""
+        with self._lock:
+            self._file.close()
+
+
+def load_recordings(path):
+    """
+    Reads responses saved by ResponseRecorder
+    :param path: str, gzipped JSONL file
+    :return: list of dicts
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answers GET requests with the recorded responses."""
+    protocol_version = 'HTTP/1.1'                                           # keep-alive, as the real api
+
+    def do_GET(self):
+        status, headers, body = self.server.stub.respond(self.path)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubApiServer:
+    """
+    Local HTTP server replaying recorded responses, so the extractors could be run and benchmarked without network or
+    credentials. Responses are matched by path and query (time window parameters are ignored), so pagination tokens
+    lead to the recorded next pages. Responses of the same request are replayed in the recorded order, the last one
+    is repeated afterwards; requests that were never recorded get a recorded response of the same path, or 404.
+    Rate limit reset times are shifted to the replay time and scaled by time_scale, "Too Many Requests" responses are
+    replayed as they were.
+    Example:
+    ```py
+        stub = StubApiServer(load_recordings('hourly_run.jsonl.gz'), time_scale=0.01)
+        stub.start()
+        extractor = TweetRetriever(..., base_url=stub.base_url)
+        ...
+        stub.stop()
+    ```
+    """
+    def __init__(self, recordings, host='127.0.0.1', port=0, time_scale=1.0):
+        """
+        Constructor
+        :param recordings: list of dicts, see load_recordings
+        :param host: str, host to listen on
+        :param port: int, port to listen on, 0 for any free port
+        :param time_scale: float, multiplier of the rate limit windows, e.g. 0.01 to wait 9 sec instead of 15 min
+        """
+        self.time_scale = time_scale
+        self._by_key = {}
+        self._by_path = {}
+        for record in recordings:
+            key = request_key(record['url'])
+            self._by_key.setdefault(key, []).append(record)
+            self._by_path.setdefault(urlsplit(key).path, []).append(record)
+        self._served = {}                                                   # {key: number of responses served}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+        self.requests = 0
+        self.misses = 0
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Starts serving on a background thread, returns base url"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-api', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        """Stops the server"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next(self, key, records):
+        """Returns the next recorded response of the key, repeats the last one when they run out"""
+        with self._lock:
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            self.requests += 1
+        return records[min(served, len(records) - 1)]
+
+    def respond(self, path):
+        """
+        Picks the recorded response for the request
+        :param path: str, request path with query
+        :return: tuple, (status, headers, body)
+        """
+        key = request_key(path)
+        records = self._by_key.get(key)
+        if records is None:
+            with self._lock:
+                self.misses += 1
+            key = urlsplit(key).path
+            records = self._by_path.get(key)
+            if records is None:
+                return 404, {'content-type': 'application/json'}, json.dumps({'title': 'Not Found Error'})
+        record = self._next(key, records)
+        headers = {name: value for name, value in record['headers'].items() if name.lower() not in SKIPPED_HEADERS}
+        for name in headers:
+            if name.lower() == 'x-rate-limit-reset':
+                window = max(int(headers[name]) - record['recorded_at'], 0) * self.time_scale
+                headers[name] = str(math.ceil(time.time() + window))
+        return record['status'], headers, record['body']
@@ -0,0 +1,350 @@
+"""
+Streaming ingestion, tweets are written in micro-batches as they come instead of being polled hourly. They are
+preprocessed by the hourly job of manage.py, text_pipe needs the whole window, see StreamIngestor.
+Usage:
+    python streaming.py [--source twitter | file:events.jsonl | socket:127.0.0.1:9000] [--batch-seconds 5]
+                        [--batch-size 500]
+"""
+import time
+import queue
+import socket
+import argparse
+import threading
+from decoding import loads
+
+FIELDS = {
+    'expansions': 'author_id',
+    'tweet.fields': 'author_id,created_at,conversation_id,in_reply_to_user_id,text,public_metrics',
+    'user.fields': 'name,username,created_at,description,verified,public_metrics',
+}
+
+
+class _RetryableResponse(ConnectionError):
+    """Error response of the stream that is reconnected after, backoff is the first wait in seconds"""
+
+    def __init__(self, message, backoff):
+        super().__init__(message)
+        self.backoff = backoff
+
+
+class FilteredStreamSource:
+    """
+    Events of Twitter's filtered stream, the stream rules are managed on the app. Reconnects with exponential backoff
+    when the connection drops or the stream responds with 5xx or 429, starting at 1, 5 and 60 seconds respectively,
+    as Twitter asks for. Other error responses (e.g. revoked token) fail the source. Keep-alive newlines are skipped.
+    """
+    NETWORK_BACKOFF = 1                                                     # first waits in seconds, doubled after
+    SERVER_ERROR_BACKOFF = 5                                                # every failed reconnect
+    RATE_LIMIT_BACKOFF = 60
+
+    def __init__(self, bearer_token, http_client, base_url='https://api.twitter.com', max_backoff=320):
+        """
+        Constructor
+        :param bearer_token: str, bearer token of the app the rules are set on
+        :param http_client: HttpClient, its session is used for the long-lived connection
+        :param base_url: str, twitter api root
+        :param max_backoff: float, max seconds between reconnects
+        """
+        self.bearer_token = bearer_token
+        self.http_client = http_client
+        self.url = f'{base_url}/2/tweets/search/stream'
+        self.max_backoff = max_backoff
+        self._closed = False
+
+    def __iter__(self):
+        self._closed = False                                                # iterating again reopens a closed source
+        backoff = 0
+        while not self._closed:
+            try:
+                with self.http_client.session.get(self.url, params=FIELDS, stream=True, timeout=(10, 60),
+                                                  headers={'Authorization': f'Bearer {self.bearer_token}'}) as response:
+                    if response.status_code == 429:
+                        raise _RetryableResponse('Too Many Requests', self.RATE_LIMIT_BACKOFF)
+                    if response.status_code >= 500:
+                        raise _RetryableResponse(f'stream responded {response.status_code}',
+                                                 self.SERVER_ERROR_BACKOFF)
+                    if not response:
+                        raise Exception(f'ERROR: stream responded {response.status_code}: {response.text}')
+                    backoff = 0
+                    for line in response.iter_lines():
+                        if self._closed:
+                            return
+                        if line:                                            # empty lines keep the connection alive
+                            yield loads(line)
+            except (ConnectionError, OSError) as err:                       # requests' errors are OSErrors too
+                backoff = min(max(backoff * 2, getattr(err, 'backoff', self.NETWORK_BACKOFF)), self.max_backoff)
+                print(f'Stream disconnected ({err}), reconnecting in {backoff} sec...')
+                time.sleep(backoff)
+
+    def close(self):
+        self._closed = True
+
+
+class FileSource:
+    """
+    Events read from a JSON lines file, one event per line, e.g. recorded stream or a test fixture.
+    With follow, the file is tailed for new lines as they are appended.
+    """
+    def __init__(self, path, follow=False, poll_interval=0.5):
+        """
+        Constructor
+        :param path: str, JSON lines file
+        :param follow: bool, True to wait for new lines at the end of the file
+        :param poll_interval: float, seconds between checks for new lines
+        """
+        self.path = path
+        self.url = f'file:{path}'
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self._closed = False
+
+    def __iter__(self):
+        with open(self.path, 'rb') as file:
+            while not self._closed:
+                line = file.readline()
+                if not line:
+                    if not self.follow:
+                        return
+                    time.sleep(self.poll_interval)
+                elif line.strip():
+                    yield loads(line)
+
+    def close(self):
+        self._closed = True
+
+
+class SocketSource:
+    """Events read from a TCP socket, one JSON event per line, e.g. from a local producer."""
+    def __init__(self, host, port):
+        """
+        Constructor
+        :param host: str, host
+        :param port: int, port
+        """
+        self.address = (host, port)
+        self.url = f'socket:{host}:{port}'
+        self._socket = None
+
+    def __iter__(self):
+        self._socket = socket.create_connection(self.address)
+        with self._socket.makefile('rb') as file:
+            for line in file:
+                if line.strip():
+                    yield loads(line)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+
+
+def build_source(spec, bearer_token=None, http_client=None, base_url='https://api.twitter.com'):
+    """
+    Builds the source from its spec
+    :param spec: str, 'twitter', 'file:<path>', 'file+follow:<path>' or 'socket:<host>:<port>'
+    :param bearer_token: str, needed by twitter source
+    :param http_client: HttpClient, needed by twitter source
+    :param base_url: str, twitter api root
+    :return: source, iterable of events with close()
+    """
+    kind, _, address = spec.partition(':')
+    if kind == 'twitter':
+        return FilteredStreamSource(bearer_token, http_client, base_url=base_url)
+    if kind in ('file', 'file+follow'):
+        return FileSource(address, follow=kind == 'file+follow')
+    if kind == 'socket':
+        host, _, port = address.rpartition(':')
+        return SocketSource(host, int(port))
+    raise Exception(f'ERROR: unknown stream source {spec}.')
+
+
+class StreamIngestor:
+    """
+    Consumes tweet events of a source and loads them in micro-batches: a batch is closed once it has batch_size tweets
+    or its oldest tweet waited batch_seconds, then it goes through the extractor's parser and db writer, so a tweet
+    reaches raw_tweets_info within batch_seconds plus the time of one batch. Batches are not preprocessed, text_pipe
+    only finds parents of short replies and duplicates within the tweets it is given, so the streamed tweets are
+    preprocessed in hourly windows as the polled ones, see manage.preprocess_streamed_tweets.
+    Events are read on a separate thread into a bounded queue, a slow db slows the reading down instead of piling up.
+    A failed source is restarted and a failed batch is retried, both with exponential backoff, so the ingestion does not
+    silently stop while the api or the db is down.
+    Example:
+    ```py
+        ingestor = StreamIngestor(tweet_extractor, FileSource('events.jsonl'), batch_seconds=5)
+        ingestor.run()                                              # until the source ends or stop is called
+    ```
+    """
+    _END = object()
+
+    def __init__(self, extractor, source, batch_seconds=5, batch_size=500, queue_size=10000, retry_seconds=5,
+                 max_retry_seconds=320):
+        """
+        Constructor
+        :param extractor: TweetRetriever, its parser, change filters, landing zone and write buffer are used
+        :param source: iterable of events, {'data': tweet or list of tweets, 'includes': {'users': [...]}}
+        :param batch_seconds: float, max seconds the oldest tweet of a batch waits
+        :param batch_size: int, max tweets in a batch
+        :param queue_size: int, max events read ahead
+        :param retry_seconds: float, first wait before a failed source is restarted or a failed batch is retried
+        :param max_retry_seconds: float, max wait between the retries
+        """
+        self.extractor = extractor
+        self.source = source
+        self.batch_seconds = batch_seconds
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._reader = None
+        self._runner = None
+        self._stopped = threading.Event()
+        self.batches = 0
+        self.tweets = 0
+        self.max_lag = 0
+
+    def _read(self):
+        """
+        Reader thread, puts (received, event) to the queue, restarts the source if it fails. The end is marked with
+        (reader thread, _END).
+        """
+        backoff = self.retry_seconds
+        try:
+            while not self._stopped.is_set():
+                try:
+                    for event in self.source:
+                        if self._stopped.is_set():
+                            return
+                        self._queue.put((time.monotonic(), event))
+                        backoff = self.retry_seconds
+                    return                                                  # the source has ended
+                except Exception as err:
+                    print(f'Stream source failed ({err}), restarting it in {backoff} sec...')
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, self.max_retry_seconds)
+        finally:
+            self._queue.put((threading.current_thread(), self._END))
+
+    def _get(self, timeout=None):
+        """Returns the next (received, event) of the queue, ends of the readers of the previous runs are skipped"""
+        while True:
+            received, event = self._queue.get(timeout=timeout)
+            if event is not self._END or received is self._reader:
+                return received, event
+
+    def _next_batch(self):
+        """
+        Collects the next batch
+        :return: tuple, (received time of the oldest event, list of events, True if the source ended)
+        """
+        received, event = self._get()
+        if event is self._END:
+            return None, [], True
+        events = [event]
+        deadline = received + self.batch_seconds
+        while len(events) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                _, event = self._get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is self._END:
+                return received, events, True
+            events.append(event)
+        return received, events, False
+
+    @staticmethod
+    def _to_page(events):
+        """Merges events into one page, as the timeline and search endpoints return them"""
+        tweets, users = [], []
+        for event in events:
+            data = event.get('data', ())
+            tweets.extend(data if isinstance(data, list) else [data])
+            users.extend(event.get('includes', {}).get('users', ()))
+        return {'data': tweets, 'includes': {'users': users}, 'meta': {'result_count': len(tweets)}}
+
+    def _process(self, received, events):
+        """Writes the batch to db"""
+        parsed = []
+        extractor = self.extractor
+        extractor._submit(('page', self._to_page(events), None, parsed.extend, self.source.url))
+        extractor._drain()
+        extractor._count_extracted(len(parsed))
+        lag = time.monotonic() - received
+        self.batches += 1
+        self.tweets += len(parsed)
+        self.max_lag = max(self.max_lag, lag)
+        print(f'STREAM: batch of {len(parsed)} tweets loaded, oldest waited {lag:.1f} sec.')
+
+    def _retry(self, received, events):
+        """Processes the batch until it is loaded or stop is called, e.g. while the db is down"""
+        backoff = self.retry_seconds
+        while True:
+            try:
+                self._process(received, events)
+                return
+            except Exception as err:
+                if self._stopped.is_set():
+                    raise
+                print(f'STREAM: batch of {len(events)} events failed ({err}), retrying in {backoff} sec...')
+                self.extractor._stop_pipeline()                             # a failed pipeline stays failed
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_retry_seconds)
+                self.extractor._start_pipeline()
+
+    def run(self):
+        """Ingests until the source ends or stop is called, a reader left by a previous run is reused"""
+        self._stopped.clear()
+        if self._reader is None or not self._reader.is_alive():
+            self._reader = threading.Thread(target=self._read, name='stream-reader', daemon=True)
+            self._reader.start()
+        self.extractor._reset_counters()
+        self.extractor._start_pipeline()
+        try:
+            while True:
+                received, events, ended = self._next_batch()
+                if events:
+                    self._retry(received, events)
+                if ended or self._stopped.is_set():
+                    break
+        finally:
+            self.extractor._stop_pipeline()
+            self.extractor._report()
+        print(f'STREAM FINISHED: {self.tweets} tweets in {self.batches} batches, max lag {self.max_lag:.1f} sec.')
+
+    def start(self):
+        """Runs the ingestion on a daemon thread, see run"""
+        self._runner = threading.Thread(target=self.run, name='stream-ingestor', daemon=True)
+        self._runner.start()
+
+    def running(self):
+        """Checks if the ingestion started by start is still running"""
+        return self._runner is not None and self._runner.is_alive()
+
+    def stop(self):
+        """Stops after the current batch"""
+        self._stopped.set()
+        self.source.close()
+
+
+if __name__ == '__main__':
+    from config import STREAM_SOURCE, STREAM_BATCH_SECONDS, STREAM_BATCH_SIZE, BEARER_TOKEN, HTTP_POOL_SIZE, \
+        TWITTER_BASE_URL
+    from http_client import HttpClient
+    from manage import build_tweet_extractor
+
+    parser = argparse.ArgumentParser(description='Loads streamed tweets in micro-batches.')
+    parser.add_argument('--source', default=STREAM_SOURCE or 'twitter',
+                        help='twitter, file:<path>, file+follow:<path> or socket:<host>:<port>')
+    parser.add_argument('--batch-seconds', type=float, default=STREAM_BATCH_SECONDS, help='max wait of a tweet')
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_SIZE, help='max tweets in a batch')
+    args = parser.parse_args()
+    http_client = HttpClient(pool_maxsize=HTTP_POOL_SIZE)
+    stream_source = build_source(args.source, bearer_token=BEARER_TOKEN, http_client=http_client,
+                                 base_url=TWITTER_BASE_URL)
+    ingestor = StreamIngestor(build_tweet_extractor(http_client), stream_source, batch_seconds=args.batch_seconds,
+                              batch_size=args.batch_size)
+    try:
+        ingestor.run()
+    except KeyboardInterrupt:
+        ingestor.stop()
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)              # seconds
+
+
+class _Histogram:
+    """Cumulative histogram in the Prometheus sense."""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+        buckets['+Inf'] = self.count
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+class RunMetrics:
+    """
+    Metrics of a single extraction run, kept up incrementally while the run goes on. At the end of the run they are
+    appended to a JSON lines file (one line per run) and written to a Prometheus text file, e.g. for node_exporter's
+    textfile collector. Request counters and latency histograms of the Prometheus file are cumulative since the start
+    of the process, as Prometheus expects, the rest are gauges of the last run. Thread-safe.
+    Example:
+    ```py
+        metrics = RunMetrics(jsonl_path='metrics/runs.jsonl', prom_path='metrics/extraction.prom')
+        metrics.start()
+        metrics.request('user_timeline', 200, 0.31)                            # for every request
+        metrics.finish(rows_written=1200, db_write_seconds=0.8)               # writes both files
+    ```
+    """
+    def __init__(self, jsonl_path=None, prom_path=None, prefix='tweet_extraction'):
+        """
+        Constructor
+        :param jsonl_path: str, file every run is appended to as a JSON line, None to skip
+        :param prom_path: str, Prometheus text file overwritten after every run, None to skip
+        :param prefix: str, prefix of the Prometheus metric names
+        """
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._total_requests = {}                                           # since the start of the process
+        self._total_latency = {}
+        self.start()
+
+    def start(self):
+        """Resets the metrics at the start of a run"""
+        with self._lock:
+            self._started = time.time()
+            self._requests = {}                                             # {(endpoint, status): count}
+            self._latency = {}                                              # {endpoint: _Histogram}
+
+    def request(self, endpoint, status, latency):
+        """
+        Records a request
+        :param endpoint: str, rate limiter's endpoint name
+        :param status: int, http status
+        :param latency: float, seconds
+        """
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._total_requests[key] = self._total_requests.get(key, 0) + 1
+            self._latency.setdefault(endpoint, _Histogram()).observe(latency)
+            self._total_latency.setdefault(endpoint, _Histogram()).observe(latency)
+
+    def snapshot(self, **gauges):
+        """
+        Returns metrics of the run
+        :param gauges: values measured at the end of the run, e.g. rows_written=1200
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'started': self._started,
+                'duration_seconds': time.time() - self._started,
+                'requests': [{'endpoint': endpoint, 'status': status, 'count': count}
+                             for (endpoint, status), count in sorted(self._requests.items())],
+                'latency_seconds': {endpoint: histogram.to_dict() for endpoint, histogram in self._latency.items()},
+                **gauges,
+            }
+
+    def finish(self, **gauges):
+        """
+        Writes metrics of the run to the files
+        :param gauges: values measured at the end of the run, numbers are exported to Prometheus as gauges
+        :return: dict, see snapshot
+        """
+        snapshot = self.snapshot(**gauges)
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as file:
+                file.write(json.dumps(snapshot, default=str) + '\n')
+        if self.prom_path:
+            tmp_path = f'{self.prom_path}.tmp'
+            with open(tmp_path, 'w') as file:
+                file.write(self.to_prometheus(snapshot))
+            os.replace(tmp_path, self.prom_path)                            # scrapers never see a half written file
+        return snapshot
+
+    def to_prometheus(self, snapshot):
+        """
+        Renders the snapshot in the Prometheus text format, requests and latencies are the process totals
+        :param snapshot: dict, see snapshot
+        :return: str
+        """
+        name = self.prefix
+        with self._lock:
+            requests = sorted(self._total_requests.items())
+            latency = {endpoint: histogram.to_dict() for endpoint, histogram in self._total_latency.items()}
+        lines = [f'# TYPE {name}_requests_total counter']
+        for (endpoint, status), count in requests:
+            lines.append(f'{name}_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines.append(f'# TYPE {name}_request_latency_seconds histogram')
+        for endpoint, histogram in latency.items():
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{name}_request_latency_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{name}_request_latency_seconds_sum{{endpoint="{endpoint}"}} {histogram["sum"]}')
+            lines.append(f'{name}_request_latency_seconds_count{{endpoint="{endpoint}"}} {histogram["count"]}')
+        for key, value in snapshot.items():
+            if key in ('requests', 'latency_seconds') or isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE {name}_{key} gauge')
+            lines.append(f'{name}_{key} {value}')
+        return '\n'.join(lines) + '\n'
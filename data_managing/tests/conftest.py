@@ -0,0 +1,105 @@
+import os
+import sys
+import uuid
+import types
+import importlib
+import pytest
+
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PACKAGE_DIR)                                                 # modules import each other flat
+
+
+class FakeClock:
+    """Time of the rate limiters, waits advance it instead of sleeping"""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def waits(self, limiter):
+        """Makes the limiter's waits advance the clock, returns list the waited seconds are appended to"""
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            self.now += timeout
+
+        limiter._condition.wait = wait
+        return waits
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake time of rate_limiter"""
+    import rate_limiter
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def package_modules(monkeypatch):
+    """
+    Drops the package's imported modules for the test, they are imported again with the test's config and doubles
+    :return: monkeypatch, restores the modules after the test
+    """
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == PACKAGE_DIR:
+            monkeypatch.delitem(sys.modules, name)
+    return monkeypatch
+
+
+@pytest.fixture
+def db_handler(package_modules):
+    """Imports db_handler with a test config, nothing is connected until a query runs. Skipped without psycopg2."""
+    pytest.importorskip('psycopg2')
+    package_modules.setitem(sys.modules, 'config', types.SimpleNamespace(USER=None, DATABASE=None, PASSWORD=None,
+                                                                          PORT=None, HOST=None, DB_POOL_MIN=1,
+                                                                          DB_POOL_MAX=2, BULK_LOAD_ROWS=5000))
+    return importlib.import_module('db_handler')
+
+
+@pytest.fixture
+def data_extraction(db_handler):
+    """Imports data_extraction on top of the test db_handler. Skipped without the extraction's dependencies."""
+    for name in ('pandas', 'tweepy', 'requests'):
+        pytest.importorskip(name)
+    return importlib.import_module('data_extraction')
+
+
+@pytest.fixture
+def database(db_handler, monkeypatch):
+    """
+    db_handler connected to a scratch schema of the TEST_DATABASE_URL database, with the tables created and migrated
+    as by manage.py, the schema is dropped after the test. Tests using it are skipped without the database.
+    :return: module, db_handler
+    """
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    import psycopg2
+    import migrations
+    from db_pool import ConnectionPool
+
+    schema = f'test_{uuid.uuid4().hex[:12]}'
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA {schema};')
+    pool = ConnectionPool(minconn=1, maxconn=2, dsn=url, options=f'-c search_path={schema}')
+    monkeypatch.setattr(db_handler, 'db_pool', pool)
+    monkeypatch.setattr(migrations, 'db_pool', pool)
+    try:
+        for table in db_handler.QUERIES.values():
+            if 'create_table' in table:
+                db_handler.create_table(table['create_table'])
+        migrations.migrate()
+        yield db_handler
+    finally:
+        pool.close()
+        with admin.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA {schema} CASCADE;')
+        admin.close()
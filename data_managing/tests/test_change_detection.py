@@ -0,0 +1,55 @@
+import sys
+import types
+import importlib
+import pytest
+
+VALUES = (3, 4, 5, 6, 7)                                                    # updatable columns of user_info rows
+
+
+def _user(account_id, followers):
+    return ('2020-01-01 00:00:00', account_id, f'name_{account_id}', False, followers, 1, 2, 3)
+
+
+@pytest.fixture
+def change_detection(package_modules):
+    """Imports change_detection on top of an in-memory {account_id: row_hash} table, loads are recorded"""
+    table, loads = {}, []
+
+    def retrieve_data(query, params=None):
+        loads.append(set(params[0]))
+        return [(key, table[key]) for key in params[0] if table.get(key) is not None]
+
+    package_modules.setitem(sys.modules, 'db_handler', types.SimpleNamespace(retrieve_data=retrieve_data))
+    return importlib.import_module('change_detection'), table, loads
+
+
+def test_unchanged_rows_are_filtered(change_detection):
+    module, table, _ = change_detection
+    table['1'] = module.fingerprint(tuple(_user('1', 10)[i] for i in VALUES))
+    table['2'] = module.fingerprint(tuple(_user('2', 10)[i] for i in VALUES))
+    change_filter = module.ChangeFilter('user_info', 'account_id', key_index=1, value_indices=VALUES)
+    changed = change_filter.filter([_user('1', 10), _user('2', 11), _user('3', 10)])
+    assert [row[1] for row in changed] == ['2', '3']
+    assert changed[0][-1] == module.fingerprint(tuple(_user('2', 11)[i] for i in VALUES))
+    assert change_filter.skipped == 1
+
+
+def test_fingerprints_are_learned_only_once_committed(change_detection):
+    module, _, loads = change_detection
+    change_filter = module.ChangeFilter('user_info', 'account_id', key_index=1, value_indices=VALUES)
+    rows = change_filter.filter([_user('1', 10)])
+    assert len(rows) == 1
+    assert change_filter.filter([_user('1', 10)]) == rows                   # not written yet, e.g. the flush failed
+    assert loads == [{'1'}, {'1'}]
+    change_filter.commit(rows)
+    assert change_filter.filter([_user('1', 10)]) == []
+    assert loads == [{'1'}, {'1'}]                                          # answered by the LRU
+
+
+def test_rows_without_row_hash_count_as_changed(database):
+    import change_detection
+    database.insert_to_db([_user('1', 10) + (None,)], database.QUERIES['user_info']['upsert'])
+    change_filter = change_detection.ChangeFilter('user_info', 'account_id', key_index=1, value_indices=VALUES)
+    assert len(change_filter.filter([_user('1', 10)])) == 1
+    assert len(change_filter.filter([_user('1', 10)])) == 1                 # a NULL is not remembered either
+    assert change_filter.skipped == 0
@@ -0,0 +1,58 @@
+import sys
+import types
+import importlib
+from datetime import datetime, timedelta
+import pytest
+
+RETRIEVE = 'SELECT conversation_id, reply_count, last_crawled, pending_since FROM conversation_reply_counts'
+UPSERT = 'INSERT INTO conversation_reply_counts (conversation_id, reply_count, last_crawled, pending_since) VALUES %s'
+
+
+@pytest.fixture
+def planner_module(package_modules):
+    """Imports crawl_planner on top of an in-memory conversation_reply_counts table"""
+    table = {}
+
+    def retrieve_data(query, params=None):
+        return [table[conversation_id] for conversation_id in params[0] if conversation_id in table]
+
+    def insert_to_db(values_list, query):
+        table.update((row[0], row) for row in values_list)
+
+    package_modules.setitem(sys.modules, 'db_handler', types.SimpleNamespace(
+        insert_to_db=insert_to_db, retrieve_data=retrieve_data,
+        QUERIES={'conversation_reply_counts': {'retrieve_all': RETRIEVE, 'upsert': UPSERT}}))
+    return importlib.import_module('crawl_planner'), table
+
+
+def test_conversations_without_new_replies_are_skipped(planner_module):
+    crawl_planner, table = planner_module
+    window_start = datetime.now() - timedelta(hours=1)
+    table['1'] = ('1', 5, window_start, None)
+    planner = crawl_planner.CommentCrawlPlanner()
+    assert planner.plan({'1': 5, '2': 3, '3': 0}, window_start) == [('2', window_start)]
+    assert planner.skipped == 2
+
+
+def test_plan_stops_at_the_request_budget(planner_module):
+    crawl_planner, _ = planner_module
+    window_start = datetime.now() - timedelta(hours=1)
+    planner = crawl_planner.CommentCrawlPlanner(request_budget=3, page_size=100)
+    plan = planner.plan({'small': 30, 'big': 250, 'medium': 90}, window_start)
+    assert plan == [('big', window_start)]                                  # 3 requests, the largest delta first
+    assert planner.deferred == 2
+
+
+def test_deferred_conversation_is_crawled_from_the_first_window_it_missed(planner_module):
+    crawl_planner, table = planner_module
+    first_window = datetime.now().replace(microsecond=0) - timedelta(hours=3)
+    planner = crawl_planner.CommentCrawlPlanner(request_budget=1, page_size=100)
+    for hour in range(2):                                                   # deferred twice behind a larger delta
+        window_start = first_window + timedelta(hours=hour)
+        plan = planner.plan({f'big{hour}': 100, 'late': 50}, window_start)
+        assert plan == [(f'big{hour}', window_start)]
+        planner.commit([conversation_id for conversation_id, _ in plan], window_start + timedelta(hours=1))
+        assert table['late'] == ('late', 0, None, first_window)             # earliest start is kept
+
+    planner = crawl_planner.CommentCrawlPlanner()
+    assert planner.plan({'late': 50}, first_window + timedelta(hours=2)) == [('late', first_window)]
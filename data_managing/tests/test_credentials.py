@@ -0,0 +1,31 @@
+from credentials import Credentials, CredentialPool
+from rate_limiter import RateLimiter
+
+LIMITS = {'search_recent': (450, 15*60)}
+
+
+def _pool():
+    credentials = [Credentials(name, 'key', 'secret', 'token', 'token_secret', f'bearer_{name}') for name in 'ab']
+    limiters = [RateLimiter(LIMITS) for _ in credentials]
+    return CredentialPool(credentials, rate_limiters=limiters), limiters
+
+
+def test_token_answered_429_fails_over_to_the_other_one(clock):
+    pool, _ = _pool()
+    token = pool.acquire('search_recent')
+    pool.update(token, 'search_recent')
+    pool.exhaust(token, 'search_recent', {'x-rate-limit-reset': str(int(clock.now) + 600)})   # Too Many Requests
+    other = pool.acquire('search_recent')
+    assert other.name != token.name
+    assert pool.stats() == {'a': {'requests': 1, 'slept': 0}, 'b': {'requests': 1, 'slept': 0}}
+
+
+def test_exhausted_pool_waits_for_the_earliest_reset(clock):
+    pool, limiters = _pool()
+    waits = [clock.waits(limiter) for limiter in limiters]
+    for token, reset_in in zip(pool.credentials, (600, 30)):
+        pool.exhaust(token, 'search_recent', {'x-rate-limit-reset': str(int(clock.now) + reset_in)})
+    token = pool.acquire('search_recent')
+    assert token.name == 'b'
+    assert waits == [[], [31]]
+    assert pool.slept() == 31
@@ -0,0 +1,102 @@
+import pytest
+from datetime import datetime, timedelta
+
+
+@pytest.fixture
+def extractor(data_extraction):
+    def build(query_max_length):
+        return data_extraction.TweetRetriever(['target'], 'key', 'secret', 'token', 'token_secret', 'bearer',
+                                              http_client=object(), batch_comments=True,
+                                              query_max_length=query_max_length)
+    return build
+
+
+@pytest.mark.parametrize('query_max_length', [60, 128, 512])
+def test_conversation_batches_fit_the_query_and_keep_every_id(extractor, query_max_length):
+    retriever = extractor(query_max_length)
+    conversation_ids = [str(1500000000000000000 + i * 7919) for i in range(50)]
+    batches = retriever._batch_conversations(conversation_ids + conversation_ids[:5])    # duplicates are searched once
+    assert all(len(retriever._conversations_query(batch)) <= query_max_length for batch in batches)
+    assert [conversation_id for batch in batches for conversation_id in batch] == conversation_ids
+    assert len(batches) > 1
+
+
+def test_single_conversation_is_one_query(extractor):
+    retriever = extractor(512)
+    assert retriever._batch_conversations(['1500000000000000000']) == [['1500000000000000000']]
+    assert retriever._conversations_query(['1500000000000000000']) == 'conversation_id:1500000000000000000'
+    assert retriever._batch_conversations([]) == []
+
+
+class FakeCandles:
+    """histohour response of the hours up to to_ts, without the hours the api skips"""
+
+    def __init__(self, to_ts, limit, skipped=()):
+        hours = (datetime.fromtimestamp(to_ts) - timedelta(hours=offset) for offset in range(limit, -1, -1))
+        self.data = [{'time': int(hour.timestamp()), 'high': 2.0, 'low': 1.0, 'open': 1.5, 'volumefrom': 10.0,
+                      'volumeto': 15.0, 'close': 1.8} for hour in hours if hour not in skipped]
+
+    def json(self):
+        return {'Data': {'Data': self.data}}
+
+
+@pytest.fixture
+def btc_extractor(data_extraction):
+    return data_extraction.BtcExtractorCC('key', rate_limiter=object(), http_client=object())
+
+
+def test_btc_gaps_requests_merge_adjacent_hours_and_split_at_max_limit(btc_extractor):
+    start = datetime(2022, 6, 1)
+    max_limit = btc_extractor.MAX_LIMIT
+    gaps = [start + timedelta(hours=offset) for offset in range(max_limit + 5)] + [start + timedelta(days=200)]
+    plan = btc_extractor.plan_requests(gaps)
+    assert plan == [(start + timedelta(days=200), 1),                                   # newest first
+                    (start + timedelta(hours=max_limit + 4), max_limit),
+                    (start + timedelta(hours=4), 5)]
+    assert btc_extractor._ranges(gaps) == [(start, start + timedelta(hours=max_limit + 4)),
+                                           (start + timedelta(days=200), start + timedelta(days=200))]
+    assert btc_extractor.plan_requests([]) == []
+
+
+def test_btc_gaps_skipped_by_the_api_are_recorded_once(btc_extractor, data_extraction, monkeypatch):
+    start = datetime(2022, 6, 1)
+    gaps = [start + timedelta(hours=offset) for offset in (0, 1, 2, 3)]
+    requests, batches = [], []
+    monkeypatch.setattr(btc_extractor, 'find_gaps', lambda start_time, end_time: gaps)
+
+    def get_request(limit, to_ts):
+        requests.append((limit, to_ts))
+        return FakeCandles(to_ts, limit, skipped=(gaps[1], gaps[3]))           # the last hour is not published yet
+    monkeypatch.setattr(btc_extractor, 'get_request', get_request)
+    monkeypatch.setattr(data_extraction, 'insert_many_to_db', lambda query_batches, page_size: batches.append(
+        query_batches))
+
+    assert btc_extractor.fill_gaps() == gaps
+    assert requests == [(3, int(gaps[3].timestamp()))]
+    (hourly_query, rows), (missing_query, missing) = batches[0]
+    assert hourly_query == data_extraction.QUERIES['btc_hourly_info']['upsert']
+    assert [row[0] for row in rows] == ['2022-06-01 00:00:00', '2022-06-01 02:00:00']
+    assert missing_query == data_extraction.QUERIES['btc_missing_hours']['upsert']
+    assert missing == [('2022-06-01 01:00:00',)]                                # between two returned candles
+
+
+def test_btc_gaps_leave_out_recorded_missing_hours(database):
+    start = datetime(2022, 6, 1)
+    database.insert_to_db([(start, 1, 1, 1, 1, 1, 1), (start + timedelta(hours=3), 1, 1, 1, 1, 1, 1)],
+                          query=database.QUERIES['btc_hourly_info']['upsert'])
+    database.insert_to_db([(start + timedelta(hours=1),)], query=database.QUERIES['btc_missing_hours']['upsert'])
+    gaps = database.retrieve_data(database.QUERIES['btc_hourly_info']['gaps'], (start, start + timedelta(hours=4)))
+    assert [hour for hour, in gaps] == [start + timedelta(hours=2), start + timedelta(hours=4)]
+
+
+def test_hourly_runs_leave_backfill_checkpoints_to_the_backfill(database, extractor, monkeypatch):
+    import backfill
+    retriever = extractor(512)
+    database.insert_to_db([('account:1', '2022-06-01T00:00:00Z', '2022-06-01T01:00:00Z', 'a', None),
+                           ('backfill:1', '2022-05-01T00:00:00Z', '2022-05-02T00:00:00Z', 'b', None)],
+                          query=database.QUERIES['pagination_checkpoints']['upsert'])
+    resumed = []
+    monkeypatch.setattr(retriever, '_resume_window', lambda *args, **kwargs: resumed.append(args))
+    retriever._resume_interrupted()
+    assert resumed == [('account', '1', '2022-06-01T00:00:00Z', '2022-06-01T01:00:00Z', None, 'a')]
+    assert backfill.Backfill._interrupted() == {('1', '2022-05-01T00:00:00Z', '2022-05-02T00:00:00Z'): 'b'}
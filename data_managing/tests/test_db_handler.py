@@ -0,0 +1,62 @@
+import pytest
+
+execute_values = pytest.importorskip('psycopg2.extras').execute_values
+
+ROWS = [
+    ('handle_a', 'tab\there'),
+    ('handle_b', 'line\nbreak\r\n'),
+    ('handle_a', 'back\\slash'),                                            # same key, the last one wins the update
+    ('handle_c', None),
+    ('handle_b', 'last \\N of b'),
+]
+
+
+def test_copy_value_escapes_text_format(db_handler):
+    assert db_handler._copy_value('a\tb\nc\rd\\e') == 'a\\tb\\nc\\rd\\\\e'
+    assert db_handler._copy_value(None) == '\\N'
+    assert db_handler._copy_value('\\N') == '\\\\N'                         # the text, not a null
+    assert db_handler._copy_value(True) == 't'
+    assert db_handler._copy_value(0) == '0'
+
+
+@pytest.mark.parametrize('query', [
+    'INSERT INTO t (a, b) VALUES %s;',                                      # no conflict clause
+    'INSERT INTO t (a, b) VALUES %s ON CONFLICT ON CONSTRAINT t_pkey DO NOTHING;',
+    'INSERT INTO t VALUES %s ON CONFLICT (a) DO NOTHING;',                  # no column list
+    'WITH x AS (SELECT 1) INSERT INTO t (a, b) VALUES %s ON CONFLICT (a) DO NOTHING;',
+    'INSERT INTO t (a, b) SELECT a, b FROM s ON CONFLICT (a) DO NOTHING;',
+    'DELETE FROM t WHERE (a, b) IN (VALUES %s);',
+])
+def test_statements_falling_back_to_execute_values_are_not_parsed(db_handler, query):
+    assert db_handler._parse_upsert(query) is None
+
+
+def test_upserts_are_parsed(db_handler):
+    for name in ('user_info', 'raw_tweets_info', 'preprocessed_tweets_info', 'handle_registry', 'conversation_roots'):
+        assert db_handler._parse_upsert(db_handler.QUERIES[name]['upsert']) is not None
+
+
+def _written(db_handler, query, rows, copy):
+    """Writes rows with COPY or one by one with execute_values, returns the table and rolls the write back"""
+    table, columns = db_handler._parse_upsert(query)[:2]
+    with db_handler.db_pool.connection() as connection:
+        with connection.cursor() as cursor:
+            if copy:
+                db_handler._copy_upsert(cursor, query, rows)
+            else:
+                execute_values(cursor, query, rows, page_size=1)            # as if inserted one by one
+            cursor.execute(f'SELECT {columns} FROM {table} ORDER BY 1;')
+            written = cursor.fetchall()
+        connection.rollback()
+    return written
+
+
+@pytest.mark.parametrize('name', ['handle_registry', 'conversation_roots'])   # DO UPDATE and DO NOTHING
+def test_copy_upsert_matches_execute_values(database, name):
+    query = database.QUERIES[name]['upsert']
+    copied = _written(database, query, ROWS, copy=True)
+    assert copied == _written(database, query, ROWS, copy=False)
+    if name == 'handle_registry':
+        assert copied == [('handle_a', 'back\\slash'), ('handle_b', 'last \\N of b'), ('handle_c', None)]
+    else:
+        assert copied == [('handle_a', 'tab\there'), ('handle_b', 'line\nbreak\r\n'), ('handle_c', None)]
@@ -0,0 +1,43 @@
+import sys
+import types
+import importlib
+import pytest
+
+UPSERT = 'INSERT INTO pagination_checkpoints (target_key, window_start, window_end, next_token) VALUES %s'
+DELETE = 'DELETE FROM pagination_checkpoints WHERE (target_key, window_start, window_end) IN (VALUES %s)'
+KEY = (0, 1, 2)
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Replaces db writes with a list of the executed (query, rows), in order"""
+    executed = []
+
+    def insert_many_to_db(batches, page_size=100):
+        executed.extend(batches)
+        return [None] * len(batches)
+
+    monkeypatch.setitem(sys.modules, 'db_handler', types.SimpleNamespace(insert_many_to_db=insert_many_to_db))
+    monkeypatch.delitem(sys.modules, 'db_writer', raising=False)
+    return importlib.import_module('db_writer'), executed
+
+
+def test_finished_checkpoint_is_not_resurrected(written):
+    db_writer, executed = written
+    buffer = db_writer.DbWriteBuffer(flush_rows=1000)
+    buffer.add(DELETE, [('account:1', 's', 'e')], key=KEY)                  # one page window finished
+    buffer.add(UPSERT, [('account:2', 's', 'e', 'token')], key=KEY)         # window of the next account
+    buffer.add(DELETE, [('account:2', 's', 'e')], key=KEY)                  # and its last page
+    buffer.flush()
+    assert executed == [(DELETE, [('account:1', 's', 'e'), ('account:2', 's', 'e')])]
+
+
+def test_last_query_of_the_key_wins(written):
+    db_writer, executed = written
+    buffer = db_writer.DbWriteBuffer(flush_rows=1000)
+    buffer.add(UPSERT, [('account:1', 's', 'e', 'first')], key=KEY)
+    buffer.add(DELETE, [('account:1', 's', 'e')], key=KEY)
+    buffer.add(UPSERT, [('account:1', 's', 'e', 'restarted')], key=KEY)
+    buffer.flush()
+    assert executed == [(UPSERT, [('account:1', 's', 'e', 'restarted')])]
+    assert buffer.stats()['rows'] == 1
@@ -0,0 +1,29 @@
+import json
+import random
+import benchmark_decoding
+from decoding import TweetRow, UserRow, decode_page, payload
+
+
+def test_decode_page_builds_the_rows_of_the_old_parser():
+    random.seed(7)
+    content = benchmark_decoding._fake_page(size=100, users=20)             # authors repeat on the page
+    legacy_tweets, legacy_users = benchmark_decoding._legacy(benchmark_decoding._Response(content))
+    tweets, users, meta = decode_page(json.loads(content))
+    assert [tuple(row) for row in tweets] == legacy_tweets
+    assert [tuple(row) for row in users] == legacy_users
+    assert len(users) == 20
+    assert meta == {'result_count': 100, 'next_token': 'b26v89c19zqg8o3fpz2m'}
+    assert tweets[0].tweet_id == legacy_tweets[0][TweetRow._fields.index('tweet_id')]
+    assert users[0].follower_count == legacy_users[0][UserRow._fields.index('follower_count')]
+
+
+def test_decode_page_without_tweets():
+    assert decode_page({'meta': {'result_count': 0}}) == ([], [], {'result_count': 0})
+
+
+def test_payload_is_parsed_once_and_plain_text_is_empty():
+    page = benchmark_decoding._Response(b'{"title": "Too Many Requests"}')
+    assert payload(page) == {'title': 'Too Many Requests'}
+    page.content = b'{}'
+    assert payload(page) == {'title': 'Too Many Requests'}                  # cached on the response
+    assert payload(benchmark_decoding._Response(b'Too Many Requests')) == {}
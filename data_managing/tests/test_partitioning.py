@@ -0,0 +1,24 @@
+import sys
+import types
+import importlib
+import pytest
+
+
+@pytest.fixture
+def partitioning(monkeypatch):
+    """Imports partitioning without a db"""
+    monkeypatch.setitem(sys.modules, 'db_handler', types.SimpleNamespace(db_pool=None))
+    monkeypatch.delitem(sys.modules, 'partitioning', raising=False)
+    return importlib.import_module('partitioning')
+
+
+def test_archived_month_gets_a_part_file_and_is_restored_with_it(partitioning, tmp_path):
+    name = 'raw_tweets_info_y2021m06'
+    paths = []
+    for _ in range(3):                                                      # month archived, back, archived again...
+        path = partitioning._archive_path(str(tmp_path), name)
+        open(path, 'w').close()
+        paths.append(path)
+    assert [p.split('/')[-1] for p in paths] == [f'{name}.csv.gz', f'{name}.part1.csv.gz', f'{name}.part2.csv.gz']
+    assert partitioning.archive_parts(paths[1]) == paths
+    assert partitioning.archive_parts(paths[0]) == paths
@@ -0,0 +1,61 @@
+import time
+import threading
+import pytest
+from pipeline import Pipeline
+
+
+def test_error_is_sticky_and_items_ahead_of_it_are_written():
+    written = []
+    release = threading.Event()
+
+    def parse(item):
+        if item == 2:
+            raise ValueError('bad page')
+        return item
+
+    def write(item):
+        release.wait(5)
+        written.append(item)
+
+    pipeline = Pipeline([('parse', parse, 1), ('write', write, 1)], maxsize=8)
+    pipeline.start()
+    for item in (1, 2, 3):
+        pipeline.put(item)
+    pipeline._stages[0].queue.join()                                        # 1 parsed, 2 failed, 3 queued behind it
+    release.set()
+    for item in (4, 5):                                                     # every producer fails from now on
+        with pytest.raises(ValueError):
+            pipeline.put(item)
+    with pytest.raises(ValueError):
+        pipeline.join()
+    pipeline.close()
+    assert written == [1]
+
+
+
+def test_close_after_a_stage_raised_writes_what_was_parsed_and_returns():
+    written = []
+    parsing = threading.Event()
+
+    def parse(item):
+        if item == 3:                                                       # still parsing when the pipeline is closed
+            parsing.set()
+            while pipeline.error is None:
+                time.sleep(0.01)
+            time.sleep(0.1)
+        if item == 4:
+            parsing.wait(5)
+            raise ValueError('bad page')
+        return item
+
+    pipeline = Pipeline([('parse', parse, 2), ('write', written.append, 1)], maxsize=1)
+    pipeline.start()
+    for item in range(1, 5):
+        pipeline.put(item)
+    while pipeline.error is None:
+        time.sleep(0.01)
+    closing = threading.Thread(target=pipeline.close)
+    closing.start()
+    closing.join(5)
+    assert not closing.is_alive()
+    assert written == [1, 2, 3]
@@ -0,0 +1,35 @@
+from rate_limiter import RateLimiter
+
+
+def test_budget_follows_the_rate_limit_headers(clock):
+    limiter = RateLimiter({'search_recent': (450, 15*60)})
+    limiter.acquire('search_recent')
+    limiter.update('search_recent', {'x-rate-limit-limit': '180', 'x-rate-limit-remaining': '12',
+                                     'x-rate-limit-reset': str(int(clock.now) + 60)})
+    assert limiter.remaining('search_recent') == 12
+    assert limiter.reset_in('search_recent') == 60
+    clock.now += 61
+    assert limiter.remaining('search_recent') == 180                        # new window of the real limit
+
+
+def test_requests_in_flight_are_not_counted_twice(clock):
+    limiter = RateLimiter({'search_recent': (450, 15*60)})
+    for _ in range(3):
+        limiter.acquire('search_recent')
+    assert limiter.remaining('search_recent') == 447
+    limiter.update('search_recent', {'x-rate-limit-remaining': '100'})     # counts the answered request only
+    assert limiter.remaining('search_recent') == 98                         # 2 are still in flight
+    limiter.update('search_recent')                                         # released without headers
+    limiter.update('search_recent', {'x-rate-limit-remaining': '98'})
+    assert limiter.remaining('search_recent') == 98
+
+
+def test_exhausted_budget_sleeps_until_the_real_reset(clock):
+    limiter = RateLimiter({'search_recent': (450, 15*60)}, margin=1)
+    waits = clock.waits(limiter)
+    limiter.acquire('search_recent')
+    limiter.update('search_recent', {'x-rate-limit-remaining': '1', 'x-rate-limit-reset': str(int(clock.now) + 10)})
+    limiter.acquire('search_recent')                                        # the margin is left, sleeps
+    assert waits == [11]                                                    # the real reset + 1, not the 15 min window
+    assert limiter.slept('search_recent') == 11
+    assert limiter.try_acquire('search_recent')
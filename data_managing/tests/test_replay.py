@@ -0,0 +1,94 @@
+import json
+import time
+import pytest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from replay import ResponseRecorder, StubApiServer, load_recordings, request_key
+
+TIMELINE = 'https://api.twitter.com/2/users/1/tweets'
+
+
+def record(url, body, status=200, headers=None, recorded_at=None):
+    return {'url': url, 'status': status, 'headers': headers or {'content-type': 'application/json'},
+            'body': json.dumps(body), 'latency': 0.1, 'recorded_at': recorded_at or time.time()}
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(recordings, time_scale=1.0):
+        server = StubApiServer(recordings, time_scale=time_scale)
+        server.start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def get(url):
+    """Returns (status, headers, parsed body) of the GET request"""
+    try:
+        with urlopen(url, timeout=5) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except HTTPError as err:
+        return err.code, err.headers, json.loads(err.read())
+
+
+def test_request_key_ignores_the_time_window():
+    assert (request_key(f'{TIMELINE}?start_time=2022-06-01T00:00:00Z&max_results=100&end_time=2022-06-01T01:00:00Z')
+            == '/2/users/1/tweets?max_results=100')
+
+
+def test_stub_follows_the_recorded_next_tokens(stub):
+    server = stub([
+        record(f'{TIMELINE}?max_results=100&start_time=2022-06-01T00:00:00Z', {'meta': {'next_token': 'a'}}),
+        record(f'{TIMELINE}?max_results=100&pagination_token=a', {'meta': {'next_token': 'b'}}),
+        record(f'{TIMELINE}?max_results=100&pagination_token=b', {'meta': {'result_count': 0}}),
+    ])
+    url = f'{server.base_url}/2/users/1/tweets?max_results=100&start_time=2022-07-01T00:00:00Z'
+    pages = []
+    while True:
+        status, _, body = get(url)
+        pages.append((status, body['meta']))
+        if 'next_token' not in body['meta']:
+            break
+        url = f'{server.base_url}/2/users/1/tweets?max_results=100&pagination_token={body["meta"]["next_token"]}'
+    assert pages == [(200, {'next_token': 'a'}), (200, {'next_token': 'b'}), (200, {'result_count': 0})]
+    assert (server.requests, server.misses) == (3, 0)
+    assert get(f'{server.base_url}/2/unknown')[0] == 404
+
+
+def test_stub_replays_too_many_requests_with_shifted_reset(stub):
+    recorded_at = time.time() - 3600
+    limited = {'content-type': 'application/json', 'x-rate-limit-remaining': '0',
+               'x-rate-limit-reset': str(int(recorded_at) + 900)}
+    server = stub([
+        record(f'{TIMELINE}?max_results=100', {'title': 'Too Many Requests'}, status=429, headers=limited,
+               recorded_at=recorded_at),
+        record(f'{TIMELINE}?max_results=100', {'meta': {'result_count': 0}}),
+    ], time_scale=0.01)
+    status, headers, body = get(f'{server.base_url}/2/users/1/tweets?max_results=100')
+    assert (status, body) == (429, {'title': 'Too Many Requests'})
+    assert headers['x-rate-limit-remaining'] == '0'
+    assert time.time() <= int(headers['x-rate-limit-reset']) <= time.time() + 10     # 900 s window scaled by 0.01
+    assert get(f'{server.base_url}/2/users/1/tweets?max_results=100')[0] == 200
+    assert get(f'{server.base_url}/2/users/1/tweets?max_results=100')[0] == 200       # the last one is repeated
+
+
+class FakeResponse:
+    url = f'{TIMELINE}?max_results=100'
+    status_code = 200
+    headers = {'content-type': 'application/json'}
+    text = '{"meta": {"result_count": 0}}'
+
+
+def test_recorded_responses_are_loaded_back(tmp_path):
+    path = str(tmp_path / 'run.jsonl.gz')
+    recorder = ResponseRecorder(path)
+    recorder(FakeResponse(), 0.25)
+    recorder.close()
+    recordings = load_recordings(path)
+    assert [(item['url'], item['status'], item['body'], item['latency']) for item in recordings] == [
+        (FakeResponse.url, 200, FakeResponse.text, 0.25)]
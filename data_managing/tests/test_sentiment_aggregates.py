@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+NOW = datetime.utcnow().replace(microsecond=0)
+OLD = NOW - timedelta(hours=48)
+RECENT = NOW - timedelta(hours=1)
+
+
+def _insert(db_handler, tweets):
+    """Writes users, raw and preprocessed rows of (tweet_id, conversation_id, author_id, tweet_created)"""
+    users = sorted({author_id for _, _, author_id, _ in tweets})
+    db_handler.insert_to_db([(NOW, user, user, False, 0, 0, 0, 0, None) for user in users],
+                            db_handler.QUERIES['user_info']['upsert'])
+    db_handler.insert_to_db([(created, conversation, tweet, author, 'text', 0, 0, 0, 0, None)
+                             for tweet, conversation, author, created in tweets],
+                            db_handler.QUERIES['raw_tweets_info']['upsert'])
+    db_handler.insert_to_db([(tweet, 'text', 0.5, 0.25, 0.5, created) for tweet, _, _, created in tweets],
+                            db_handler.QUERIES['preprocessed_tweets_info']['upsert'])
+
+
+def _pending(db_handler):
+    return {tweet for tweet, in db_handler.retrieve_data(
+        'SELECT tweet_id FROM preprocessed_tweets_info WHERE NOT aggregated;')}
+
+
+def _day_counts(db_handler):
+    return {account: count for account, count in db_handler.retrieve_data(
+        "SELECT root_account, SUM(tweet_count) FROM sentiment_aggregates WHERE granularity = 'day' GROUP BY 1;")}
+
+
+def test_reply_with_unknown_root_leaves_the_pending_set_after_the_wait(database):
+    db_handler = database
+    rollup = db_handler.QUERIES['sentiment_aggregates']['rollup']
+    db_handler.insert_to_db([('10', 'root_author')], db_handler.QUERIES['conversation_roots']['upsert'])
+    _insert(db_handler, [
+        ('11', '10', 'replier', RECENT),                                    # root known
+        ('21', '20', 'target', OLD),                                        # reply in a thread never extracted
+        ('31', '30', 'replier', RECENT),                                    # its root may still come
+    ])
+
+    db_handler.execute_query(rollup, (24,))
+    assert _pending(db_handler) == {'31'}
+    assert _day_counts(db_handler) == {'root_author': 1, 'target': 1}
+
+    db_handler.insert_to_db([('30', 'late_root_author')], db_handler.QUERIES['conversation_roots']['upsert'])
+    db_handler.execute_query(rollup, (24,))
+    db_handler.execute_query(rollup, (24,))                                 # nothing is counted twice
+    assert _pending(db_handler) == set()
+    assert _day_counts(db_handler) == {'root_author': 1, 'target': 1, 'late_root_author': 1}